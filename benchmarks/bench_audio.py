@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark : décodage + rééchantillonnage 16 kHz mono en mémoire (musetalk_audio)
+contre l'ancien chemin `ffmpeg` en subprocess (fichier → fichier).
+
+    python3 benchmarks/bench_audio.py --runs 20 --duration 8
+"""
+
+import argparse
+import io
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import musetalk_audio  # noqa: E402
+
+import av  # noqa: E402
+
+
+def make_fixture(fmt, codec, rate, duration, layout='mono'):
+    """Encode une voix synthétique (sinus modulés + bruit) avec PyAV."""
+    t = np.arange(int(rate * duration)) / rate
+    signal = 0.3 * np.sin(2 * np.pi * 220 * t) * (0.5 + 0.5 * np.sin(2 * np.pi * 3 * t))
+    signal += 0.01 * np.random.default_rng(0).standard_normal(len(t))
+    pcm = (signal * 32767).astype(np.int16)
+
+    buf = io.BytesIO()
+    with av.open(buf, mode='w', format=fmt) as out:
+        stream = out.add_stream(codec, rate=rate, layout=layout)
+        step = 960
+        for i in range(0, len(pcm), step):
+            chunk = pcm[i:i + step]
+            frame = av.AudioFrame.from_ndarray(chunk.reshape(1, -1), format='s16', layout=layout)
+            frame.sample_rate = rate
+            for packet in stream.encode(frame):
+                out.mux(packet)
+        for packet in stream.encode(None):
+            out.mux(packet)
+    return buf.getvalue()
+
+
+def bench(fn, runs):
+    fn()  # chauffe
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return statistics.median(times), times[min(len(times) - 1, int(len(times) * 0.95))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=8.0, help="durée des fixtures (s)")
+    parser.add_argument('--ffmpeg', default=shutil.which('ffmpeg'))
+    args = parser.parse_args()
+
+    fixtures = {
+        'webm/opus 48k (micro)': ('webm', make_fixture('webm', 'libopus', 48000, args.duration)),
+        'mp3 44.1k (TTS)': ('mp3', make_fixture('mp3', 'mp3', 44100, args.duration)),
+        'wav 44.1k': ('wav', make_fixture('wav', 'pcm_s16le', 44100, args.duration)),
+    }
+
+    print(f"{'fixture':<24} {'chemin':<22} {'p50 ms':>8} {'p95 ms':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, (ext, data) in fixtures.items():
+            p50, p95 = bench(lambda: musetalk_audio.decode_to_pcm16k(data), args.runs)
+            print(f"{name:<24} {'in-process (PyAV)':<22} {p50:>8.1f} {p95:>8.1f}")
+
+            if not args.ffmpeg:
+                print(f"{name:<24} {'subprocess ffmpeg':<22} {'n/a':>8} {'n/a':>8}")
+                continue
+
+            src = os.path.join(tmp, f"in.{ext}")
+            dst = os.path.join(tmp, "out.wav")
+
+            def run_ffmpeg():
+                # Reproduit l'ancien chemin : écriture disque + ffmpeg + relecture
+                Path(src).write_bytes(data)
+                subprocess.run([args.ffmpeg, '-y', '-i', src, '-ar', '16000', '-ac', '1',
+                                '-acodec', 'pcm_s16le', dst],
+                               check=True, capture_output=True)
+                Path(dst).read_bytes()
+
+            p50, p95 = bench(run_ffmpeg, args.runs)
+            print(f"{name:<24} {'subprocess ffmpeg':<22} {p50:>8.1f} {p95:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
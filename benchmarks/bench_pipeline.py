@@ -0,0 +1,501 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark de bout en bout hors ligne : `process_chat_with_avatar_local` (via le
+JobScheduler, comme le handler Socket.IO) sur des enregistrements audio, sans
+clé OpenAI / ElevenLabs ni GPU.
+
+- Whisper, GPT et TTS : serveur local stub_providers.py (latences réglables),
+  joint par OPENAI_BASE_URL / ELEVENLABS_API_BASE, avec le vrai HttpClient.
+- MuseTalk : stub_inference.py à la place de scripts.inference
+  (MUSETALK_MODE=subprocess).
+- Backend isolé dans un dossier temporaire (outputs, avatars, résultats).
+
+Rapport : p50 / p95 par étape (spans de TRACE_LOG), CPU du backend et des
+sous-processus, pic de RSS, octets écrits, par tour.
+
+    python3 benchmarks/bench_pipeline.py --runs 10
+    python3 benchmarks/bench_pipeline.py --runs 10 --audio enregistrements/*.webm
+    python3 benchmarks/bench_pipeline.py --runs 20 --save-baseline benchmarks/baselines/default.json
+    python3 benchmarks/bench_pipeline.py --runs 20 --compare benchmarks/baselines/default.json
+
+Avec --compare, le code de sortie vaut 1 si une mesure dépasse la référence de
+plus de --tolerance (et d'un écart absolu minimal), ou si un tour échoue.
+"""
+
+import argparse
+import base64
+import io
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+HERE = Path(__file__).resolve().parent
+ROOT = HERE.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(HERE))
+from stub_providers import add_latency_args  # noqa: E402
+
+import av  # noqa: E402
+
+# Écart absolu en dessous duquel une hausse n'est pas une régression (bruit)
+ABS_FLOOR = {'_ms': 5.0, '_ms_per_job': 5.0, '_bytes_per_job': 64 * 1024, '_mb': 10.0}
+
+
+# ----------  fixtures  ----------
+def make_recording(duration, seed=0, rate=48000, lead=0.4, tail=0.6):
+    """
+    Enregistrement micro synthétique (webm/opus 48 kHz, comme MediaRecorder) :
+    bruit de fond, `duration` s de « syllabes » voisées, puis silence.
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(rate * duration)) / rate
+    pitch = 140 + 60 * rng.random()
+    voice = 0.3 * np.sin(2 * np.pi * pitch * t) * (0.5 + 0.5 * np.sin(2 * np.pi * 4 * t))
+    signal = np.concatenate([np.zeros(int(rate * lead)), voice, np.zeros(int(rate * tail))])
+    signal += 0.003 * rng.standard_normal(len(signal))
+    pcm = (np.clip(signal, -1, 1) * 32767).astype(np.int16)
+
+    buf = io.BytesIO()
+    with av.open(buf, mode='w', format='webm') as out:
+        stream = out.add_stream('libopus', rate=rate, layout='mono')
+        for i in range(0, len(pcm), 960):
+            frame = av.AudioFrame.from_ndarray(pcm[i:i + 960].reshape(1, -1), format='s16', layout='mono')
+            frame.sample_rate = rate
+            for packet in stream.encode(frame):
+                out.mux(packet)
+        for packet in stream.encode(None):
+            out.mux(packet)
+    return buf.getvalue()
+
+
+def make_avatar(seconds=2.0, size=256, fps=25):
+    """Clip avatar mp4 (h264 si disponible, sinon mpeg4)."""
+    codec = 'libx264' if 'libx264' in av.codecs_available else 'mpeg4'
+    buf = io.BytesIO()
+    with av.open(buf, mode='w', format='mp4') as out:
+        stream = out.add_stream(codec, rate=fps)
+        stream.width = stream.height = size
+        stream.pix_fmt = 'yuv420p'
+        yy, xx = np.mgrid[0:size, 0:size]
+        for i in range(int(seconds * fps)):
+            img = np.stack([(xx + i * 4) % 256, (yy + i * 2) % 256, np.full_like(xx, 128)], axis=-1)
+            frame = av.VideoFrame.from_ndarray(img.astype(np.uint8), format='rgb24')
+            for packet in stream.encode(frame):
+                out.mux(packet)
+        for packet in stream.encode(None):
+            out.mux(packet)
+    return buf.getvalue()
+
+
+def load_fixtures(args):
+    """[(nom, octets)] : fichiers --audio, sinon enregistrements synthétiques de --durations."""
+    if args.audio:
+        return [(Path(path).name, Path(path).read_bytes()) for path in args.audio]
+    return [
+        (f"synth_{seconds:g}s.webm", make_recording(seconds, seed=i))
+        for i, seconds in enumerate(float(x) for x in args.durations.split(','))
+    ]
+
+
+# ----------  environnement isolé  ----------
+def start_stub(args):
+    """Lance stub_providers.py dans un process séparé (son CPU n'est pas compté)."""
+    scale = args.latency_scale
+    cmd = [
+        sys.executable, str(HERE / 'stub_providers.py'), '--port', '0',
+        '--whisper-ms', str(args.whisper_ms * scale),
+        '--chat-ttft-ms', str(args.chat_ttft_ms * scale),
+        '--chat-token-ms', str(args.chat_token_ms * scale),
+        '--tts-ttfb-ms', str(args.tts_ttfb_ms * scale),
+        '--tts-realtime', str(args.tts_realtime / scale if scale else 0),
+        '--speech-ms-per-char', str(args.speech_ms_per_char),
+        '--transcript', args.transcript,
+        '--reply', args.reply,
+    ]
+    if args.same_reply:
+        cmd.append('--same-reply')
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    line = proc.stdout.readline()
+    if not line.strip().isdigit():
+        proc.kill()
+        raise RuntimeError("stub_providers.py n'a pas démarré")
+    return proc, int(line)
+
+
+def prepare_env(work, port, args):
+    """
+    Variables lues par le backend à l'import. Comme en production (/app),
+    MUSETALK_DIR est le dossier courant du backend : les chemins relatifs
+    passés à scripts.inference (ici le stub) restent valides.
+    """
+    musetalk_dir = work
+    (musetalk_dir / 'scripts').mkdir(parents=True)
+    (musetalk_dir / 'scripts' / '__init__.py').write_text('')
+    shutil.copyfile(HERE / 'stub_inference.py', musetalk_dir / 'scripts' / 'inference.py')
+
+    scale = args.latency_scale
+    base = f"http://127.0.0.1:{port}"
+    os.environ.update({
+        'OPENAI_API_KEY': 'bench',
+        'OPENAI_BASE_URL': f"{base}/v1",
+        'ELEVENLABS_API_KEY': 'bench' if args.provider == 'elevenlabs' else '',
+        'ELEVENLABS_API_BASE': base,
+        'NO_PROXY': '127.0.0.1,localhost',
+        'MUSETALK_MODE': 'subprocess',
+        'MUSETALK_DIR': str(musetalk_dir),
+        'MUSETALK_INFERENCE_SLOTS': str(args.slots),
+        'JOB_IO_WORKERS': str(max(4, args.concurrency)),
+        'JOB_MAX_QUEUE': str(max(8, args.concurrency)),
+        'PUBLISH_SINKS': 'local',
+        'PUBLISH_LOCAL_DIR': str(work / 'exports'),
+        'TRACE_LOG': str(work / 'outputs' / 'traces.jsonl'),
+        'BENCH_INFERENCE_MS': str(args.inference_ms * scale),
+        'BENCH_INFERENCE_RTF': str(args.inference_rtf * scale),
+        'BENCH_VIDEO_KBPS': str(args.video_kbps),
+        # `python3 -m scripts.inference` : même interpréteur que le benchmark
+        'PATH': os.path.dirname(sys.executable) + os.pathsep + os.environ.get('PATH', ''),
+    })
+
+
+def load_backend(work, args):
+    os.chdir(work)  # OUTPUT_DIR, AVATARS_DIR… sont relatifs au dossier courant
+    import musetalk_backend_optimized as backend
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    return backend
+
+
+# ----------  mesures  ----------
+def tree_bytes(root):
+    """Octets des fichiers sous `root` (liens durs comptés une fois)."""
+    seen, total = set(), 0
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            try:
+                st = os.lstat(os.path.join(dirpath, name))
+            except OSError:
+                continue
+            if (st.st_dev, st.st_ino) not in seen:
+                seen.add((st.st_dev, st.st_ino))
+                total += st.st_size
+    return total
+
+
+def proc_io():
+    """/proc/self/io (Linux) : wchar = octets passés à write(), disque ou non."""
+    try:
+        with open('/proc/self/io') as f:
+            return {k: int(v) for k, v in (line.split(':') for line in f)}
+    except OSError:
+        return {}
+
+
+def reset_peak_rss():
+    """Remet VmHWM à la RSS courante (Linux ≥ 4.0) ; False si indisponible."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def cpu_seconds(who):
+    usage = resource.getrusage(who)
+    return usage.ru_utime + usage.ru_stime
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+# ----------  exécution  ----------
+def run_jobs(backend, fixtures, avatar_b64, args, label, count):
+    """Soumet `count` tours au scheduler, au plus `concurrency` à la fois."""
+    voice_id = args.voice_id or ('alloy' if args.provider == 'openai' else 'EXAVITQu4vr4xnSDxMaL')
+    pending = []
+    for i in range(count):
+        name, data = fixtures[i % len(fixtures)]
+        while len(pending) >= args.concurrency:
+            pending = [job for job in pending if job.finished_at is None]
+            time.sleep(0.005)
+        pending.append(backend.scheduler.submit(
+            f"{label}-{i}",
+            backend.process_chat_with_avatar_local,
+            f"{label}-{i}",
+            base64.b64encode(data).decode('ascii'),
+            avatar_b64,
+            'avatar.mp4',
+            'video/mp4',
+            None,
+            None,
+            args.provider,
+            voice_id,
+            [],
+            0,
+            args.pipelined,
+        ))
+    while any(job.finished_at is None for job in pending):
+        time.sleep(0.005)
+    # Publication asynchrone : ses écritures font partie du tour
+    deadline = time.time() + 30
+    while backend.publisher.stats()['pending'] and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def summarize(records):
+    """Traces → {étape: durées par tour (ms)} dans l'ordre d'apparition ; plusieurs spans du même nom sont sommés."""
+    stages, order = {}, {}
+    for record in records:
+        per_job = {}
+        for s in record.get('spans', []):
+            per_job[s['name']] = per_job.get(s['name'], 0.0) + s['duration_ms']
+            order.setdefault(s['name'], s['start_ms'])
+        for name, ms in per_job.items():
+            stages.setdefault(name, []).append(ms)
+    stages = {name: stages[name] for name in sorted(stages, key=order.get)}
+    stages['job'] = [record['duration_ms'] for record in records]
+    return {
+        name: {
+            'n': len(values),
+            'p50_ms': round(statistics.median(values), 1),
+            'p95_ms': round(percentile(values, 0.95), 1),
+            'mean_ms': round(statistics.mean(values), 1),
+        }
+        for name, values in stages.items()
+    }
+
+
+def scenario(args, fixtures):
+    return {
+        'runs': args.runs,
+        'warmup': args.warmup,
+        'concurrency': args.concurrency,
+        'slots': args.slots,
+        'pipelined': args.pipelined,
+        'provider': args.provider,
+        'fixtures': [name for name, _ in fixtures],
+        'latency_scale': args.latency_scale,
+        'whisper_ms': args.whisper_ms,
+        'chat_ttft_ms': args.chat_ttft_ms,
+        'chat_token_ms': args.chat_token_ms,
+        'tts_ttfb_ms': args.tts_ttfb_ms,
+        'tts_realtime': args.tts_realtime,
+        'speech_ms_per_char': args.speech_ms_per_char,
+        'same_reply': args.same_reply,
+        'inference_ms': args.inference_ms,
+        'inference_rtf': args.inference_rtf,
+        'video_kbps': args.video_kbps,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark(args):
+    fixtures = load_fixtures(args)
+    avatar_b64 = base64.b64encode(make_avatar()).decode('ascii')
+    work = Path(tempfile.mkdtemp(prefix='musetalk-bench-'))
+    stub, port = start_stub(args)
+    cwd = os.getcwd()
+    try:
+        prepare_env(work, port, args)
+        backend = load_backend(work, args)
+        events = Counter()
+        # Pas de client Socket.IO : les événements sont seulement comptés
+        backend.socketio.emit = lambda event, *a, **kw: events.update([event])
+
+        run_jobs(backend, fixtures, avatar_b64, args, 'warmup', args.warmup)
+        events.clear()
+
+        rss_scope = 'runs' if reset_peak_rss() else 'process'
+        bytes_before, io_before = tree_bytes(work), proc_io()
+        cpu_before = cpu_seconds(resource.RUSAGE_SELF), cpu_seconds(resource.RUSAGE_CHILDREN)
+        start = time.perf_counter()
+        run_jobs(backend, fixtures, avatar_b64, args, 'bench', args.runs)
+        wall = time.perf_counter() - start
+        cpu_self = cpu_seconds(resource.RUSAGE_SELF) - cpu_before[0]
+        cpu_children = cpu_seconds(resource.RUSAGE_CHILDREN) - cpu_before[1]
+        io_after = proc_io()
+
+        from musetalk_trace import read_traces
+        records = [r for r in read_traces(backend.TRACE_LOG) if str(r.get('client_id', '')).startswith('bench-')]
+        statuses = Counter(r.get('status') for r in records)
+        runs = max(1, args.runs)
+        return {
+            'meta': {
+                'date': datetime.now().isoformat(timespec='seconds'),
+                'git': git_revision(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'scenario': scenario(args, fixtures),
+            },
+            'jobs': dict(statuses, total=len(records), wall_seconds=round(wall, 2)),
+            'events': dict(events),
+            'stages': summarize(records),
+            'resources': {
+                'cpu_ms_per_job': round(cpu_self * 1000 / runs, 1),
+                'child_cpu_ms_per_job': round(cpu_children * 1000 / runs, 1),
+                'peak_rss_mb': round(peak_rss_mb(), 1),
+                'peak_rss_scope': rss_scope,
+                'disk_bytes_per_job': (tree_bytes(work) - bytes_before) // runs,
+                'io_wchar_bytes_per_job': (
+                    (io_after['wchar'] - io_before['wchar']) // runs if 'wchar' in io_before else None
+                ),
+            },
+        }
+    finally:
+        os.chdir(cwd)
+        stub.terminate()
+        stub.wait()
+        if args.keep:
+            print(f"Dossier de travail conservé : {work}", file=sys.stderr)
+        else:
+            shutil.rmtree(work, ignore_errors=True)
+
+
+# ----------  rapport / référence  ----------
+def print_report(result):
+    sc = result['meta']['scenario']
+    jobs = result['jobs']
+    print(f"{jobs['total']} tours ({jobs.get('done', 0)} ok) en {jobs['wall_seconds']} s — "
+          f"{sc['provider']}, {'rendu pipeliné' if sc['pipelined'] else 'rendu en un bloc'}, "
+          f"concurrence {sc['concurrency']}, latences × {sc['latency_scale']:g}")
+    print(f"{'étape':<22} {'n':>4} {'p50 ms':>9} {'p95 ms':>9}")
+    for name, s in result['stages'].items():
+        print(f"{name:<22} {s['n']:>4} {s['p50_ms']:>9.1f} {s['p95_ms']:>9.1f}")
+    r = result['resources']
+    wchar = r['io_wchar_bytes_per_job']
+    print(f"par tour : CPU backend {r['cpu_ms_per_job']:.0f} ms, CPU sous-processus {r['child_cpu_ms_per_job']:.0f} ms, "
+          f"disque {r['disk_bytes_per_job'] / 1024:.0f} Kio"
+          + (f", write() {wchar / 1024:.0f} Kio" if wchar is not None else ''))
+    print(f"pic RSS : {r['peak_rss_mb']:.0f} Mo ({'pendant les tours' if r['peak_rss_scope'] == 'runs' else 'process'})")
+
+
+def flatten(result):
+    metrics = {}
+    for name, s in result['stages'].items():
+        metrics[f"stage.{name}.p50_ms"] = s['p50_ms']
+        metrics[f"stage.{name}.p95_ms"] = s['p95_ms']
+    for key, value in result['resources'].items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[key] = value
+    return metrics
+
+
+def compare(result, baseline, tolerance):
+    """Affiche l'écart à la référence ; retourne la liste des régressions."""
+    if baseline['meta'].get('scenario') != result['meta']['scenario']:
+        print("⚠️ Scénario différent de la référence : comparaison indicative", file=sys.stderr)
+    current, reference = flatten(result), flatten(baseline)
+    regressions = []
+    print(f"\n{'mesure':<36} {'réf.':>11} {'actuel':>11} {'écart':>8}")
+    for key in reference:
+        if key not in current:
+            continue
+        before, after = reference[key], current[key]
+        floor = next((v for suffix, v in ABS_FLOOR.items() if key.endswith(suffix)), 0)
+        delta = (after - before) / before if before else 0.0
+        mark = ''
+        if after > before * (1 + tolerance) and after - before > floor:
+            mark = '⚠️'
+            regressions.append(key)
+        elif after < before * (1 - tolerance) and before - after > floor:
+            mark = '✅'
+        print(f"{key:<36} {before:>11g} {after:>11g} {delta:>+7.0%} {mark}")
+    return regressions
+
+
+def write_json(path, data):
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    Path(path).write_text(json.dumps(data, indent=2, ensure_ascii=False) + '\n', encoding='utf-8')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--warmup', type=int, default=1, help="tours non mesurés (imports, avatar, pools)")
+    parser.add_argument('--concurrency', type=int, default=1, help="tours en parallèle dans le scheduler")
+    parser.add_argument('--slots', type=int, default=1, help="MUSETALK_INFERENCE_SLOTS")
+    parser.add_argument('--pipelined', action='store_true', help="rendu phrase par phrase (ffmpeg requis)")
+    parser.add_argument('--provider', choices=('openai', 'elevenlabs'), default='elevenlabs')
+    parser.add_argument('--voice-id')
+    parser.add_argument('--audio', nargs='+', help="enregistrements (webm, ogg, wav…) au lieu des fixtures synthétiques")
+    parser.add_argument('--durations', default='2,4,8', help="durées (s) des fixtures synthétiques")
+    parser.add_argument('--latency-scale', type=float, default=1.0,
+                        help="multiplie toutes les latences simulées (0 = coût propre du backend)")
+    add_latency_args(parser)
+    group = parser.add_argument_group('faux MuseTalk')
+    group.add_argument('--inference-ms', type=float, default=500)
+    group.add_argument('--inference-rtf', type=float, default=0.25, help="s de rendu par s d'audio")
+    group.add_argument('--video-kbps', type=float, default=0, help="0 = copie du clip avatar")
+    group = parser.add_argument_group('résultats')
+    group.add_argument('--json', help="écrit le résultat complet (JSON)")
+    group.add_argument('--save-baseline', help="enregistre le résultat comme référence")
+    group.add_argument('--compare', help="compare à une référence enregistrée")
+    group.add_argument('--tolerance', type=float, default=0.2, help="hausse relative tolérée (0.2 = +20 %%)")
+    parser.add_argument('--keep', action='store_true', help="garde le dossier de travail")
+    parser.add_argument('--verbose', action='store_true', help="logs INFO du backend")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    result = benchmark(args)
+    print_report(result)
+
+    if args.json:
+        write_json(args.json, result)
+
+    if result['jobs'].get('done', 0) < args.runs:
+        print(f"❌ {args.runs - result['jobs'].get('done', 0)} tour(s) non terminé(s) : {result['jobs']}",
+              file=sys.stderr)
+        return 1
+    if args.save_baseline:
+        write_json(args.save_baseline, result)
+        print(f"Référence enregistrée : {args.save_baseline}")
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding='utf-8'))
+        regressions = compare(result, baseline, args.tolerance)
+        if regressions:
+            print(f"\n❌ {len(regressions)} régression(s) au-delà de {args.tolerance:.0%} : {', '.join(regressions)}",
+                  file=sys.stderr)
+            return 1
+        print("\n✅ Pas de régression")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Vérification hors ligne de `musetalk_http.UrlCache` (cache des `avatar_url`)
+contre une origine HTTP locale, avec le vrai HttpClient.
+
+Scénarios :
+- premier GET → téléchargement (200), copie locale écrite ;
+- GET suivant → If-None-Match → 304 : rien retransféré, mtime rafraîchi
+  (le janitor n'évince pas un avatar encore demandé) ;
+- ETag changé côté origine → 200 et copie locale remplacée ;
+- origine sans ETag (Last-Modified seul) → If-Modified-Since → 304 ;
+- N threads sur la même URL (origine lente) → un seul GET, les autres fusionnés ;
+- fenêtre `fresh` → aucune requête ;
+- origine injoignable → copie locale (périmée) servie.
+
+    python3 benchmarks/check_url_cache.py
+    python3 benchmarks/check_url_cache.py --threads 16 --origin-delay-ms 500
+
+Code de sortie 1 si un scénario échoue.
+"""
+
+import argparse
+import email.utils
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+from musetalk_http import HttpClient, HttpStage, UrlCache  # noqa: E402
+
+OLD_MTIME = 1_000_000_000  # 2001 : bien plus vieux que n'importe quel âge max du janitor
+
+
+class Origin:
+    """Fichiers servis par l'origine et compteurs de réponses (par chemin)."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.files = {}  # chemin → {'body', 'etag', 'last_modified'}
+        self.counts = {}  # chemin → {'get': n, 200: n, 304: n}
+        self.lock = threading.Lock()
+
+    def put(self, path, body, etag=None, last_modified=None):
+        with self.lock:
+            self.files[path] = {'body': body, 'etag': etag, 'last_modified': last_modified}
+
+    def count(self, path, key):
+        with self.lock:
+            return self.counts.get(path, {}).get(key, 0)
+
+    def _hit(self, path, key):
+        with self.lock:
+            entry = self.counts.setdefault(path, {})
+            entry[key] = entry.get(key, 0) + 1
+
+
+class OriginHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    origin = None  # Origin, fixé par start_origin()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        origin = self.origin
+        path = self.path.split('?', 1)[0]
+        origin._hit(path, 'get')
+        if origin.delay:
+            time.sleep(origin.delay)
+        with origin.lock:
+            entry = origin.files.get(path)
+        if entry is None:
+            self._reply(404, b'')
+            return
+        etag, last_modified = entry['etag'], entry['last_modified']
+        if etag and self.headers.get('If-None-Match') == etag:
+            not_modified = True
+        elif not etag and last_modified and self.headers.get('If-Modified-Since'):
+            since = email.utils.parsedate_to_datetime(self.headers['If-Modified-Since'])
+            not_modified = since >= email.utils.parsedate_to_datetime(last_modified)
+        else:
+            not_modified = False
+        headers = {}
+        if etag:
+            headers['ETag'] = etag
+        if last_modified:
+            headers['Last-Modified'] = last_modified
+        if not_modified:
+            origin._hit(path, 304)
+            self._reply(304, b'', headers)
+        else:
+            origin._hit(path, 200)
+            self._reply(200, entry['body'], dict(headers, **{'Content-Type': 'video/mp4'}))
+
+    def _reply(self, status, body, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+
+def start_origin(origin):
+    handler = type('ConfiguredOriginHandler', (OriginHandler,), {'origin': origin})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name='origin').start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+class Checks:
+    def __init__(self):
+        self.failures = 0
+
+    def expect(self, label, ok, detail=''):
+        print(f"{'OK    ' if ok else 'ÉCHEC '} {label}" + (f"  ({detail})" if detail else ''))
+        if not ok:
+            self.failures += 1
+
+
+def run(args):
+    origin = Origin()
+    server, base = start_origin(origin)
+    http = HttpClient([HttpStage('avatar_url', read=10.0, connect=2.0, retries=0)], backoff=0.0)
+    checks = Checks()
+
+    with tempfile.TemporaryDirectory(prefix='url-cache-') as root:
+        cache = UrlCache(Path(root) / 'cache', http, 'avatar_url')
+
+        # 1. Premier GET : téléchargement
+        origin.put('/a.mp4', b'avatar-v1' * 1000, etag='"v1"')
+        path = cache.fetch(f"{base}/a.mp4")
+        checks.expect("premier GET téléchargé",
+                      path.read_bytes() == b'avatar-v1' * 1000 and origin.count('/a.mp4', 200) == 1,
+                      f"200={origin.count('/a.mp4', 200)}")
+
+        # 2. Revalidation ETag : 304, pas de corps, mtime rafraîchi
+        os.utime(path, (OLD_MTIME, OLD_MTIME))
+        again = cache.fetch(f"{base}/a.mp4")
+        checks.expect("If-None-Match → 304, rien retransféré",
+                      again == path and origin.count('/a.mp4', 304) == 1 and origin.count('/a.mp4', 200) == 1,
+                      f"200={origin.count('/a.mp4', 200)} 304={origin.count('/a.mp4', 304)}")
+        checks.expect("mtime rafraîchi sur 304", path.stat().st_mtime > OLD_MTIME,
+                      f"mtime={path.stat().st_mtime:.0f}")
+
+        # 3. ETag changé : nouvelle version téléchargée
+        origin.put('/a.mp4', b'avatar-v2' * 1000, etag='"v2"')
+        path = cache.fetch(f"{base}/a.mp4")
+        checks.expect("ETag changé → 200, copie remplacée",
+                      path.read_bytes() == b'avatar-v2' * 1000 and origin.count('/a.mp4', 200) == 2,
+                      f"200={origin.count('/a.mp4', 200)}")
+
+        # 4. Last-Modified seul
+        origin.put('/lm.mp4', b'lm' * 1000, last_modified=email.utils.formatdate(time.time() - 3600, usegmt=True))
+        cache.fetch(f"{base}/lm.mp4")
+        cache.fetch(f"{base}/lm.mp4")
+        checks.expect("Last-Modified seul → If-Modified-Since → 304",
+                      origin.count('/lm.mp4', 200) == 1 and origin.count('/lm.mp4', 304) == 1,
+                      f"200={origin.count('/lm.mp4', 200)} 304={origin.count('/lm.mp4', 304)}")
+
+        # 5. Demandes concurrentes fusionnées
+        origin.delay = args.origin_delay_ms / 1000.0
+        origin.put('/big.mp4', b'big' * 100000, etag='"big"')
+        coalesced_before = cache.stats()['coalesced']
+        barrier = threading.Barrier(args.threads)
+        results = []
+
+        def worker():
+            barrier.wait()
+            results.append(cache.fetch(f"{base}/big.mp4"))
+
+        threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        origin.delay = 0.0
+        coalesced = cache.stats()['coalesced'] - coalesced_before
+        checks.expect(f"{args.threads} demandes concurrentes → un seul GET",
+                      origin.count('/big.mp4', 'get') == 1 and len(set(results)) == 1
+                      and coalesced == args.threads - 1,
+                      f"GET={origin.count('/big.mp4', 'get')} fusionnées={coalesced}")
+
+        # 6. Fenêtre fresh : aucune requête
+        fresh_cache = UrlCache(Path(root) / 'cache', http, 'avatar_url', fresh=60.0)
+        gets = origin.count('/a.mp4', 'get')
+        fresh_cache.fetch(f"{base}/a.mp4")
+        checks.expect("fenêtre fresh → aucune requête",
+                      origin.count('/a.mp4', 'get') == gets and fresh_cache.stats()['hits'] == 1,
+                      f"GET={origin.count('/a.mp4', 'get') - gets}")
+
+        # 7. Origine injoignable : copie périmée servie
+        server.shutdown()
+        server.server_close()
+        # Connexions keep-alive encore servies par leur thread : coupées comme par une vraie panne
+        http.session.close()
+        try:
+            stale = cache.fetch(f"{base}/a.mp4")
+            ok = stale.read_bytes() == b'avatar-v2' * 1000 and cache.stats()['stale'] == 1
+            detail = f"stale={cache.stats()['stale']}"
+        except Exception as e:
+            ok, detail = False, f"{type(e).__name__}: {e}"
+        checks.expect("origine injoignable → copie locale servie", ok, detail)
+
+        print(f"\nUrlCache : {cache.stats()}")
+    http.session.close()
+    return 1 if checks.failures else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=8, help="demandes concurrentes de la même URL")
+    parser.add_argument('--origin-delay-ms', type=float, default=300, help="latence de l'origine (fusion)")
+    return run(parser.parse_args(argv))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
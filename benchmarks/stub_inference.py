@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Remplaçant de `scripts.inference` (MuseTalk) pour les benchmarks hors ligne.
+
+bench_pipeline.py le copie en <MUSETALK_DIR>/scripts/inference.py : le backend
+(MUSETALK_MODE=subprocess) le lance avec les mêmes arguments que le vrai script
+et attend la même sortie, <result_dir>/v15/<avatar>_<audio>.mp4.
+
+Réglages par variables d'environnement :
+- BENCH_INFERENCE_MS   : durée fixe par tâche (chargement des modèles…)
+- BENCH_INFERENCE_RTF  : secondes de rendu par seconde d'audio
+- BENCH_VIDEO_KBPS     : 0 = copie du clip avatar (mp4 valide, concat possible) ;
+                         sinon N kbit/s × durée audio d'octets de remplissage
+- BENCH_INFERENCE_EXIT : code de sortie forcé (simuler un échec)
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import time
+import wave
+
+import yaml
+
+
+def audio_seconds(path):
+    with wave.open(path, 'rb') as w:
+        return w.getnframes() / float(w.getframerate())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--inference_config', required=True)
+    parser.add_argument('--result_dir', required=True)
+    parser.add_argument('--version', default='v15')
+    parser.add_argument('--fps', type=int, default=25)
+    # Acceptés pour la compatibilité de ligne de commande, sans effet ici
+    for name in ('--unet_model_path', '--unet_config', '--batch_size', '--ffmpeg_path'):
+        parser.add_argument(name)
+    parser.add_argument('--use_float16', action='store_true')
+    args = parser.parse_args(argv)
+
+    exit_code = int(os.getenv('BENCH_INFERENCE_EXIT', '0'))
+    if exit_code:
+        sys.stderr.write("stub inference : échec simulé\n")
+        return exit_code
+
+    fixed = float(os.getenv('BENCH_INFERENCE_MS', '500')) / 1000.0
+    rtf = float(os.getenv('BENCH_INFERENCE_RTF', '0.25'))
+    kbps = float(os.getenv('BENCH_VIDEO_KBPS', '0'))
+
+    with open(args.inference_config, encoding='utf-8') as f:
+        tasks = yaml.safe_load(f)
+    out_dir = os.path.join(args.result_dir, args.version)
+    os.makedirs(out_dir, exist_ok=True)
+
+    for task in tasks.values():
+        video_path, audio_path = task['video_path'], task['audio_path']
+        seconds = audio_seconds(audio_path)
+        time.sleep(fixed + rtf * seconds)
+        name = (f"{os.path.basename(video_path).split('.')[0]}_"
+                f"{os.path.basename(audio_path).split('.')[0]}.mp4")
+        output = os.path.join(out_dir, name)
+        if kbps > 0:
+            with open(output, 'wb') as f:
+                f.write(b'\0' * int(kbps * 1000 / 8 * seconds))
+        else:
+            shutil.copyfile(video_path, output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Faux fournisseurs pour les benchmarks hors ligne : serveur HTTP local qui imite
+les routes utilisées par le backend, avec des latences réglables.
+
+- POST /v1/audio/transcriptions      Whisper (réponse JSON après --whisper-ms)
+- POST /v1/chat/completions          GPT, flux SSE : 1er token après --chat-ttft-ms,
+                                     puis un mot toutes les --chat-token-ms
+- POST /v1/audio/speech              TTS OpenAI (mp3 en flux)
+- POST /v1/text-to-speech/<voix>/stream   TTS ElevenLabs (mp3 en flux)
+
+TTS : premier octet après --tts-ttfb-ms, puis débit de --tts-realtime fois le
+temps réel ; durée de la voix = --speech-ms-per-char × nombre de caractères.
+
+    python3 benchmarks/stub_providers.py --port 8765
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 ELEVENLABS_API_BASE=http://127.0.0.1:8765 python3 musetalk_backend_optimized.py
+
+Le port effectif est écrit sur la première ligne de stdout (utile avec --port 0).
+"""
+
+import argparse
+import io
+import itertools
+import json
+import sys
+import time
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+import av
+
+DEFAULT_TRANSCRIPT = "Bonjour, tu peux me raconter ta journée ?"
+DEFAULT_REPLY = (
+    "Avec plaisir ! Ce matin j'ai pris un café en terrasse au soleil. "
+    "Ensuite j'ai marché le long de la rivière jusqu'au marché. "
+    "Et toi, qu'as-tu prévu pour ce soir ?"
+)
+TTS_RATE = 22050
+TTS_CHUNK = 4096
+
+
+@lru_cache(maxsize=64)
+def synth_mp3(tenths):
+    """mp3 mono 22,05 kHz de `tenths` dixièmes de seconde (voix synthétique)."""
+    t = np.arange(int(TTS_RATE * tenths / 10)) / TTS_RATE
+    signal = 0.3 * np.sin(2 * np.pi * 180 * t) * (0.5 + 0.5 * np.sin(2 * np.pi * 4 * t))
+    pcm = (signal * 32767).astype(np.int16)
+    buf = io.BytesIO()
+    with av.open(buf, mode='w', format='mp3') as out:
+        stream = out.add_stream('mp3', rate=TTS_RATE, layout='mono')
+        stream.bit_rate = 64000
+        for i in range(0, len(pcm), 1152):
+            frame = av.AudioFrame.from_ndarray(pcm[i:i + 1152].reshape(1, -1), format='s16', layout='mono')
+            frame.sample_rate = TTS_RATE
+            for packet in stream.encode(frame):
+                out.mux(packet)
+        for packet in stream.encode(None):
+            out.mux(packet)
+    return buf.getvalue()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, comme les vrais fournisseurs
+    config = None                  # argparse.Namespace, fixé par serve()
+    turns = itertools.count(1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def _sleep(self, ms):
+        if ms > 0:
+            time.sleep(ms / 1000.0)
+
+    def _send_json(self, payload, status=200):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _start_chunked(self, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+    def _chunk(self, data):
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+    def _end_chunked(self):
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+    def do_POST(self):
+        path = self.path.split('?', 1)[0]
+        body = self._body()
+        if path == '/v1/audio/transcriptions':
+            self._sleep(self.config.whisper_ms)
+            self._send_json({'text': self.config.transcript})
+        elif path == '/v1/chat/completions':
+            self._chat(json.loads(body or b'{}'))
+        elif path == '/v1/audio/speech':
+            self._tts(json.loads(body or b'{}').get('input', ''))
+        elif path.startswith('/v1/text-to-speech/'):
+            self._tts(json.loads(body or b'{}').get('text', ''))
+        else:
+            self._send_json({'error': {'message': f'route inconnue {path}'}}, status=404)
+
+    def _reply_text(self):
+        # Réponse différente à chaque tour : le cache TTS ne masque pas l'étape tts
+        if self.config.same_reply:
+            return self.config.reply
+        return f"{self.config.reply} Tour {next(self.turns)}."
+
+    def _chat(self, request):
+        text = self._reply_text()
+        words = text.split(' ')
+        model = request.get('model', 'gpt-4o-mini')
+        if not request.get('stream'):
+            self._sleep(self.config.chat_ttft_ms + self.config.chat_token_ms * len(words))
+            self._send_json({
+                'id': 'chatcmpl-bench', 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+                'choices': [{'index': 0, 'finish_reason': 'stop',
+                             'message': {'role': 'assistant', 'content': text}}],
+            })
+            return
+
+        self._start_chunked('text/event-stream')
+        self._sleep(self.config.chat_ttft_ms)
+        for i, word in enumerate(words):
+            if i:
+                self._sleep(self.config.chat_token_ms)
+            chunk = {
+                'id': 'chatcmpl-bench', 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'finish_reason': None,
+                             'delta': {'content': word if i == 0 else ' ' + word}}],
+            }
+            self._chunk(b'data: ' + json.dumps(chunk).encode('utf-8') + b'\n\n')
+        self._chunk(b'data: [DONE]\n\n')
+        self._end_chunked()
+
+    def _tts(self, text):
+        seconds = max(0.5, len(text) * self.config.speech_ms_per_char / 1000.0)
+        audio = synth_mp3(round(seconds * 10))
+        # Débit : `tts_realtime` secondes d'audio envoyées par seconde
+        pause = seconds / self.config.tts_realtime / max(1, len(audio) / TTS_CHUNK) if self.config.tts_realtime else 0
+        self._start_chunked('audio/mpeg')
+        self._sleep(self.config.tts_ttfb_ms)
+        for i in range(0, len(audio), TTS_CHUNK):
+            if i and pause:
+                time.sleep(pause)
+            self._chunk(audio[i:i + TTS_CHUNK])
+        self._end_chunked()
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Connexion keep-alive fermée par le client (fin de pool) : pas une erreur
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    add_latency_args(parser)
+    return parser
+
+
+def add_latency_args(parser):
+    """Options partagées avec bench_pipeline.py (transmises telles quelles au serveur)."""
+    group = parser.add_argument_group('faux fournisseurs')
+    group.add_argument('--whisper-ms', type=float, default=300)
+    group.add_argument('--chat-ttft-ms', type=float, default=350)
+    group.add_argument('--chat-token-ms', type=float, default=15)
+    group.add_argument('--tts-ttfb-ms', type=float, default=250)
+    group.add_argument('--tts-realtime', type=float, default=4.0, help="débit TTS en × temps réel (0 = immédiat)")
+    group.add_argument('--speech-ms-per-char', type=float, default=65)
+    group.add_argument('--transcript', default=DEFAULT_TRANSCRIPT)
+    group.add_argument('--reply', default=DEFAULT_REPLY)
+    group.add_argument('--same-reply', action='store_true', help="même réponse à chaque tour (cache TTS chaud)")
+    return group
+
+
+def serve(args):
+    handler = type('ConfiguredStubHandler', (StubHandler,), {'config': args})
+    server = StubServer((args.host, args.port), handler)
+    sys.stdout.write(f"{server.server_address[1]}\n")
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main(argv=None):
+    serve(build_parser().parse_args(argv))
+
+
+if __name__ == '__main__':
+    main()
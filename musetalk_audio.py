@@ -0,0 +1,424 @@
+# -*- coding: utf-8 -*-
+"""
+Décodage / rééchantillonnage audio en mémoire, partagé par les deux backends.
+
+Remplace les appels `ffmpeg` en subprocess : webm/opus, mp3 et wav sont décodés
+avec PyAV (déjà utilisé par le backend WebRTC), puis convertis en 16 kHz mono
+s16 avec NumPy. Les fonctions travaillent sur des buffers, sans fichier temporaire.
+Sans PyAV, seul le wav (module `wave`) reste décodable.
+
+Pour le micro WebRTC : rééchantillonnage par blocs sans discontinuité
+(StreamResampler) et découpage en énoncés par énergie (Endpointer).
+Avant transcription : silences de début / fin coupés (trim_silence) et
+encodage compact opus / flac (encode_for_transcription).
+"""
+
+import io
+import logging
+import wave
+from collections import deque
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+try:
+    import av
+    AV_AVAILABLE = True
+    _AV_ERRORS = (getattr(av, 'FFmpegError', None) or av.AVError, IndexError)
+except ImportError:
+    AV_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+TARGET_RATE = 16000
+
+
+class AudioDecodeError(ValueError):
+    """Le buffer n'a pas pu être décodé."""
+
+
+# ----------  décodage  ----------
+def frames_to_mono(frames):
+    """Liste d'av.AudioFrame (même format) → float32 mono dans [-1, 1]."""
+    if not frames:
+        return np.zeros(0, dtype=np.float32)
+    first = frames[0]
+    fmt = first.format.name
+    channels = len(first.layout.channels)
+    # Une seule concaténation / conversion pour tout le flux
+    arr = np.concatenate([frame.to_ndarray() for frame in frames], axis=1)
+    if first.format.is_planar:
+        arr = arr.reshape(channels, -1)
+    else:
+        arr = arr.reshape(-1, channels).T
+    if fmt.startswith('s16'):
+        arr = arr.astype(np.float32) / 32768.0
+    elif fmt.startswith('s32'):
+        arr = arr.astype(np.float32) / 2147483648.0
+    elif fmt.startswith('u8'):
+        arr = (arr.astype(np.float32) - 128.0) / 128.0
+    else:
+        arr = arr.astype(np.float32, copy=False)
+    return arr.mean(axis=0) if arr.shape[0] > 1 else arr[0]
+
+
+def _decode_wav(data):
+    with wave.open(io.BytesIO(data), 'rb') as w:
+        channels, width, rate = w.getnchannels(), w.getsampwidth(), w.getframerate()
+        raw = w.readframes(w.getnframes())
+    if width == 2:
+        samples = np.frombuffer(raw, dtype='<i2').astype(np.float32) / 32768.0
+    elif width == 1:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif width == 4:
+        samples = np.frombuffer(raw, dtype='<i4').astype(np.float32) / 2147483648.0
+    else:
+        raise AudioDecodeError(f"wav {width * 8} bits non supporté")
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    return samples, rate
+
+
+def decode_audio(data):
+    """
+    Décode un buffer audio (webm/opus, mp3, wav, ogg, m4a…).
+    Retourne (samples float32 mono, sample_rate).
+    """
+    if data[:4] == b'RIFF' and data[8:12] == b'WAVE':
+        try:
+            return _decode_wav(data)
+        except (wave.Error, AudioDecodeError):
+            if not AV_AVAILABLE:
+                raise
+    if not AV_AVAILABLE:
+        raise AudioDecodeError("PyAV non installé : seul le wav PCM est supporté")
+
+    try:
+        with av.open(io.BytesIO(data), mode='r') as container:
+            stream = container.streams.audio[0]
+            frames = list(container.decode(stream))
+            rate = stream.codec_context.sample_rate or stream.rate
+    except _AV_ERRORS as e:
+        raise AudioDecodeError(f"décodage impossible: {e}") from e
+
+    return frames_to_mono(frames), rate
+
+
+class StreamingDecoder:
+    """
+    Décodeur incrémental : on lui pousse les octets au fil de la réception
+    (réponse HTTP chunkée du TTS), il décode les paquets complets au passage.
+    """
+
+    def __init__(self, codec='mp3'):
+        if not AV_AVAILABLE:
+            raise AudioDecodeError("PyAV non installé")
+        self._codec = av.CodecContext.create(codec, 'r')
+        self._skip_id3 = codec == 'mp3'
+        self._head = b''
+        self._frames = []
+        self.rate = None
+
+    def _decode(self, packet):
+        try:
+            frames = self._codec.decode(packet)
+        except _AV_ERRORS:
+            return  # paquet corrompu : ignoré, comme le fait ffmpeg
+        for frame in frames:
+            self.rate = self.rate or frame.sample_rate
+            self._frames.append(frame)
+
+    def _strip_id3(self, data):
+        """Retire le tag ID3v2 en tête de flux mp3 (le parser ne le gère pas)."""
+        self._head += data
+        if len(self._head) < 10:
+            return b''
+        head, self._head = self._head, b''
+        if head[:3] != b'ID3':
+            self._skip_id3 = False
+            return head
+        size = 10 + ((head[6] & 0x7f) << 21 | (head[7] & 0x7f) << 14 | (head[8] & 0x7f) << 7 | head[9] & 0x7f)
+        if len(head) < size:
+            self._head = head
+            return b''
+        self._skip_id3 = False
+        return head[size:]
+
+    def feed(self, data):
+        if self._skip_id3:
+            data = self._strip_id3(data)
+            if not data:
+                return
+        for packet in self._codec.parse(data):
+            self._decode(packet)
+
+    def finish(self):
+        """Vide le décodeur et retourne (samples float32 mono, sample_rate)."""
+        if self._head:
+            head, self._head, self._skip_id3 = self._head, b'', False
+            self.feed(head)
+        for packet in self._codec.parse(b''):
+            self._decode(packet)
+        self._decode(None)
+        return frames_to_mono(self._frames), self.rate or TARGET_RATE
+
+
+# ----------  rééchantillonnage  ----------
+def _lowpass_kernel(cutoff, taps=63):
+    """FIR passe-bas (sinc fenêtré Hann), cutoff en fraction de la fréquence d'entrée."""
+    n = np.arange(taps) - (taps - 1) / 2
+    kernel = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hanning(taps)
+    return (kernel / kernel.sum()).astype(np.float32)
+
+
+def resample(samples, src_rate, dst_rate=TARGET_RATE, taps=63):
+    """Rééchantillonne un signal float32 mono (anti-repliement + interpolation linéaire)."""
+    samples = samples.astype(np.float32, copy=False)
+    if src_rate == dst_rate or len(samples) == 0:
+        return samples
+    if src_rate % dst_rate == 0:
+        # Décimation entière (48 kHz → 16 kHz) : le FIR n'est évalué qu'aux
+        # échantillons conservés, en un seul produit matriciel.
+        factor = src_rate // dst_rate
+        half = taps // 2
+        padded = np.pad(samples, (half, taps - 1 - half))
+        windows = sliding_window_view(padded, taps)[::factor]
+        return windows @ _lowpass_kernel(0.5 / factor, taps)[::-1]
+    if dst_rate < src_rate:
+        # Ratio non entier (44.1 kHz → 16 kHz) : interpolation vers le multiple
+        # entier supérieur (48 kHz) puis décimation, moins coûteux qu'un FIR plein débit.
+        factor = -(-src_rate // dst_rate)
+        return resample(resample(samples, src_rate, dst_rate * factor, taps), dst_rate * factor, dst_rate, taps)
+    n_out = int(round(len(samples) * dst_rate / src_rate))
+    positions = np.arange(n_out, dtype=np.float64) * (src_rate / dst_rate)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+class StreamResampler:
+    """
+    Rééchantillonnage d'un flux reçu par blocs (trames micro de 20 ms).
+    Ratio entier (48 kHz → 16 kHz) : le FIR garde l'historique du bloc
+    précédent, donc pas de clic aux frontières. Sinon, resample() par bloc.
+    """
+
+    def __init__(self, src_rate, dst_rate=TARGET_RATE, taps=63):
+        self.src_rate = src_rate
+        self.dst_rate = dst_rate
+        self.factor = src_rate // dst_rate if src_rate % dst_rate == 0 else None
+        self._kernel = _lowpass_kernel(0.5 / self.factor, taps) if self.factor else None
+        self._history = np.zeros(taps - 1, dtype=np.float32)
+        self._phase = 0
+
+    def process(self, samples):
+        samples = samples.astype(np.float32, copy=False)
+        if self.factor is None:
+            return resample(samples, self.src_rate, self.dst_rate)
+        if self.factor == 1:
+            return samples
+        x = np.concatenate([self._history, samples])
+        windows = sliding_window_view(x, len(self._kernel))[self._phase::self.factor]
+        self._phase = self._phase + len(windows) * self.factor - len(samples)
+        self._history = x[len(x) - len(self._history):]
+        return windows @ self._kernel
+
+
+def to_pcm16(samples):
+    """float32 [-1, 1] → int16."""
+    return (np.clip(samples, -1.0, 1.0) * 32767.0).astype('<i2')
+
+
+def decode_to_pcm16k(data):
+    """Buffer audio quelconque → PCM s16 mono 16 kHz (np.int16)."""
+    samples, rate = decode_audio(data)
+    return to_pcm16(resample(samples, rate, TARGET_RATE))
+
+
+# ----------  sortie  ----------
+def pcm16_to_wav_bytes(pcm, rate=TARGET_RATE):
+    buf = io.BytesIO()
+    with wave.open(buf, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(pcm.tobytes())
+    return buf.getvalue()
+
+
+def write_wav(path, pcm, rate=TARGET_RATE):
+    with wave.open(str(path), 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(pcm.tobytes())
+
+
+def duration_seconds(pcm, rate=TARGET_RATE):
+    return len(pcm) / float(rate)
+
+
+# codec → (encodeur PyAV, conteneur, extension) ; tous acceptés par Whisper
+TRANSCRIPTION_CODECS = {
+    'opus': ('libopus', 'ogg', 'ogg'),
+    'flac': ('flac', 'flac', 'flac'),
+}
+
+
+def _encode(pcm, codec, container_format, rate, bit_rate):
+    buf = io.BytesIO()
+    with av.open(buf, 'w', format=container_format) as container:
+        stream = container.add_stream(codec, rate=rate, layout='mono')
+        if bit_rate:
+            stream.bit_rate = bit_rate
+        frame = av.AudioFrame.from_ndarray(pcm.reshape(1, -1), format='s16', layout='mono')
+        frame.sample_rate = rate
+        # PyAV redécoupe la trame à la taille attendue par l'encodeur
+        for packet in stream.encode(frame):
+            container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+    return buf.getvalue()
+
+
+def encode_for_transcription(pcm, codec='opus', rate=TARGET_RATE, bit_rate=24000):
+    """
+    PCM s16 mono → (nom de fichier, octets) prêts pour l'API de transcription.
+    opus 24 kb/s ≈ 10× plus petit que le wav, flac ≈ 2× (sans perte) ;
+    repli sur le wav si PyAV ou l'encodeur manque.
+    """
+    if AV_AVAILABLE and codec in TRANSCRIPTION_CODECS and len(pcm):
+        encoder, container_format, ext = TRANSCRIPTION_CODECS[codec]
+        try:
+            data = _encode(np.ascontiguousarray(pcm, dtype=np.int16), encoder, container_format, rate,
+                           bit_rate if codec == 'opus' else None)
+            return f'audio.{ext}', data
+        except (_AV_ERRORS + (ValueError,)) as e:
+            logger.warning("Encodage %s impossible (%s), envoi en wav", codec, e)
+    return 'audio.wav', pcm16_to_wav_bytes(pcm, rate)
+
+
+# ----------  détection d'activité vocale  ----------
+VAD_FRAME_MS = 20
+
+
+def frame_energies_db(pcm, frame):
+    """Énergie RMS (dBFS) de chaque trame complète de `frame` échantillons (int16 ou float32)."""
+    n = len(pcm) // frame
+    if n == 0:
+        return np.zeros(0, dtype=np.float32)
+    x = pcm[:n * frame].reshape(n, frame).astype(np.float32)
+    if pcm.dtype == np.int16:
+        x /= 32768.0
+    return 10.0 * np.log10(np.mean(x * x, axis=1) + 1e-10)
+
+
+def trim_silence(pcm, rate=TARGET_RATE, threshold_db=12.0, floor_db=-50.0, max_noise_db=-35.0,
+                 pad_ms=150, min_speech_ms=250):
+    """
+    Coupe le silence et le souffle en début / fin d'un enregistrement complet.
+    Plancher de bruit = 10e centile des énergies de trame (plafonné à
+    `max_noise_db` pour un enregistrement entièrement parlé) ; une trame est
+    voisée au-dessus de plancher + `threshold_db`. On garde `pad_ms` autour de
+    la parole. Retourne (pcm, début, fin) en échantillons ; pcm vide si moins
+    de `min_speech_ms` de parole (enregistrement accidentel).
+    """
+    frame = rate * VAD_FRAME_MS // 1000
+    energies = frame_energies_db(pcm, frame)
+    if len(energies) == 0:
+        return pcm[:0], 0, 0
+    noise_db = min(float(np.percentile(energies, 10)), max_noise_db)
+    voiced = np.flatnonzero(energies > max(noise_db + threshold_db, floor_db))
+    if len(voiced) < min_speech_ms // VAD_FRAME_MS:
+        return pcm[:0], 0, 0
+    pad = pad_ms // VAD_FRAME_MS
+    start = max(0, voiced[0] - pad) * frame
+    end = len(pcm) if voiced[-1] + 1 + pad >= len(energies) else (voiced[-1] + 1 + pad) * frame
+    return pcm[start:end], start, end
+
+
+class Endpointer:
+    """
+    Découpe un flux PCM s16 en énoncés (VAD par énergie, tout NumPy) :
+    une trame de 20 ms est « voisée » si son énergie dépasse le plancher de
+    bruit (estimé sur les silences) de `threshold_db`. L'énoncé s'ouvre après
+    `start_ms` de parole (avec `preroll_ms` de contexte) et se ferme après
+    `hangover_ms` de silence ; les énoncés de moins de `min_speech_ms` de
+    parole (clics, toux) sont ignorés.
+    """
+
+    def __init__(self, rate=TARGET_RATE, threshold_db=12.0, floor_db=-50.0, start_ms=60,
+                 hangover_ms=600, preroll_ms=200, tail_ms=120, min_speech_ms=250, max_seconds=15.0):
+        self.rate = rate
+        self.frame = rate * VAD_FRAME_MS // 1000
+        self.threshold_db = threshold_db
+        self.floor_db = floor_db
+        self.start_frames = max(1, start_ms // VAD_FRAME_MS)
+        self.hangover_frames = max(1, hangover_ms // VAD_FRAME_MS)
+        self.tail_frames = tail_ms // VAD_FRAME_MS
+        self.min_speech_frames = min_speech_ms // VAD_FRAME_MS
+        self.max_frames = int(max_seconds * 1000 // VAD_FRAME_MS)
+        self.noise_db = floor_db - 10.0
+        self._pending = np.zeros(0, dtype=np.int16)
+        self._preroll = deque(maxlen=max(1, preroll_ms // VAD_FRAME_MS))
+        self._reset()
+
+    def _reset(self):
+        self._frames = []
+        self._in_speech = False
+        self._speech_run = 0
+        self._silence_run = 0
+        self._voiced = 0
+
+    @property
+    def in_speech(self):
+        return self._in_speech
+
+    def _close(self):
+        """Termine l'énoncé en cours ; retourne son PCM ou None s'il est trop court."""
+        keep = len(self._frames) - max(0, self._silence_run - self.tail_frames)
+        frames, voiced = self._frames[:keep], self._voiced
+        self._reset()
+        if voiced < self.min_speech_frames or not frames:
+            return None
+        return np.concatenate(frames)
+
+    def feed(self, pcm):
+        """Pousse des échantillons int16 ; retourne la liste des énoncés terminés."""
+        data = np.concatenate([self._pending, pcm]) if len(self._pending) else pcm
+        n = len(data) // self.frame
+        self._pending = data[n * self.frame:].copy()
+        energies = frame_energies_db(data, self.frame)
+        utterances = []
+        for i, db in enumerate(energies):
+            frame = data[i * self.frame:(i + 1) * self.frame]
+            voiced = db > max(self.noise_db + self.threshold_db, self.floor_db)
+            if not self._in_speech:
+                self._preroll.append(frame)
+                if voiced:
+                    self._speech_run += 1
+                else:
+                    self._speech_run = 0
+                    # Plancher de bruit : moyenne glissante sur les trames non voisées
+                    self.noise_db = 0.95 * self.noise_db + 0.05 * db
+                if self._speech_run >= self.start_frames:
+                    self._frames = list(self._preroll)
+                    self._preroll.clear()
+                    self._in_speech = True
+                    self._voiced = self._speech_run
+                    self._silence_run = 0
+                continue
+
+            self._frames.append(frame)
+            if voiced:
+                self._voiced += 1
+                self._silence_run = 0
+            else:
+                self._silence_run += 1
+            if self._silence_run >= self.hangover_frames or len(self._frames) >= self.max_frames:
+                utterance = self._close()
+                if utterance is not None:
+                    utterances.append(utterance)
+        return utterances
+
+    def flush(self):
+        """Fin du flux : retourne l'énoncé en cours (ou None)."""
+        return self._close() if self._in_speech else None
@@ -1,11 +1,11 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from flask import Flask, request, jsonify, send_file, send_from_directory
+from flask import Flask, request, jsonify
 from flask_cors import CORS
 from flask_socketio import SocketIO, emit
+from werkzeug.utils import safe_join
 import os
-import requests
 from pathlib import Path
 import logging
 from datetime import datetime
@@ -13,14 +13,34 @@ import json
 import threading
 import base64
 from io import BytesIO
-import openai
 import subprocess
 import shutil
 from dotenv import load_dotenv
 import sys
+import hashlib
 import glob
+import queue
+import re
+import time
+import uuid
+import wave
+from concurrent.futures import ThreadPoolExecutor
 import yaml  # besoin de pyyaml
 
+from musetalk_audio import (
+    AV_AVAILABLE, StreamingDecoder, decode_audio, decode_to_pcm16k, duration_seconds, encode_for_transcription,
+    resample, to_pcm16, trim_silence, write_wav
+)
+from musetalk_http import HttpClient, HttpStage, UrlCache
+from musetalk_media import send_media
+from musetalk_metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Registry, StageMetrics
+from musetalk_publish import HttpPutSink, LocalDirSink, Publisher, SshSink
+from musetalk_scheduler import JobScheduler, QueueFull
+from musetalk_storage import AvatarStore, JobManifest, JobWorkspace, StorageJanitor, TtsCache, link_or_copy, storage_budget
+from musetalk_trace import Trace, TraceLog, attach, bind, current_trace, detach, run_subprocess, span
+from musetalk_upload import SOCKETIO_BUFFER_SIZE, UploadError, UploadStore, register_upload_events
+from musetalk_worker import MuseTalkWorker, WorkerUnavailable
+
 # ----------  init  ----------
 load_dotenv()
 app = Flask(__name__)
@@ -31,7 +51,9 @@ socketio = SocketIO(
     app,
     cors_allowed_origins="*",
     async_mode='threading',
-    max_http_buffer_size=10**8,
+    # ⚡️ Audio / avatar arrivent par morceaux binaires (upload_chunk) : plus de
+    # message base64 de 100 Mo, un message ne dépasse pas un morceau
+    max_http_buffer_size=int(os.getenv('SOCKETIO_MAX_BUFFER', str(SOCKETIO_BUFFER_SIZE))),
     logger=False,
     engineio_logger=False,
     ping_timeout=60,  # 60 seconds
@@ -40,6 +62,7 @@ socketio = SocketIO(
 
 PUBLIC_URL      = os.getenv('PUBLIC_URL', 'https://magirl.fr').strip()
 ELEVENLABS_KEY  = os.getenv('ELEVENLABS_API_KEY', '').strip()
+ELEVENLABS_API_BASE = os.getenv('ELEVENLABS_API_BASE', 'https://api.elevenlabs.io').rstrip('/')
 OPENAI_API_KEY  = os.getenv('OPENAI_API_KEY', '').strip()
 
 MUSETALK_DIR    = Path(os.getenv('MUSETALK_DIR', '/app'))
@@ -48,6 +71,102 @@ UPLOAD_DIR      = Path('uploads')
 AVATARS_DIR     = Path('avatars')
 AUDIO_DIR       = Path('audio_recordings')
 MUSETALK_RESULTS = MUSETALK_DIR / 'results' / 'output' / 'v15'
+# Un dossier par job : <OUTPUT_DIR>/jobs/<job_id>/ et <MUSETALK_RESULTS>/jobs/<job_id>/
+JOBS_DIR         = OUTPUT_DIR / 'jobs'
+JOB_RESULTS_DIR  = MUSETALK_RESULTS / 'jobs'
+JOB_MANIFEST     = Path(os.getenv('JOB_MANIFEST', str(OUTPUT_DIR / 'jobs.jsonl')))
+
+# ⚡️ Mode d'inférence : 'worker' (process persistant, modèles chargés une fois)
+# ou 'subprocess' (un `python3 -m scripts.inference` par tour, fallback)
+MUSETALK_MODE       = os.getenv('MUSETALK_MODE', 'worker').strip().lower()
+MUSETALK_FPS        = int(os.getenv('MUSETALK_FPS', '15'))         # ⚡️ Optimisé: 25 → 15
+MUSETALK_BATCH_SIZE = int(os.getenv('MUSETALK_BATCH_SIZE', '2'))   # ⚡️ Optimisé: 4 → 2
+MUSETALK_FLOAT16    = os.getenv('MUSETALK_FLOAT16', '1') not in ('0', 'false', 'no')
+MUSETALK_TIMEOUT    = int(os.getenv('MUSETALK_TIMEOUT', '120'))
+MUSETALK_WORKER_SOCKET = os.getenv('MUSETALK_WORKER_SOCKET', '/tmp/musetalk_worker.sock')
+MUSETALK_WORKER_READY_TIMEOUT = int(os.getenv('MUSETALK_WORKER_READY_TIMEOUT', '30'))
+# Cache des avatars préparés (bbox, crops, latents) – mode worker uniquement
+MUSETALK_PREPARED_DIR = Path(os.getenv('MUSETALK_PREPARED_DIR', str(MUSETALK_DIR / 'results' / 'prepared')))
+MUSETALK_PREPARED_BUDGET_MB = int(os.getenv('MUSETALK_PREPARED_BUDGET_MB', '5120'))
+
+# Cache TTS (mp3 fournisseur + wav 16 kHz)
+TTS_CACHE_DIR       = Path(os.getenv('TTS_CACHE_DIR', str(OUTPUT_DIR / 'tts_cache')))
+TTS_CACHE_BUDGET_MB = int(os.getenv('TTS_CACHE_BUDGET_MB', '512'))
+TTS_MODELS = {'elevenlabs': 'eleven_multilingual_v2', 'openai': 'tts-1'}
+ELEVENLABS_VOICE_SETTINGS = {"stability": 0.5, "similarity_boost": 0.75}
+
+# Ordonnancement : pool borné pour les étapes I/O, slot(s) GPU pour MuseTalk
+JOB_IO_WORKERS           = int(os.getenv('JOB_IO_WORKERS', '4'))
+JOB_MAX_QUEUE            = int(os.getenv('JOB_MAX_QUEUE', '8'))
+# En mode worker, un process MuseTalk (modèles en VRAM) par slot
+MUSETALK_INFERENCE_SLOTS = int(os.getenv('MUSETALK_INFERENCE_SLOTS', '1'))
+
+# 🧹 Nettoyage disque en tâche de fond : budget (Mo) et âge max (s) par dossier,
+# surchargeables via STORAGE_<NOM>_MB / STORAGE_<NOM>_MAX_AGE (0 = illimité)
+JANITOR_INTERVAL = int(os.getenv('JANITOR_INTERVAL', '60'))
+JOB_MAX_AGE      = int(os.getenv('JOB_MAX_AGE', '3600'))
+
+
+# 📤 Publication des vidéos (en tâche de fond, après le chat_result) :
+# PUBLISH_SINKS = liste parmi ssh, local, http (vide = pas de copie hors du backend)
+PUBLISH_SINKS       = [x.strip() for x in os.getenv('PUBLISH_SINKS', 'ssh').split(',') if x.strip()]
+PUBLISH_WORKERS     = int(os.getenv('PUBLISH_WORKERS', '2'))
+PUBLISH_RETRIES     = int(os.getenv('PUBLISH_RETRIES', '3'))
+PUBLISH_SSH_TARGET  = os.getenv('PUBLISH_SSH_TARGET', 'ubuntu@51.75.125.105')
+PUBLISH_SSH_DIR     = os.getenv('PUBLISH_SSH_DIR', '/home/ubuntu/soulmate-creator-ai/public/exports')
+PUBLISH_SSH_KEY     = os.getenv('PUBLISH_SSH_KEY', '/root/.ssh/id_rsa')
+PUBLISH_SSH_TOOL    = os.getenv('PUBLISH_SSH_TOOL', 'scp')   # scp | rsync
+PUBLISH_PUBLIC_BASE = os.getenv('PUBLISH_PUBLIC_BASE', 'https://magirl.fr/exports')
+PUBLISH_LOCAL_DIR   = os.getenv('PUBLISH_LOCAL_DIR', 'exports')
+PUBLISH_HTTP_URL    = os.getenv('PUBLISH_HTTP_URL', '')
+PUBLISH_HTTP_TOKEN  = os.getenv('PUBLISH_HTTP_TOKEN', '')
+
+# 📥 Uploads par morceaux (Socket.IO binaire) : tailles max et durée de vie
+UPLOAD_CHUNKED_DIR    = UPLOAD_DIR / 'chunked'
+UPLOAD_CHUNK_SIZE     = int(os.getenv('UPLOAD_CHUNK_SIZE', str(256 * 1024)))
+UPLOAD_MAX_AUDIO_MB   = int(os.getenv('UPLOAD_MAX_AUDIO_MB', '20'))
+UPLOAD_MAX_AVATAR_MB  = int(os.getenv('UPLOAD_MAX_AVATAR_MB', '200'))
+UPLOAD_TTL            = int(os.getenv('UPLOAD_TTL', '3600'))
+
+# 🎞️ Service des médias : X-Accel-Redirect vers des locations nginx `internal`
+# (ex. MEDIA_ACCEL_RESULTS=/_media/results) ; vide = Flask sert les octets
+MEDIA_ACCEL_ROOTS = [
+    (MUSETALK_DIR / 'results', os.getenv('MEDIA_ACCEL_RESULTS', '')),
+    (OUTPUT_DIR, os.getenv('MEDIA_ACCEL_OUTPUTS', '')),
+]
+
+# 🌐 Appels fournisseurs : pool keep-alive partagé, délais connect / read et
+# réessais par étape (HTTP_<ÉTAPE>_TIMEOUT / _CONNECT_TIMEOUT / _RETRIES)
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '10'))
+HTTP_STAGES = [
+    HttpStage.from_env('transcription', read=30, retries=1),
+    HttpStage.from_env('chat', read=20, retries=1),
+    HttpStage.from_env('tts', read=20, retries=2),
+    HttpStage.from_env('avatar_download', read=30, retries=2),
+]
+
+# avatar_url : copie locale revalidée (ETag / Last-Modified), pas de requête
+# pendant AVATAR_URL_FRESH secondes après une validation
+AVATAR_URL_CACHE_DIR = AVATARS_DIR / 'url_cache'
+AVATAR_URL_FRESH     = float(os.getenv('AVATAR_URL_FRESH', '30'))
+
+# 🧭 Traces par job (spans de chaque étape) : une ligne JSON par job, fichier à rotation
+TRACE_LOG         = Path(os.getenv('TRACE_LOG', str(OUTPUT_DIR / 'traces.jsonl')))
+TRACE_LOG_MB      = int(os.getenv('TRACE_LOG_MB', '50'))
+TRACE_LOG_BACKUPS = int(os.getenv('TRACE_LOG_BACKUPS', '5'))
+
+# 🎙️ Pré-traitement avant Whisper : silences coupés (VAD par énergie), audio
+# vide refusé, envoi compressé (opus | flac | wav)
+VAD_THRESHOLD_DB   = float(os.getenv('VAD_THRESHOLD_DB', '12'))
+VAD_MIN_SPEECH_MS  = int(os.getenv('VAD_MIN_SPEECH_MS', '250'))
+TRANSCRIBE_CODEC   = os.getenv('TRANSCRIBE_CODEC', 'opus').strip().lower()
+
+# ⚡️ Pipeline par phrase (chat_segment) quand le client ne précise pas `pipelined` :
+# désactivé par défaut, PIPELINE_SEGMENTS=1 pour l'activer
+PIPELINE_SEGMENTS = os.getenv('PIPELINE_SEGMENTS', '0') not in ('0', 'false', 'no')
+# Vidéos publiées en mode pipeline : full (concaténée), segments, ou both.
+# Les clips restent servis par le backend (/results/<job_id>/…) dans tous les cas.
+PIPELINE_PUBLISH = os.getenv('PIPELINE_PUBLISH', 'full')
 
 for d in (OUTPUT_DIR, UPLOAD_DIR, AVATARS_DIR, AUDIO_DIR):
     d.mkdir(exist_ok=True)
@@ -59,11 +178,148 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-if OPENAI_API_KEY:
-    openai.api_key = OPENAI_API_KEY
+http_client = HttpClient(HTTP_STAGES, pool_size=HTTP_POOL_SIZE, openai_api_key=OPENAI_API_KEY or None)
+avatar_url_cache = UrlCache(
+    AVATAR_URL_CACHE_DIR,
+    http_client,
+    'avatar_download',
+    max_bytes=UPLOAD_MAX_AVATAR_MB * 1024 * 1024,
+    fresh=AVATAR_URL_FRESH
+)
+
+# 📈 Métriques Prometheus (/metrics) : durée / erreurs par étape, jauges calculées au scrape
+metrics_registry = Registry()
+# Chaque étape mesurée est aussi un span de la trace du job
+stage_metrics = StageMetrics(metrics_registry, 'musetalk', span=span)
+trace_log = TraceLog(TRACE_LOG, TRACE_LOG_MB * 1024 * 1024, TRACE_LOG_BACKUPS)
+jobs_total = metrics_registry.counter('musetalk_jobs_total', 'Jobs terminés par statut', ('status',))
+metrics_registry.gauge('musetalk_active_connections', 'Clients Socket.IO connectés').set_function(
+    lambda: len(active_connections)
+)
+metrics_registry.gauge('musetalk_queue_jobs', "Jobs par état (queued, running…)", ('state',)).set_function(
+    lambda: _queue_depth()
+)
+metrics_registry.gauge('musetalk_publish_pending', 'Vidéos en attente de publication').set_function(
+    lambda: publisher.pending
+)
+metrics_registry.gauge('musetalk_storage_bytes', 'Octets par dossier géré par le janitor', ('policy',)).set_function(
+    lambda: {name: policy['bytes'] for name, policy in janitor.stats()['policies'].items()}
+)
+metrics_registry.gauge('musetalk_disk_free_bytes', 'Espace libre sur le disque de travail').set_function(
+    lambda: shutil.disk_usage('.').free
+)
 
 active_connections = {}
 
+# Registre d'avatars adressé par contenu (avatar_id = sha256)
+avatar_store = AvatarStore(AVATARS_DIR / 'store')
+tts_cache = TtsCache(TTS_CACHE_DIR, TTS_CACHE_BUDGET_MB * 1024 * 1024)
+# Index des jobs (entrées, sorties, timings) : remplace les rglob + tri par mtime
+job_manifest = JobManifest(JOB_MANIFEST)
+# Uploads binaires par morceaux : audio référencé par upload_id dans chat_with_avatar,
+# avatar enregistré dès upload_finish (avatar_id dans l'acquittement)
+uploads = UploadStore(
+    UPLOAD_CHUNKED_DIR,
+    {'audio': UPLOAD_MAX_AUDIO_MB * 1024 * 1024, 'avatar': UPLOAD_MAX_AVATAR_MB * 1024 * 1024},
+    chunk_size=UPLOAD_CHUNK_SIZE,
+    ttl=UPLOAD_TTL
+)
+
+
+def _on_storage_evict(policy, path):
+    if policy in ('jobs', 'job_results'):
+        job_manifest.forget([path.name])
+
+
+def _on_publish_observed(sink, seconds, error):
+    # Copie scp / rsync (sink ssh), copie locale ou PUT HTTP
+    stage_metrics.observe(f'publish_{sink}', seconds)
+    if error is not None:
+        stage_metrics.error(f'publish_{sink}', error)
+
+
+def _build_publish_sinks():
+    sinks = []
+    for name in PUBLISH_SINKS:
+        if name == 'ssh':
+            sinks.append(SshSink(PUBLISH_SSH_TARGET, PUBLISH_SSH_DIR, PUBLISH_PUBLIC_BASE,
+                                 key_path=PUBLISH_SSH_KEY, tool=PUBLISH_SSH_TOOL))
+        elif name == 'local':
+            sinks.append(LocalDirSink(PUBLISH_LOCAL_DIR, PUBLISH_PUBLIC_BASE))
+        elif name == 'http' and PUBLISH_HTTP_URL:
+            headers = {'Authorization': f'Bearer {PUBLISH_HTTP_TOKEN}'} if PUBLISH_HTTP_TOKEN else None
+            sinks.append(HttpPutSink(PUBLISH_HTTP_URL, PUBLISH_PUBLIC_BASE, headers=headers))
+        else:
+            logger.warning("Sink de publication ignoré : %s", name)
+    return sinks
+
+
+def _on_published(context, urls, errors):
+    janitor.unpin(('publish', context['filename']))
+    url = next(iter(urls.values()))
+    update = {'published': {context['filename']: url}}
+    if errors:
+        # Copie réussie ailleurs, mais le client doit savoir quel sink a échoué
+        update['publish_errors'] = {context['filename']: errors}
+    job_manifest.update(context['job_id'], **update)
+    socketio.emit('video_published', dict(context, success=True, video_url=url, urls=urls, errors=errors),
+                  room=context['client_id'])
+
+
+def _on_publish_failed(context, errors):
+    janitor.unpin(('publish', context['filename']))
+    job_manifest.update(context['job_id'], publish_errors={context['filename']: errors})
+    socketio.emit('video_published', dict(context, success=False, errors=errors),
+                  room=context['client_id'])
+
+
+publisher = Publisher(
+    _build_publish_sinks(),
+    workers=PUBLISH_WORKERS,
+    retries=PUBLISH_RETRIES,
+    on_done=_on_published,
+    on_failed=_on_publish_failed,
+    observer=_on_publish_observed
+)
+
+
+janitor = StorageJanitor(interval=JANITOR_INTERVAL, on_evict=_on_storage_evict)
+janitor.add('jobs', JOBS_DIR, dirs=True, **storage_budget('jobs', 2048, JOB_MAX_AGE))
+janitor.add('job_results', JOB_RESULTS_DIR, dirs=True, **storage_budget('job_results', 4096, JOB_MAX_AGE))
+janitor.add('outputs', OUTPUT_DIR, ('*.mp3', '*.wav', '*.mp4', '*.webm'), **storage_budget('outputs', 512, 86400))
+janitor.add('audio_recordings', AUDIO_DIR, **storage_budget('audio_recordings', 256, 86400))
+janitor.add('uploads', UPLOAD_DIR, **storage_budget('uploads', 256, 86400))
+janitor.add('chunked_uploads', UPLOAD_CHUNKED_DIR, **storage_budget('chunked_uploads', 0, 86400))
+janitor.add('avatars', AVATARS_DIR, **storage_budget('avatars', 1024, 7 * 86400))
+# Avatars fournis avec le backend (clip par défaut / d'attente) : jamais évincés
+AVATAR_KEEP = [name.strip() for name in os.getenv('AVATAR_KEEP', 'sample.mp4').split(',') if name.strip()]
+janitor.pin('bundled_avatars', *(AVATARS_DIR / name for name in AVATAR_KEEP))
+janitor.add('avatar_store', AVATARS_DIR / 'store', **storage_budget('avatar_store', 4096, 0))
+janitor.add('avatar_url_cache', AVATAR_URL_CACHE_DIR, **storage_budget('avatar_url_cache', 1024, 7 * 86400))
+janitor.add('inference_configs', MUSETALK_DIR / 'configs' / 'inference', 'generated_*.yaml',
+            **storage_budget('inference_configs', 0, 3600))
+janitor.add('legacy_results', MUSETALK_RESULTS, '*.mp4', **storage_budget('legacy_results', 0, 3600))
+
+MUSETALK_WORKER_ARGS = {
+    'unet_model_path': 'models/musetalkV15/unet.pth',
+    'unet_config': 'models/musetalkV15/musetalk.json',
+    'version': 'v15',
+    'ffmpeg_path': '/usr/bin/ffmpeg',
+    'fps': MUSETALK_FPS,
+    'batch_size': MUSETALK_BATCH_SIZE,
+    'use_float16': MUSETALK_FLOAT16,
+    'prepared_dir': MUSETALK_PREPARED_DIR,
+    'prepared_budget_mb': MUSETALK_PREPARED_BUDGET_MB,
+}
+musetalk_workers = [
+    MuseTalkWorker(
+        MUSETALK_DIR,
+        MUSETALK_WORKER_SOCKET if i == 0 else f"{MUSETALK_WORKER_SOCKET}.{i}",
+        model_args=MUSETALK_WORKER_ARGS
+    )
+    for i in range(max(1, MUSETALK_INFERENCE_SLOTS))
+]
+
 AVAILABLE_VOICES = {
     'elevenlabs': [
         {'id': 'EXAVITQu4vr4xnSDxMaL', 'name': 'Sarah (Femme)', 'lang': 'fr'},
@@ -81,9 +337,79 @@ AVAILABLE_VOICES = {
     ]
 }
 
+def emit_status(client_id, payload):
+    """Événement `status` vers le client (étape courante reportée dans /api/queue)."""
+    scheduler.set_stage(payload.get('stage'))
+    job = scheduler.current_job()
+    if job is not None:
+        payload = dict(payload, job_id=job.id)
+    trace = current_trace()
+    if trace.trace_id:
+        # Temps réel écoulé + spans terminés depuis le statut précédent
+        payload = dict(payload, trace_id=trace.trace_id, elapsed_ms=trace.elapsed_ms(), spans=trace.take_new())
+    socketio.emit('status', payload, room=client_id)
+
+
+def _queue_depth():
+    depth = {'queued': 0, 'running': 0, 'inference': 0, 'waiting_inference': 0, 'waiting_io': 0}
+    snapshot = scheduler.snapshot()
+    for entry in snapshot['running'] + snapshot['pending']:
+        depth[entry['state']] = depth.get(entry['state'], 0) + 1
+    return depth
+
+
+def _on_inference_wait(job, position, eta):
+    if job.client_id is None:
+        return
+    socketio.emit(
+        'status',
+        {
+            'stage': 'queued',
+            'message': f"En file d'attente GPU (position {position})…",
+            'job_id': job.id,
+            'queue_position': position,
+            'eta_seconds': eta
+        },
+        room=job.client_id
+    )
+
+
+scheduler = JobScheduler(
+    io_workers=JOB_IO_WORKERS,
+    inference_slots=MUSETALK_INFERENCE_SLOTS,
+    max_queue=JOB_MAX_QUEUE,
+    on_wait=_on_inference_wait
+)
+
+
 # ==================== WEBSOCKET HANDLERS ====================
+def register_avatar_upload(upload):
+    """
+    Hook de `upload_finish` : un avatar terminé part tout de suite dans le
+    registre, et le client reçoit son `avatar_id` dans l'acquittement. Il ne
+    renvoie plus l'avatar aux tours suivants, même si le premier est rejeté
+    (`no_speech`) ou encore en file.
+    """
+    if upload.kind != 'avatar':
+        return None
+    upload = uploads.consume(upload.id, 'avatar')
+    try:
+        avatar_id, _, _ = avatar_store.put_file(upload.path, upload.ext, upload.digest)
+    except OSError as e:
+        logger.error("Enregistrement de l'avatar %s impossible : %s", upload.id[:8], e)
+        upload.path.unlink(missing_ok=True)
+        raise UploadError('avatar_store_failed', "Enregistrement de l'avatar impossible") from e
+    return {'avatar_id': avatar_id}
+
+
+# upload_begin / upload_chunk / upload_status / upload_finish / upload_abort
+register_upload_events(socketio, uploads, on_finish=register_avatar_upload)
+
+
 @socketio.on('connect')
 def handle_connect():
+    # Le transport Socket.IO ne passe pas par before_request
+    start_background_services()
     client_id = request.sid
     logger.info("NOUVELLE CONNEXION %s", client_id)
     active_connections[client_id] = {
@@ -109,25 +435,59 @@ def handle_chat_with_avatar(data):
     client_id = request.sid
     logger.info("CHAT_FROM %s", client_id)
     try:
-        threading.Thread(
-            target=process_chat_with_avatar_local,
-            args=(
-                client_id,
-                data['audio_data'],
-                data.get('avatar_data'),
-                data.get('avatar_filename'),
-                data.get('avatar_type'),
-                data.get('avatar_url'),
-                data.get('voice_provider', 'elevenlabs'),
-                data.get('voice_id', 'EXAVITQu4vr4xnSDxMaL'),
-                data.get('conversation_history', []),
-                data.get('bbox_shift', 0)
-            ),
-            daemon=True
-        ).start()
+        # Uploads référencés par id : vérifiés avant la mise en file
+        if data.get('audio_upload_id'):
+            uploads.get(data['audio_upload_id'], 'audio')
+        if not data.get('audio_upload_id') and not data.get('audio_data'):
+            raise UploadError('audio_missing', 'Aucun audio fourni (audio_upload_id)')
+
+        job = scheduler.submit(
+            client_id,
+            process_chat_with_avatar_local,
+            client_id,
+            data.get('audio_data'),
+            data.get('avatar_data'),
+            data.get('avatar_filename'),
+            data.get('avatar_type'),
+            data.get('avatar_url'),
+            data.get('avatar_id'),
+            data.get('voice_provider', 'elevenlabs'),
+            data.get('voice_id', 'EXAVITQu4vr4xnSDxMaL'),
+            data.get('conversation_history', []),
+            data.get('bbox_shift', 0),
+            data.get('pipelined', PIPELINE_SEGMENTS),
+            audio_upload_id=data.get('audio_upload_id')
+        )
+    except UploadError as e:
+        socketio.emit('error', {'message': str(e), 'code': e.code}, room=client_id)
+        return
+    except QueueFull as e:
+        # ⚡️ Refus immédiat plutôt qu'un timeout 2 minutes plus tard
+        logger.warning("CHAT REFUSÉ %s : %s", client_id, e)
+        socketio.emit(
+            'error',
+            {'message': 'Serveur saturé, réessayez dans quelques instants', 'code': 'queue_full'},
+            room=client_id
+        )
+        return
     except Exception as e:
         logger.exception("Erreur lors du traitement de chat_with_avatar")
         socketio.emit('error', {'message': f'{type(e).__name__}: {str(e)}'}, room=client_id)
+        return
+
+    position, eta = scheduler.queue_status(job)
+    socketio.emit(
+        'status',
+        {
+            'stage': 'queued',
+            'message': "En file d'attente…" if position else 'Démarrage…',
+            'progress': 0,
+            'job_id': job.id,
+            'queue_position': position,
+            'eta_seconds': eta
+        },
+        room=client_id
+    )
 
 def process_chat_with_avatar_local(
     client_id,
@@ -136,76 +496,185 @@ def process_chat_with_avatar_local(
     avatar_filename,
     avatar_type,
     avatar_url,
+    avatar_id,
     voice_provider,
     voice_id,
     conversation_history,
-    bbox_shift
+    bbox_shift,
+    pipelined=False,
+    audio_upload_id=None
 ):
+    ws = None
+    # 🧭 Trace du job : spans de chaque étape, joints aux `status` / `chat_result`
+    trace = Trace(client_id=client_id, pipelined=bool(pipelined))
+    trace_token = attach(trace)
     try:
-        ts = datetime.now().strftime('%Y%m%d_%H%M%S')
-
-        # 1. audio utilisateur (webm/base64 -> wav)
-        socketio.emit(
-            'status',
-            {'stage': 'saving_audio', 'message': 'Sauvegarde audio…', 'progress': 5},
-            room=client_id
+        job_start = time.time()
+        timings = {}
+        # ⚡️ Dossier de travail propre au job : aucun fichier partagé entre jobs
+        job = scheduler.current_job()
+        ws = JobWorkspace(job.id if job else uuid.uuid4().hex[:12], JOBS_DIR, JOB_RESULTS_DIR)
+        trace.attrs['job_id'] = ws.job_id
+        # Le janitor ne touche pas aux fichiers du job tant qu'il tourne
+        janitor.pin(ws.job_id, ws.dir, ws.result_dir)
+        job_manifest.update(
+            ws.job_id,
+            client_id=client_id,
+            status='running',
+            created_at=job_start,
+            trace_id=trace.trace_id,
+            inputs={
+                'voice_provider': voice_provider,
+                'voice_id': voice_id,
+                'bbox_shift': bbox_shift,
+                'pipelined': bool(pipelined),
+            }
         )
 
-        if audio_data.startswith('data:'):
-            audio_data = audio_data.split(',')[1]
-        raw = base64.b64decode(audio_data)
-        audio_input_path = AUDIO_DIR / f"user_{ts}.webm"
-        audio_input_path.write_bytes(raw)
-
-        user_wav = AUDIO_DIR / f"user_{ts}.wav"
-        subprocess.run(
-            ['ffmpeg', '-y', '-i', str(audio_input_path), '-ar', '16000', '-ac', '1', str(user_wav)],
-            check=True,
-            capture_output=True,
-            text=True
+        # 1. audio utilisateur (upload binaire ou base64 historique -> wav)
+        emit_status(
+            client_id,
+            {'stage': 'saving_audio', 'message': 'Sauvegarde audio…', 'progress': 5}
         )
 
+        with stage_metrics.stage('audio_save', source='upload' if audio_upload_id else 'base64') as attrs:
+            if audio_upload_id:
+                # ⚡️ Déjà sur disque : simple déplacement dans le dossier du job
+                upload = uploads.consume(audio_upload_id, 'audio')
+                audio_input_path = ws.path(f'user.{upload.ext}')
+                shutil.move(str(upload.path), str(audio_input_path))
+                raw = audio_input_path.read_bytes()
+            else:
+                if audio_data.startswith('data:'):
+                    audio_data = audio_data.split(',')[1]
+                raw = base64.b64decode(audio_data)
+                audio_input_path = ws.path('user.webm')
+                audio_input_path.write_bytes(raw)
+            attrs['bytes'] = len(raw)
+
+        # ⚡️ Décodage en mémoire (PyAV + NumPy), plus de ffmpeg ni de wav temporaire
+        with stage_metrics.stage('decode') as attrs:
+            user_pcm = decode_user_audio(raw, audio_input_path)
+            # 🎙️ Silences de début / fin coupés avant tout appel API
+            speech, _, _ = trim_silence(user_pcm, threshold_db=VAD_THRESHOLD_DB, min_speech_ms=VAD_MIN_SPEECH_MS)
+            audio_seconds = round(duration_seconds(user_pcm), 3)
+            speech_seconds = round(duration_seconds(speech), 3)
+            attrs.update(audio_seconds=audio_seconds, speech_seconds=speech_seconds)
+        timings['audio'] = round(time.time() - job_start, 3)
+
+        if not len(speech):
+            # Enregistrement accidentel / silence : pas de pipeline complet pour rien
+            job_manifest.update(
+                ws.job_id,
+                status='rejected',
+                error='no_speech',
+                inputs={'audio_seconds': audio_seconds, 'speech_seconds': 0.0}
+            )
+            trace.finish('rejected')
+            socketio.emit(
+                'error',
+                {
+                    'message': 'Aucune parole détectée',
+                    'code': 'no_speech',
+                    'audio_seconds': audio_seconds,
+                    'trace_id': trace.trace_id,
+                },
+                room=client_id
+            )
+            jobs_total.inc(status='rejected')
+            return
+
         # 2. avatar
-        socketio.emit(
-            'status',
-            {'stage': 'saving_avatar', 'message': 'Sauvegarde avatar…', 'progress': 10},
-            room=client_id
+        emit_status(
+            client_id,
+            {'stage': 'saving_avatar', 'message': 'Sauvegarde avatar…', 'progress': 10}
         )
 
-        if avatar_data:
-            if avatar_data.startswith('data:'):
-                avatar_data = avatar_data.split(',')[1]
-            ext = avatar_filename.rsplit('.', 1)[-1] if avatar_filename and '.' in avatar_filename else 'mp4'
-            avatar_path = AVATARS_DIR / f"avatar_{ts}.{ext}"
-            avatar_path.write_bytes(base64.b64decode(avatar_data))
-        elif avatar_url:
-            avatar_path = AVATARS_DIR / f"avatar_{ts}.mp4"
-            avatar_path.write_bytes(requests.get(avatar_url).content)
-        else:
-            raise FileNotFoundError("Aucun avatar fourni")
+        avatar_source = next(
+            (name for name, value in (('id', avatar_id), ('base64', avatar_data), ('url', avatar_url)) if value),
+            None
+        )
+        with stage_metrics.stage('avatar', source=avatar_source) as attrs:
+            if avatar_id:
+                avatar_path = avatar_store.path(avatar_id)
+                if avatar_path is None:
+                    # Le client doit renvoyer l'avatar (avatar_data / upload_avatar)
+                    job_manifest.update(ws.job_id, status='failed', error='avatar_not_found')
+                    trace.finish('failed')
+                    socketio.emit(
+                        'error',
+                        {'message': f'Avatar inconnu: {avatar_id}', 'code': 'avatar_not_found'},
+                        room=client_id
+                    )
+                    jobs_total.inc(status='failed')
+                    return
+            elif avatar_data:
+                if avatar_data.startswith('data:'):
+                    avatar_data = avatar_data.split(',')[1]
+                ext = avatar_filename.rsplit('.', 1)[-1] if avatar_filename and '.' in avatar_filename else 'mp4'
+                avatar_id, avatar_path, _ = avatar_store.put_bytes(base64.b64decode(avatar_data), ext)
+                # ⚡️ Le client peut désormais n'envoyer que l'avatar_id
+                socketio.emit('avatar_registered', {'avatar_id': avatar_id}, room=client_id)
+            elif avatar_url:
+                # ⚡️ Copie locale revalidée (304) au lieu d'un téléchargement complet à
+                # chaque tour ; écrite par blocs, jamais entièrement en mémoire
+                avatar_path = avatar_url_cache.fetch(avatar_url)
+            else:
+                raise FileNotFoundError("Aucun avatar fourni")
+            attrs['bytes'] = Path(avatar_path).stat().st_size
+        janitor.pin(ws.job_id, avatar_path)
+
+        job_manifest.update(
+            ws.job_id,
+            inputs={
+                'audio_sha256': hashlib.sha256(raw).hexdigest(),
+                'audio_seconds': audio_seconds,
+                'speech_seconds': speech_seconds,
+                'avatar_id': avatar_id,
+                'avatar_url': avatar_url if not avatar_id else None,
+            }
+        )
 
         # 3. Transcription
-        socketio.emit(
-            'status',
-            {'stage': 'transcription', 'message': 'Transcription…', 'progress': 20},
-            room=client_id
+        emit_status(
+            client_id,
+            {'stage': 'transcription', 'message': 'Transcription…', 'progress': 20}
         )
 
-        user_text = openai.audio.transcriptions.create(
-            model="whisper-1",
-            file=open(user_wav, "rb"),
-            language="fr"
-        ).text
+        t = time.time()
+        # ⚡️ opus 16 kHz : ~10× moins d'octets envoyés que le wav
+        with stage_metrics.stage('encode', codec=TRANSCRIBE_CODEC) as attrs:
+            upload_name, upload_bytes = encode_for_transcription(speech, TRANSCRIBE_CODEC)
+            attrs['bytes'] = len(upload_bytes)
+        timings['encode'] = round(time.time() - t, 3)
+        t = time.time()
+        with stage_metrics.stage('transcription', request_bytes=len(upload_bytes)) as attrs:
+            user_text = http_client.openai('transcription').audio.transcriptions.create(
+                model="whisper-1",
+                file=(upload_name, upload_bytes),
+                language="fr"
+            ).text
+            attrs['response_chars'] = len(user_text)
+        timings['transcription'] = round(time.time() - t, 3)
+        job_manifest.update(ws.job_id, inputs={'transcription_bytes': len(upload_bytes)})
 
-        socketio.emit('transcription', {'text': user_text}, room=client_id)
-
-        # 4. Réponse GPT
         socketio.emit(
-            'status',
-            {'stage': 'ai_response', 'message': 'Génération réponse…', 'progress': 35},
+            'transcription',
+            {
+                'text': user_text,
+                'audio_seconds': audio_seconds,
+                'speech_seconds': speech_seconds,
+                'trimmed_seconds': round(audio_seconds - speech_seconds, 3),
+            },
             room=client_id
         )
 
+        # 4. Réponse GPT
+        emit_status(
+            client_id,
+            {'stage': 'ai_response', 'message': 'Génération réponse…', 'progress': 35}
+        )
+
         messages = [{
             "role": "system",
             "content": (
@@ -217,166 +686,409 @@ def process_chat_with_avatar_local(
         messages.extend(conversation_history[-10:])
         messages.append({"role": "user", "content": user_text})
 
-        ai_response = openai.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages,
-            max_tokens=100,  # ⚡️ Optimisé: 150 → 100 pour réponses plus courtes
-            temperature=0.7
-        ).choices[0].message.content
-
-        socketio.emit('ai_response', {'text': ai_response}, room=client_id)
-
-        # 5. TTS
-        socketio.emit(
-            'status',
-            {'stage': 'tts', 'message': 'Synthèse vocale…', 'progress': 50},
-            room=client_id
-        )
-
-        tts_path = generate_tts(ai_response, voice_provider, voice_id, ts)
-
-        tts_wav = OUTPUT_DIR / f"tts_{ts}.wav"
-        # ⚡️ Conversion audio optimisée
-        subprocess.run(
-            [
-                'ffmpeg', '-y', '-i', str(tts_path),
-                '-ar', '16000',
-                '-ac', '1',              # mono
-                '-acodec', 'pcm_s16le',  # codec direct
-                '-threads', '2',          # parallélisation
-                str(tts_wav)
-            ],
-            check=True,
-            capture_output=True,
-            text=True
-        )
+        # ⚡️ Streaming : deltas envoyés au front, et en mode pipeline la première
+        # phrase part en TTS avant la fin de la génération
+        llm = ChatStream(client_id, messages)
 
-        # 6. MuseTalk – fichiers « latest »
-        socketio.emit(
-            'status',
-            {
-                'stage': 'avatar_generation',
-                'message': 'Génération vidéo avatar…',
-                'progress': 65
-            },
-            room=client_id
+        # 5. TTS + 6. MuseTalk
+        t = time.time()
+        if pipelined:
+            result = render_pipelined(client_id, llm.sentences(), avatar_path, voice_provider, voice_id, bbox_shift, ws)
+            ai_response = llm.text
+        else:
+            ai_response = llm.collect()
+            timings['ai_response'] = round(time.time() - t, 3)
+            t = time.time()
+            result = render_single(client_id, ai_response, avatar_path, voice_provider, voice_id, bbox_shift, ws)
+        timings['render'] = round(time.time() - t, 3)
+        timings['total'] = round(time.time() - job_start, 3)
+
+        job_manifest.update(
+            ws.job_id,
+            status='done',
+            finished_at=time.time(),
+            video=result['filename'],
+            tts_seconds=round(wav_duration(result['audio_path']), 3),
+            segments=result.get('segments', 1),
+            timings=timings
         )
 
-        latest_avatar = AVATARS_DIR / 'video_latest.mp4'
-        latest_audio = OUTPUT_DIR / 'audio_latest.wav'
-        shutil.copy2(avatar_path, latest_avatar)
-        shutil.copy2(tts_wav, latest_audio)
-
-        # Appel MuseTalk avec mesure de performance
-        import time
-        musetalk_start = time.time()
-        video_url = run_musetalk_local(latest_avatar, latest_audio, bbox_shift)
-        musetalk_duration = time.time() - musetalk_start
-        logger.info("⏱️ Temps total génération avatar: %.2f secondes", musetalk_duration)
-
-        # 7. renvoi au FRONT
-
-        # On récupère le nom du fichier à partir de l'URL retournée
-        out_name = Path(video_url).name
-
-        # On reconstitue le chemin local de la vidéo dans le conteneur
-        try:
-            # On cherche d'abord la vidéo dans le dossier de résultats de MuseTalk
-            candidates = list(MUSETALK_RESULTS.rglob(out_name))
-            if candidates:
-                result_video_path = candidates[-1]
-            else:
-                # fallback raisonnable si pas trouvé en rglob
-                result_video_path = MUSETALK_RESULTS / "v15" / out_name
-        except Exception:
-            result_video_path = MUSETALK_RESULTS / "v15" / out_name
-
-        # Tentative d'envoi direct vers le FRONT via SCP
-        public_video_url = None
-        try:
-            scp_cmd = [
-                "/usr/bin/scp",
-                "-i", "/root/.ssh/id_rsa",
-                "-o", "StrictHostKeyChecking=no",
-                str(result_video_path),
-                f"ubuntu@51.75.125.105:/home/ubuntu/soulmate-creator-ai/public/exports/{out_name}",
-            ]
-            logger.info("SCP → FRONT : %s", " ".join(scp_cmd))
-            subprocess.run(scp_cmd, check=True, capture_output=True, text=True)
-            public_video_url = f"https://magirl.fr/exports/{out_name}"
-            logger.info("Vidéo copiée sur FRONT : %s", public_video_url)
-        except Exception as scp_err:
-            logger.warning("Échec SCP vers FRONT, fallback URL backend : %s", scp_err)
-
-        # Si SCP échoue, on retombe sur l’URL servie par le back
-        if not public_video_url:
-            public_video_url = f"/results/output/v15/{out_name}"
-
-        # (optionnel) copie dans OUTPUT_DIR si tu utilises encore /api/download/<filename>
-        out_path = OUTPUT_DIR / out_name
-        try:
-            shutil.copy2(result_video_path, out_path)
-        except Exception as copy_err:
-            logger.warning("Impossible de copier la vidéo dans OUTPUT_DIR : %s", copy_err)
         # Statut final
-        socketio.emit(
-            'status',
+        emit_status(
+            client_id,
             {
                 'stage': 'complete',
                 'message': 'Réponse générée !',
                 'progress': 100
-            },
-            room=client_id
+            }
         )
 
+        trace.finish('done')
+
         # ⚡️ ÉVÉNEMENT PRINCIPAL : on pousse la vidéo au front
-        socketio.emit(
-            'chat_result',
-            {
-                'success': True,
-                'user_text': user_text,
-                'ai_response': ai_response,
-                'audio_url': f"/api/audio/{tts_path.name}",
-                # URL utilisée pour <video src="..."> côté front
-                'video_url': public_video_url,
-                # Infos supplémentaires
-                'local_video_path': str(result_video_path),
-                'filename': out_name,
-                'download_url': f"/api/download/{out_name}",
-                'timestamp': datetime.now().isoformat()
-            },
-            room=client_id
-        )
+        with stage_metrics.stage('emit'):
+            socketio.emit(
+                'chat_result',
+                {
+                    'success': True,
+                    'user_text': user_text,
+                    'ai_response': ai_response,
+                    'job_id': ws.job_id,
+                    'audio_url': result['audio_url'],
+                    # URL utilisée pour <video src="..."> côté front
+                    'video_url': result['video_url'],
+                    # Infos supplémentaires
+                    'local_video_path': result['local_video_path'],
+                    'filename': result['filename'],
+                    'download_url': f"/api/download/{ws.job_id}",
+                    'segments': result.get('segments', 1),
+                    'timestamp': datetime.now().isoformat(),
+                    # 🧭 Spans du tour (étapes et sous-étapes, durées réelles)
+                    'trace_id': trace.trace_id,
+                    'trace': trace.as_dict()
+                },
+                room=client_id
+            )
+        jobs_total.inc(status='done')
+        stage_metrics.observe('job', time.time() - job_start)
         logger.info("TRAITEMENT TERMINÉ %s", client_id)
-        # 6. MuseTalk – fichiers "latest"
-        # 👉 Envoi de l’URL de la vidéo au front
 
     except Exception as e:
         logger.exception("ERREUR TRAITEMENT")
-        socketio.emit('error', {'message': f'{type(e).__name__}: {str(e)}'}, room=client_id)
+        jobs_total.inc(status='failed')
+        trace.finish('failed')
+        if ws is not None:
+            job_manifest.update(ws.job_id, status='failed', error=f'{type(e).__name__}: {e}')
+        socketio.emit('error', {'message': f'{type(e).__name__}: {str(e)}', 'trace_id': trace.trace_id}, room=client_id)
+    finally:
+        if ws is not None:
+            janitor.unpin(ws.job_id)
+        if trace.status is None:
+            trace.finish('failed')
+        detach(trace_token)
+        try:
+            trace_log.write(trace)
+        except Exception:
+            logger.exception("Écriture de la trace %s impossible", trace.trace_id)
+
+
+def render_single(client_id, ai_response, avatar_path, voice_provider, voice_id, bbox_shift, ws):
+    """TTS de toute la réponse puis une seule vidéo MuseTalk."""
+    # 5. TTS
+    emit_status(
+        client_id,
+        {'stage': 'tts', 'message': 'Synthèse vocale…', 'progress': 50}
+    )
+
+    tts_path, tts_wav = generate_tts_cached(ai_response, voice_provider, voice_id, ws.path('tts'))
+
+    # 6. MuseTalk – entrées et sortie propres au job
+    emit_status(
+        client_id,
+        {
+            'stage': 'avatar_generation',
+            'message': 'Génération vidéo avatar…',
+            'progress': 65
+        }
+    )
+
+    # Appel MuseTalk avec mesure de performance
+    out_name = f"chat_{ws.job_id}.mp4"
+    musetalk_start = time.time()
+    result_video_path = run_musetalk_local(avatar_path, tts_wav, bbox_shift, ws.result_dir, out_name)
+    musetalk_duration = time.time() - musetalk_start
+    logger.info("⏱️ Temps total génération avatar: %.2f secondes", musetalk_duration)
+
+    # 7. renvoi au FRONT
+    return {
+        'audio_url': output_url('/api/audio', tts_path),
+        'audio_path': tts_wav,
+        'video_url': publish_video(client_id, result_video_path, ws),
+        'local_video_path': str(result_video_path),
+        'filename': out_name,
+    }
+
+
+def render_pipelined(client_id, sentences, avatar_path, voice_provider, voice_id, bbox_shift, ws):
+    """
+    Rendu phrase par phrase : chaque phrase part en TTS dès qu'elle est complète
+    (`sentences` peut être le flux GPT en cours), et MuseTalk rend la phrase N
+    pendant la TTS de la phrase N+1. Chaque clip est émis via `chat_segment`
+    dès qu'il est rendu, puis `chat_segments_done` donne le nombre total ; les
+    clips sont ensuite concaténés pour le `chat_result` final.
+    """
+    segments = []
+    ready = queue.Queue()
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='tts-prefetch') as tts_pool:
+
+        def feed():
+            # Consomme les phrases (éventuellement en streaming) et lance leur TTS
+            try:
+                for i, sentence in enumerate(sentences):
+                    ready.put((i, sentence, tts_pool.submit(
+                        bind(generate_tts_cached), sentence, voice_provider, voice_id, ws.path(f"tts_{i}")
+                    )))
+                ready.put(None)
+            except Exception as e:
+                ready.put(e)
+
+        threading.Thread(target=bind(feed), daemon=True).start()
+
+        while True:
+            item = ready.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            index, sentence, pending = item
+            emit_status(
+                client_id,
+                {
+                    'stage': 'avatar_generation',
+                    'message': f'Génération vidéo avatar (phrase {index + 1})…',
+                    'progress': min(95, 50 + 15 * index),
+                    'segment': index
+                }
+            )
+
+            tts_path, tts_wav = pending.result()
+            musetalk_start = time.time()
+            result_video_path = run_musetalk_local(
+                avatar_path, tts_wav, bbox_shift, ws.result_dir, f"chat_{ws.job_id}_{index}.mp4"
+            )
+            logger.info("⏱️ Segment %d généré en %.2f secondes", index + 1, time.time() - musetalk_start)
+
+            # ⚡️ Émis tout de suite : sans attendre que GPT ait fini la phrase suivante
+            segment = {
+                'index': index,
+                'text': sentence,
+                'audio_url': output_url('/api/audio', tts_path),
+                'video_url': publish_video(client_id, result_video_path, ws, segment=index,
+                                           publish=PIPELINE_PUBLISH in ('segments', 'both')),
+                'filename': result_video_path.name,
+            }
+            socketio.emit('chat_segment', segment, room=client_id)
+            segments.append((segment, result_video_path, tts_wav))
+
+    if not segments:
+        raise RuntimeError("Réponse GPT vide")
+    socketio.emit('chat_segments_done', {'job_id': ws.job_id, 'total': len(segments)}, room=client_id)
+
+    # Vidéo et audio complets pour les clients qui ne gèrent pas les segments
+    out_name = f"chat_{ws.job_id}.mp4"
+    full_video = ws.result_dir / out_name
+    concat_videos([path for _, path, _ in segments], full_video)
+    full_wav = ws.path('tts.wav')
+    concat_wavs([wav for _, _, wav in segments], full_wav)
+
+    return {
+        'audio_url': output_url('/api/audio', full_wav),
+        'audio_path': full_wav,
+        'video_url': publish_video(client_id, full_video, ws, publish=PIPELINE_PUBLISH in ('full', 'both')),
+        'local_video_path': str(full_video),
+        'filename': out_name,
+        'segments': len(segments),
+    }
+
+
+class ChatStream:
+    """
+    Complétion GPT en streaming : émet `ai_response_delta` à chaque token,
+    `ai_response` à la fin, et découpe le texte en phrases au fil de l'eau.
+    """
+
+    def __init__(self, client_id, messages):
+        self.client_id = client_id
+        self.messages = messages
+        self.text = ''
+
+    def deltas(self):
+        with stage_metrics.stage('llm', model="gpt-4o-mini") as attrs:
+            start = time.time()
+            chunks = 0
+            stream = http_client.openai('chat').chat.completions.create(
+                model="gpt-4o-mini",
+                messages=self.messages,
+                max_tokens=100,  # ⚡️ Optimisé: 150 → 100 pour réponses plus courtes
+                temperature=0.7,
+                stream=True
+            )
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if not self.text:
+                        stage_metrics.observe('llm_first_token', time.time() - start)
+                        attrs['first_token_ms'] = round((time.time() - start) * 1000, 1)
+                    chunks += 1
+                    self.text += delta
+                    socketio.emit('ai_response_delta', {'delta': delta, 'text': self.text}, room=self.client_id)
+                    yield delta
+            self.text = self.text.strip()
+            attrs.update(chunks=chunks, response_chars=len(self.text))
+            socketio.emit('ai_response', {'text': self.text}, room=self.client_id)
+
+    def sentences(self, min_chars=25):
+        """Chaque phrase est rendue dès sa ponctuation finale reçue."""
+        buf = ''
+        for delta in self.deltas():
+            buf += delta
+            match = _SENTENCE_END.search(buf, min_chars)
+            while match:
+                yield buf[:match.start()].strip()
+                buf = buf[match.end():]
+                match = _SENTENCE_END.search(buf, min_chars)
+        if buf.strip():
+            yield buf.strip()
+
+    def collect(self):
+        for _ in self.deltas():
+            pass
+        return self.text
+
+
+_SENTENCE_END = re.compile(r'(?<=[.!?…])\s+')
+
+
+def output_url(prefix, path):
+    """URL relative d'un fichier de OUTPUT_DIR (ex. /api/audio/jobs/<job_id>/tts.mp3)."""
+    return f"{prefix}/{Path(path).relative_to(OUTPUT_DIR).as_posix()}"
+
+
+def results_url(job_id, name):
+    """URL /results/<job_id>/<fichier>, résolue via le manifeste des jobs."""
+    return f"/results/{job_id}/{name}"
+
+
+def publish_video(client_id, result_video_path, ws, segment=None, publish=True):
+    """
+    Enregistre la vidéo dans le manifeste du job et retourne tout de suite
+    l'URL servie par le backend (/results/<job_id>/…). La copie vers le FRONT
+    part dans la file de publication ; `video_published` suit à la fin de la copie.
+    `publish=False` : servie par le backend seulement, pas de copie.
+    """
+    out_name = result_video_path.name  # unique : contient le job_id
+    job_manifest.add_output(ws.job_id, out_name, result_video_path)
+    if not publish:
+        return results_url(ws.job_id, out_name)
+    # Épinglée avant submit (le callback peut passer avant le retour de submit) ;
+    # sans sink, rien ne sera publié ni désépinglé par un callback
+    janitor.pin(('publish', out_name), result_video_path)
+    future = publisher.submit(result_video_path, out_name, {
+        'client_id': client_id,
+        'job_id': ws.job_id,
+        'filename': out_name,
+        'segment': segment,
+    })
+    if future is None:
+        janitor.unpin(('publish', out_name))
+    return results_url(ws.job_id, out_name)
+
+
+def concat_videos(paths, dest):
+    """Concatène des mp4 de même encodage (demuxer concat, sans réencodage)."""
+    list_path = dest.with_suffix('.txt')
+    list_path.write_text("".join(f"file '{Path(p).resolve()}'\n" for p in paths), encoding='utf-8')
+    try:
+        run_subprocess(
+            'ffmpeg_concat',
+            ['ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0',
+             '-i', str(list_path), '-c', 'copy', str(dest)],
+            check=True,
+            capture_output=True,
+            text=True
+        )
+    finally:
+        list_path.unlink(missing_ok=True)
+
+
+def concat_wavs(paths, dest):
+    """Concatène des wav de mêmes paramètres (16 kHz mono s16)."""
+    with wave.open(str(dest), 'wb') as out:
+        for i, path in enumerate(paths):
+            with wave.open(str(path), 'rb') as w:
+                if i == 0:
+                    out.setparams(w.getparams())
+                out.writeframes(w.readframes(w.getnframes()))
 
 
 # ----------  MuseTalk shell call  ----------
-def run_musetalk_local(avatar_path: str, audio_path: str, bbox_shift: int = 0) -> str:
+def run_musetalk_local(avatar_path, audio_path, bbox_shift, result_dir, result_name):
+    """
+    Appelle MuseTalk via le worker persistant (MUSETALK_MODE=worker) ou, en
+    fallback, via scripts.inference en subprocess.
+    Retourne le chemin (déterministe) de la vidéo : <result_dir>/v15/<result_name>.
+    """
+    # ⏱️ Mesure du temps de génération
+    start_time = time.time()
+
+    # MUSETALK_INFERENCE_SLOTS rendus GPU en parallèle au plus, dans l'ordre d'arrivée
+    with scheduler.inference_slot() as job:
+        wait = time.time() - start_time
+        stage_metrics.observe('inference_wait', wait)
+        current_trace().add_span('inference_wait', start_time, wait, parent_id=current_trace().current_span_id(),
+                                 slot=job.slot)
+        with stage_metrics.stage('inference', mode=MUSETALK_MODE, slot=job.slot):
+            final_video = _run_musetalk(avatar_path, audio_path, bbox_shift, result_dir, result_name, job.slot)
+
+    generation_time = time.time() - start_time
+    logger.info("⏱️ Temps de génération MuseTalk: %.2f secondes", generation_time)
+    logger.info("MuseTalk vidéo générée : %s", final_video)
+    return final_video
+
+
+def _run_musetalk(avatar_path, audio_path, bbox_shift, result_dir, result_name, slot):
+    """Worker du slot si disponible, sinon subprocess. Retourne le Path de la vidéo."""
+    output_path = Path(result_dir) / 'v15' / result_name
+    if MUSETALK_MODE == 'worker':
+        worker = musetalk_workers[slot % len(musetalk_workers)]
+        try:
+            reply = worker.run_job(
+                {
+                    'video_path': str(Path(avatar_path)),
+                    'audio_path': str(Path(audio_path)),
+                    'bbox_shift': int(bbox_shift),
+                    'result_dir': str(result_dir),
+                    'result_name': result_name,
+                    'fps': MUSETALK_FPS,
+                    'batch_size': MUSETALK_BATCH_SIZE,
+                    'use_float16': MUSETALK_FLOAT16,
+                },
+                timeout=MUSETALK_TIMEOUT,
+                ready_timeout=MUSETALK_WORKER_READY_TIMEOUT
+            )
+            # 🧭 Sous-étapes mesurées dans le worker (horloge epoch partagée)
+            trace = current_trace()
+            parent_id = trace.current_span_id()
+            for step in reply.get('steps', ()):
+                step = dict(step)
+                trace.add_span(step.pop('name'), step.pop('start'), step.pop('duration'),
+                               parent_id=parent_id, worker=slot % len(musetalk_workers), **step)
+            return Path(reply['output_path'])
+        except WorkerUnavailable as e:
+            logger.warning("Worker MuseTalk indisponible (%s), fallback subprocess", e)
+
+    run_musetalk_subprocess(avatar_path, audio_path, bbox_shift, result_dir)
+
+    # 5. inference.py nomme la sortie <avatar>_<audio>.mp4 dans <result_dir>/v15
+    produced = Path(result_dir) / 'v15' / (
+        f"{Path(avatar_path).name.split('.')[0]}_{Path(audio_path).name.split('.')[0]}.mp4"
+    )
+    if not produced.exists():
+        raise FileNotFoundError(f"Aucune vidéo produite par MuseTalk ({produced})")
+    os.replace(produced, output_path)
+    return output_path
+
+
+def run_musetalk_subprocess(avatar_path, audio_path, bbox_shift, result_dir):
     """
-    Appelle MuseTalk via scripts.inference en utilisant un fichier YAML temporaire,
-    comme l'exige inference.py (aucun argument positionnel accepté).
-    Retourne une URL HTTP exploitable directement par le front.
+    Mode historique : un `python3 -m scripts.inference` par tour, avec un
+    fichier YAML temporaire comme l'exige inference.py.
     """
-    # 1. Préparer le dossier résultats
-    result_dir = MUSETALK_RESULTS
-    result_dir.mkdir(parents=True, exist_ok=True)
-    # ⚡️ Nettoyage optimisé: supprime seulement les vidéos > 1h
-    import time
-    current_time = time.time()
-    for old in result_dir.glob("*.mp4"):
-        if (current_time - old.stat().st_mtime) > 3600:  # 1 heure
-            old.unlink()
-            logger.info("🗑️ Nettoyage: %s supprimé", old.name)
-
-    # 2. Créer fichier YAML dynamique
-    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-    cfg_path = MUSETALK_DIR / "configs" / "inference" / f"generated_{ts}.yaml"
+    # 2. Créer fichier YAML dynamique (nom unique : dossier du job + audio)
+    cfg_name = f"generated_{Path(result_dir).name}_{Path(audio_path).stem}.yaml"
+    cfg_path = MUSETALK_DIR / "configs" / "inference" / cfg_name
     cfg_path.parent.mkdir(parents=True, exist_ok=True)
 
     config = {
@@ -390,8 +1102,7 @@ def run_musetalk_local(avatar_path: str, audio_path: str, bbox_shift: int = 0) -
     with open(cfg_path, "w", encoding="utf-8") as f:
         yaml.safe_dump(config, f)
 
-    # 3. Commande optimisée pour inference.py
-    # ⚡️ FPS 25→15 et batch_size 4→2 pour gain ~50% de vitesse
+    # 3. Commande pour inference.py
     cmd = [
         "python3",
         "-m", "scripts.inference",
@@ -400,76 +1111,158 @@ def run_musetalk_local(avatar_path: str, audio_path: str, bbox_shift: int = 0) -
         "--unet_model_path", "models/musetalkV15/unet.pth",
         "--unet_config", "models/musetalkV15/musetalk.json",
         "--version", "v15",
-        "--fps", "15",           # ⚡️ Optimisé: 25 → 15
-        "--batch_size", "2",     # ⚡️ Optimisé: 4 → 2
-        "--use_float16",
+        "--fps", str(MUSETALK_FPS),
+        "--batch_size", str(MUSETALK_BATCH_SIZE),
         "--ffmpeg_path", "/usr/bin/ffmpeg"
     ]
+    if MUSETALK_FLOAT16:
+        cmd.append("--use_float16")
 
-    logger.info("⚡️ MuseTalk cmd (optimisé): %s", " ".join(cmd))
-    
-    # ⏱️ Mesure du temps de génération
-    import time
-    start_time = time.time()
+    logger.info("⚡️ MuseTalk cmd (subprocess): %s", " ".join(cmd))
 
-    completed = subprocess.run(
+    completed = run_subprocess(
+        'musetalk_inference',
         cmd,
         capture_output=True,
         text=True,
         cwd=str(MUSETALK_DIR),
-        timeout=120  # ⚡️ Timeout de 2 minutes max
+        timeout=MUSETALK_TIMEOUT  # ⚡️ Timeout de 2 minutes max
     )
-    
-    generation_time = time.time() - start_time
-    logger.info("⏱️ Temps de génération MuseTalk: %.2f secondes", generation_time)
 
     if completed.returncode != 0:
         logger.error("MuseTalk Error:\n%s", completed.stderr)
         raise RuntimeError(f"MuseTalk failed: {completed.stderr}")
 
-    # 5. Chercher la vidéo générée
-    mp4_files = sorted(result_dir.rglob("*.mp4"), key=lambda p: p.stat().st_mtime)
-    if not mp4_files:
-        raise FileNotFoundError("Aucune vidéo produite par MuseTalk")
 
-    final_video = mp4_files[-1]
-
-    # 🔥 On construit une URL HTTP publique vers la vidéo
-    # Chemin de la vidéo vu depuis /app : /app/results/output/v15/xxx.mp4
-    # On expose /results via une route Flask (voir plus bas).
-    rel_path = f"output/v15/{final_video.name}"   # relatif à /results
-    base = PUBLIC_URL.rstrip("/")
-    public_url = f"{base}/results/{rel_path}"
-    logger.info("MuseTalk vidéo générée : %s (URL: %s)", final_video, public_url)
-
-    return public_url
+# ----------  helpers  ----------
+def generate_tts_cached(text, provider, voice_id, dest):
+    """
+    TTS + conversion 16 kHz mono, avec cache disque.
+    Un hit évite l'appel HTTP fournisseur ET la conversion ffmpeg ; un miss
+    convertit en streaming pendant la réception (voir stream_to_wav16k).
+    Retourne (mp3_path, wav_path) = dest.mp3 / dest.wav (dossier du job).
+    """
+    voice_settings = ELEVENLABS_VOICE_SETTINGS if provider == 'elevenlabs' else None
+    key = TtsCache.key(provider, voice_id, TTS_MODELS.get(provider), voice_settings, text)
+    tts_path = dest.with_suffix('.mp3')
+    tts_wav = dest.with_suffix('.wav')
+
+    cached = tts_cache.get(key)
+    if cached:
+        logger.info("♻️ TTS en cache (%s)", key[:12])
+        mp3, wav = cached
+        with span('tts_cache_hit', provider=provider, chars=len(text)):
+            return link_or_copy(mp3, tts_path), link_or_copy(wav, tts_wav)
+
+    # Durée fournisseur + décodage au fil de l'eau (resample mesuré à part)
+    with stage_metrics.stage('tts', provider=provider, chars=len(text)) as attrs:
+        stream_to_wav16k(tts_stream(text, provider, voice_id), tts_path, tts_wav)
+        attrs['response_bytes'] = tts_path.stat().st_size
+    tts_cache.put(key, tts_path, tts_wav)
+    return tts_path, tts_wav
+
+
+def wav_duration(wav):
+    """Durée (s) d'un wav, depuis un chemin ou des octets."""
+    with wave.open(BytesIO(wav) if isinstance(wav, bytes) else str(wav), 'rb') as w:
+        return w.getnframes() / float(w.getframerate())
+
+
+def decode_user_audio(raw, input_path):
+    """Audio utilisateur (webm/opus…) → PCM s16 16 kHz mono (np.int16)."""
+    if AV_AVAILABLE:
+        return decode_to_pcm16k(raw)
+
+    # Fallback sans PyAV : ffmpeg en subprocess
+    user_wav = input_path.with_suffix('.wav')
+    run_subprocess(
+        'ffmpeg_decode',
+        ['ffmpeg', '-y', '-i', str(input_path), '-ar', '16000', '-ac', '1', str(user_wav)],
+        check=True,
+        capture_output=True,
+        text=True
+    )
+    samples, _ = decode_audio(user_wav.read_bytes())
+    return to_pcm16(samples)
 
 
-# ----------  helpers  ----------
-def generate_tts(text, provider, voice_id, timestamp):
-    """Génère l'audio TTS avec ElevenLabs ou OpenAI"""
+def stream_to_wav16k(chunks, raw_path, wav_path):
+    """
+    Écrit le flux audio fournisseur (mp3) dans raw_path et le décode en même
+    temps pour produire le wav 16 kHz mono pcm_s16le attendu par MuseTalk.
+    Le wav est prêt dès la réception du dernier octet.
+    """
+    if AV_AVAILABLE:
+        decoder = StreamingDecoder('mp3')
+        with open(raw_path, 'wb') as raw:
+            for chunk in chunks:
+                if chunk:
+                    raw.write(chunk)
+                    decoder.feed(chunk)
+        with stage_metrics.stage('resample'):
+            samples, rate = decoder.finish()
+            write_wav(wav_path, to_pcm16(resample(samples, rate)))
+        return
+
+    # Fallback sans PyAV : ffmpeg lit le flux sur stdin
+    with span('ffmpeg_resample', argv0='ffmpeg') as attrs:
+        _stream_to_ffmpeg(chunks, raw_path, wav_path, attrs)
+
+
+def _stream_to_ffmpeg(chunks, raw_path, wav_path, attrs):
+    proc = subprocess.Popen(
+        [
+            'ffmpeg', '-y', '-loglevel', 'error',
+            '-i', 'pipe:0',
+            '-ar', '16000',
+            '-ac', '1',              # mono
+            '-acodec', 'pcm_s16le',  # codec direct
+            str(wav_path)
+        ],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE
+    )
+    try:
+        with open(raw_path, 'wb') as raw:
+            for chunk in chunks:
+                if chunk:
+                    raw.write(chunk)
+                    proc.stdin.write(chunk)
+        proc.stdin.close()
+    except BaseException:
+        proc.kill()
+        proc.wait()
+        raise
+
+    stderr = proc.stderr.read()
+    attrs['exit_code'] = proc.wait()
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, 'ffmpeg', stderr=stderr.decode(errors='replace'))
+
+
+def tts_stream(text, provider, voice_id, chunk_size=4096):
+    """Génère l'audio TTS (mp3) avec ElevenLabs ou OpenAI, chunk par chunk."""
     if provider == 'elevenlabs' and ELEVENLABS_KEY:
-        url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
+        url = f"{ELEVENLABS_API_BASE}/v1/text-to-speech/{voice_id}/stream"
         hdr = {"xi-api-key": ELEVENLABS_KEY, "Content-Type": "application/json"}
         payload = {
             "text": text,
-            "model_id": "eleven_multilingual_v2",
-            "voice_settings": {"stability": 0.5, "similarity_boost": 0.75},
+            "model_id": TTS_MODELS['elevenlabs'],
+            "voice_settings": ELEVENLABS_VOICE_SETTINGS,
         }
-        resp = requests.post(url, json=payload, headers=hdr)
-        resp.raise_for_status()
-        out = OUTPUT_DIR / f"tts_elevenlabs_{timestamp}.mp3"
-        out.write_bytes(resp.content)
-        return out
+        with http_client.request('tts', 'POST', url, json=payload, headers=hdr, stream=True) as resp:
+            resp.raise_for_status()
+            yield from resp.iter_content(chunk_size=chunk_size)
 
     elif provider == 'openai' and OPENAI_API_KEY:
-        out = OUTPUT_DIR / f"tts_openai_{timestamp}.mp3"
-        openai.audio.speech.create(
-            model="tts-1",
+        with http_client.openai('tts').audio.speech.with_streaming_response.create(
+            model=TTS_MODELS['openai'],
             voice=voice_id,
-            input=text
-        ).stream_to_file(out)
-        return out
+            input=text,
+            response_format="mp3"
+        ) as resp:
+            yield from resp.iter_bytes(chunk_size)
 
     else:
         raise RuntimeError("Clé / provider TTS manquant")
@@ -481,6 +1274,7 @@ def health():
     """Endpoint de santé avec diagnostics"""
     inference_script = MUSETALK_DIR / 'scripts' / 'inference.py'
     config_dir = MUSETALK_DIR / 'configs' / 'inference'
+    queue = scheduler.snapshot()
 
     return jsonify({
         'status': 'healthy',
@@ -492,7 +1286,9 @@ def health():
             'inference_script': str(inference_script),
             'inference_exists': inference_script.exists(),
             'config_dir': str(config_dir),
-            'config_dir_exists': config_dir.exists()
+            'config_dir_exists': config_dir.exists(),
+            'mode': MUSETALK_MODE,
+            'workers': [worker.health() for worker in musetalk_workers]
         },
         'directories': {
             'outputs': str(OUTPUT_DIR),
@@ -502,44 +1298,111 @@ def health():
         'api_keys': {
             'openai': bool(OPENAI_API_KEY),
             'elevenlabs': bool(ELEVENLABS_KEY)
+        },
+        'tts_cache': tts_cache.stats(),
+        'storage': janitor.stats(),
+        'publish': publisher.stats(),
+        'uploads': uploads.stats(),
+        'http': http_client.stats(),
+        'avatar_url_cache': avatar_url_cache.stats(),
+        'traces': {'path': str(TRACE_LOG), 'written': trace_log.written},
+        'queue': {
+            'running': len(queue['running']),
+            'pending': len(queue['pending']),
+            'max_queue': JOB_MAX_QUEUE
         }
     })
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Métriques au format texte Prometheus"""
+    return app.response_class(metrics_registry.render(), content_type=METRICS_CONTENT_TYPE)
+
+
+@app.route('/api/storage', methods=['GET'])
+def storage_status():
+    """Occupation disque par dossier géré par le janitor"""
+    return jsonify(janitor.stats())
+
+
+@app.route('/api/queue', methods=['GET'])
+def queue_status():
+    """Jobs en cours / en attente, limites et durée moyenne d'inférence"""
+    return jsonify(scheduler.snapshot())
+
+
 @app.route('/api/voices', methods=['GET'])
 def get_voices():
     """Liste des voix disponibles"""
     return jsonify({'success': True, 'voices': AVAILABLE_VOICES})
 
 
-@app.route('/api/download/<filename>', methods=['GET'])
+def _accel(file_path):
+    """Paramètres X-Accel-Redirect (nginx) pour un fichier servi, si configuré."""
+    for root, prefix in MEDIA_ACCEL_ROOTS:
+        if prefix and os.path.abspath(file_path).startswith(os.path.abspath(root) + os.sep):
+            return {'accel_root': root, 'accel_prefix': prefix}
+    return {}
+
+
+@app.route('/api/download/<path:filename>', methods=['GET'])
 def download_file(filename):
-    """Télécharge un fichier généré"""
-    file_path = OUTPUT_DIR / filename
-    return send_file(file_path, as_attachment=True) if file_path.exists() else (jsonify({'error': 'File not found'}), 404)
+    """Télécharge la vidéo d'un job (/api/download/<job_id>) ou un fichier de OUTPUT_DIR"""
+    record = job_manifest.get(filename)
+    if record is not None:
+        file_path = job_manifest.output(filename, record.get('video'))
+        immutable = True
+    else:
+        file_path = safe_join(str(OUTPUT_DIR), filename)
+        immutable = False
+    response = file_path and send_media(
+        file_path,
+        immutable=immutable,
+        download_name=os.path.basename(file_path),
+        **_accel(file_path)
+    )
+    return response or (jsonify({'error': 'File not found'}), 404)
 
 
-@app.route('/api/audio/<filename>', methods=['GET'])
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_info(job_id):
+    """Entrée du manifeste : entrées, sorties, durées et timings du job"""
+    record = job_manifest.get(job_id)
+    return jsonify(record) if record else (jsonify({'error': 'Job not found'}), 404)
+
+
+@app.route('/api/audio/<path:filename>', methods=['GET'])
 def serve_audio(filename):
-    """Sert un fichier audio"""
-    file_path = OUTPUT_DIR / filename
-    return send_file(file_path) if file_path.exists() else (jsonify({'error': 'File not found'}), 404)
+    """Sert un fichier audio (ex. jobs/<job_id>/tts.mp3)"""
+    file_path = safe_join(str(OUTPUT_DIR), filename)
+    # Les fichiers des jobs ne sont jamais réécrits
+    response = file_path and send_media(file_path, immutable=filename.startswith('jobs/'), **_accel(file_path))
+    return response or (jsonify({'error': 'File not found'}), 404)
 
 
 @app.route("/results/<path:filename>", methods=['GET'])
 def serve_results(filename):
     """
-    Sert les fichiers de /app/results/
-    Exemple : /results/output/v15/xxx.mp4
+    Sert les vidéos des jobs via le manifeste : /results/<job_id>/<fichier>
+    (immutables : cache navigateur / CDN d'un an). Les anciens chemins
+    (/results/output/v15/xxx.mp4) restent servis depuis /app/results/.
     """
-    root = MUSETALK_DIR / "results"
-    return send_from_directory(root, filename)
+    job_id, _, name = filename.partition('/')
+    file_path = job_manifest.output(job_id, name) if name else None
+    immutable = file_path is not None
+    if file_path is None:
+        file_path = safe_join(str(MUSETALK_DIR / "results"), filename)
+    response = file_path and send_media(file_path, immutable=immutable, **_accel(file_path))
+    return response or (jsonify({'error': 'File not found'}), 404)
 
 
 @app.route('/upload_avatar', methods=['POST'])
 def upload_avatar():
     """
-    Reçoit un fichier vidéo avatar et le sauvegarde comme sample.mp4 (ou autre nom).
+    Reçoit un fichier vidéo avatar, l'enregistre dans le registre (dédupliqué par
+    sha256) et le copie comme sample.mp4 (ou autre nom).
+    Retourne l'avatar_id à passer ensuite à chat_with_avatar.
     Utilisé par l'edge function upload-avatar-to-backend.
     """
     try:
@@ -553,27 +1416,34 @@ def upload_avatar():
         if file.filename == '':
             return jsonify({'error': 'Empty filename'}), 400
         
-        # Destination: dossier avatars avec le nom demandé
-        dest_path = AVATARS_DIR / save_as
-        
-        # Sauvegarder le fichier
-        file.save(str(dest_path))
-        file_size = dest_path.stat().st_size
-        
-        logger.info("✅ Avatar uploadé: %s (%d bytes)", dest_path, file_size)
-        
+        # Registre adressé par contenu : un upload identique n'est pas réécrit
+        ext = file.filename.rsplit('.', 1)[-1] if '.' in file.filename else 'mp4'
+        avatar_id, stored_path, created = avatar_store.put_stream(file.stream, ext)
+        file_size = stored_path.stat().st_size
+
         # Vérifier que le fichier est valide (au moins quelques KB)
         if file_size < 1000:
+            if created:
+                stored_path.unlink()
             return jsonify({'error': 'File too small, probably corrupted'}), 400
-        
+
+        # Compatibilité : copie sous le nom demandé (sample.mp4 par défaut)
+        dest_path = AVATARS_DIR / Path(save_as).name
+        shutil.copy2(stored_path, dest_path)
+
+        logger.info("✅ Avatar uploadé: %s (%d bytes, avatar_id=%s, nouveau=%s)",
+                    dest_path, file_size, avatar_id[:12], created)
+
         return jsonify({
             'success': True,
             'message': f'Avatar saved as {save_as}',
+            'avatar_id': avatar_id,
+            'deduplicated': not created,
             'path': str(dest_path),
             'size': file_size,
             'timestamp': datetime.now().isoformat()
         })
-        
+
     except Exception as e:
         logger.exception("Erreur upload_avatar")
         return jsonify({'error': str(e)}), 500
@@ -591,6 +1461,37 @@ def root():
 
 
 # ----------  start  ----------
+_services_started = False
+_services_lock = threading.Lock()
+
+
+def start_background_services():
+    """
+    Workers MuseTalk et janitor. Jamais à l'import (REPL, benchmark, `import`
+    d'un outil) : au lancement direct, sinon à la première requête HTTP ou
+    connexion Socket.IO du processus qui sert, donc dans chaque worker
+    gunicorn après le fork (y compris avec `--preload`). Idempotent.
+    """
+    global _services_started
+    if _services_started:
+        return
+    with _services_lock:
+        if _services_started:
+            return
+        _services_started = True
+    try:
+        (MUSETALK_DIR / 'configs' / 'inference').mkdir(parents=True, exist_ok=True)
+    except OSError as e:
+        logger.warning("Dossier de configs MuseTalk indisponible : %s", e)
+    if MUSETALK_MODE == 'worker':
+        for worker in musetalk_workers:
+            worker.start()
+    janitor.start()
+
+
+app.before_request(start_background_services)
+
+
 if __name__ == '__main__':
     logger.info("=" * 60)
     logger.info("DÉMARRAGE MUSETALK BACKEND v2.0")
@@ -606,6 +1507,9 @@ if __name__ == '__main__':
     (MUSETALK_DIR / 'configs' / 'inference').mkdir(parents=True, exist_ok=True)
     logger.info("Config DIR     : ✅ Créé")
 
+    logger.info("MuseTalk mode  : %s", MUSETALK_MODE)
+    start_background_services()
+
     logger.info("=" * 60)
     logger.info("🚀 Serveur démarré sur http://0.0.0.0:8000")
     logger.info("=" * 60)
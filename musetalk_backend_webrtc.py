@@ -6,25 +6,46 @@ from flask_socketio import SocketIO, emit
 from flask_cors import CORS
 import logging
 import os
+import shutil
+import threading
+import time
 import traceback
 import uuid
 import base64
-import io
 import wave
 import json
 from datetime import datetime
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.utils import safe_join
+
+from musetalk_audio import Endpointer, decode_to_pcm16k, duration_seconds, encode_for_transcription, write_wav
+from musetalk_http import HttpClient, HttpStage
+from musetalk_media import send_media
+from musetalk_metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Registry, StageMetrics
+from musetalk_storage import StorageJanitor, storage_budget
+from musetalk_trace import Trace, TraceLog, attach, detach, span
+from musetalk_upload import SOCKETIO_BUFFER_SIZE, UploadError, UploadStore, register_upload_events
 
 # -------------------------------------------------------------------
 # Tentative d'import de aiortc / av pour WebRTC
 # -------------------------------------------------------------------
 try:
-    from aiortc import RTCPeerConnection, RTCSessionDescription, MediaStreamTrack
-    import av
+    from aiortc import RTCPeerConnection, RTCSessionDescription
+    # Pistes audio / vidéo (PyAV) : clip d'attente, sortie MuseTalk, audios TTS en file
+    from musetalk_rtc import AvatarAudioTrack, AvatarChannel, AvatarVideoTrack, LoopPool, consume_mic
     AIORTC_AVAILABLE = True
 except ImportError:
     AIORTC_AVAILABLE = False
 
+# Transcription des énoncés reçus par WebRTC (Whisper)
+try:
+    import openai  # noqa: F401  (client créé par http_client)
+    OPENAI_AVAILABLE = True
+except ImportError:
+    OPENAI_AVAILABLE = False
+
 # -------------------------------------------------------------------
 # Configuration du logging
 # -------------------------------------------------------------------
@@ -48,7 +69,8 @@ socketio = SocketIO(
     app,
     cors_allowed_origins="*",
     async_mode='threading',
-    max_http_buffer_size=10**8,
+    # L'audio arrive par morceaux binaires (upload_chunk), plus en un seul message base64
+    max_http_buffer_size=int(os.getenv("SOCKETIO_MAX_BUFFER", str(SOCKETIO_BUFFER_SIZE))),
     logger=False,
     engineio_logger=False,
     ping_timeout=60,
@@ -63,17 +85,115 @@ OUTPUT_FOLDER = "outputs"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
+# Nettoyage disque en tâche de fond (uploads et sorties ne sont jamais purgés sinon)
+janitor = StorageJanitor(interval=int(os.getenv("JANITOR_INTERVAL", "60")))
+janitor.add("uploads", UPLOAD_FOLDER, **storage_budget("uploads", 256, 86400))
+janitor.add("outputs", OUTPUT_FOLDER, **storage_budget("outputs", 512, 86400))
+
+# Uploads binaires par morceaux (upload_begin / upload_chunk / upload_finish)
+CHUNKED_UPLOAD_FOLDER = os.path.join(UPLOAD_FOLDER, "chunked")
+uploads = UploadStore(
+    CHUNKED_UPLOAD_FOLDER,
+    {"audio": int(os.getenv("UPLOAD_MAX_AUDIO_MB", "20")) * 1024 * 1024},
+    chunk_size=int(os.getenv("UPLOAD_CHUNK_SIZE", str(256 * 1024))),
+    ttl=int(os.getenv("UPLOAD_TTL", "3600")),
+)
+janitor.add("chunked_uploads", CHUNKED_UPLOAD_FOLDER, **storage_budget("chunked_uploads", 0, 86400))
+
+# Dossiers servis par /exports et /results/output (résolus une fois au démarrage)
+_HERE = os.path.dirname(os.path.abspath(__file__))
+EXPORTS_DIR = os.path.join(_HERE, "exports")
+if not os.path.isdir(EXPORTS_DIR):
+    EXPORTS_DIR = "/app/MuseTalk/exports"
+RESULTS_OUTPUT_DIR = os.path.join(_HERE, "results", "output")
+if not os.path.isdir(RESULTS_OUTPUT_DIR):
+    RESULTS_OUTPUT_DIR = "/app/MuseTalk/results/output"
+
+# X-Accel-Redirect : préfixes de locations nginx `internal` (vide = Flask sert les octets)
+MEDIA_ACCEL_EXPORTS = os.getenv("MEDIA_ACCEL_EXPORTS", "")
+MEDIA_ACCEL_RESULTS = os.getenv("MEDIA_ACCEL_RESULTS", "")
+MEDIA_CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "GET, HEAD, OPTIONS",
+    "Access-Control-Expose-Headers": "Content-Length, Content-Range, ETag, Accept-Ranges",
+}
+
 # Durée max d'un fichier audio en secondes (par exemple 60 s)
 MAX_AUDIO_DURATION = 60
 
 # On lit la variable d'env PUBLIC_URL ou on utilise une valeur par défaut :
 PUBLIC_URL = os.getenv('PUBLIC_URL', 'https://magirl.fr').strip()
 ELEVENLABS_API_KEY = os.getenv("ELEVENLABS_API_KEY", "")
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "").strip()
+# Client OpenAI configuré une fois : délais / réessais, connexions gardées ouvertes
+http_client = HttpClient(
+    [HttpStage.from_env("transcription", read=30, retries=1)],
+    pool_size=int(os.getenv("HTTP_POOL_SIZE", "4")),
+    openai_api_key=OPENAI_API_KEY or None
+)
 
 logger.info("PUBLIC_URL = %s", PUBLIC_URL)
 
 # Dictionnaire pour suivre les PeerConnections WebRTC par client Socket.IO
 webrtc_peers = {}
+# Média de chaque session (horloge, clip d'attente partagé, anneau de frames MuseTalk)
+rtc_channels = {}
+
+# Piste vidéo : format de sortie et clip d'attente de l'avatar (décodé une fois)
+WEBRTC_VIDEO_WIDTH = int(os.getenv("WEBRTC_VIDEO_WIDTH", "640"))
+WEBRTC_VIDEO_HEIGHT = int(os.getenv("WEBRTC_VIDEO_HEIGHT", "480"))
+WEBRTC_VIDEO_FPS = int(os.getenv("WEBRTC_VIDEO_FPS", "25"))
+WEBRTC_IDLE_AVATAR = os.getenv("WEBRTC_IDLE_AVATAR", "avatars/sample.mp4")
+
+# Boucles asyncio longue durée qui possèdent toutes les PeerConnections
+# (au lieu d'un asyncio.run par offre, qui laissait les tâches du pair orphelines)
+WEBRTC_LOOPS = int(os.getenv("WEBRTC_LOOPS", "1"))
+WEBRTC_OFFER_TIMEOUT = float(os.getenv("WEBRTC_OFFER_TIMEOUT", "15"))
+WEBRTC_CLOSE_TIMEOUT = float(os.getenv("WEBRTC_CLOSE_TIMEOUT", "5"))
+rtc_loops = LoopPool(WEBRTC_LOOPS) if AIORTC_AVAILABLE else None
+
+# Micro du client reçu en WebRTC : découpage en énoncés côté serveur (VAD),
+# chaque énoncé part au pipeline transcription / chat dans ce pool
+WEBRTC_VAD_THRESHOLD_DB = float(os.getenv("WEBRTC_VAD_THRESHOLD_DB", "12"))
+WEBRTC_VAD_HANGOVER_MS = int(os.getenv("WEBRTC_VAD_HANGOVER_MS", "600"))
+TRANSCRIBE_CODEC = os.getenv("TRANSCRIBE_CODEC", "opus").strip().lower()
+utterance_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("WEBRTC_PIPELINE_WORKERS", "2")), thread_name_prefix="utterance"
+)
+# Références fortes sur les tâches de lecture micro (asyncio ne garde que des weakrefs)
+mic_tasks = set()
+
+# 📈 Métriques Prometheus (/metrics) : durée / erreurs par étape, jauges calculées au scrape
+connected_clients = set()
+utterances_pending = [0]  # énoncés soumis au pool, pas encore traités
+utterances_lock = threading.Lock()
+metrics_registry = Registry()
+stage_metrics = StageMetrics(metrics_registry, "musetalk", span=span)
+# 🧭 Une trace par énoncé (spans des étapes), une ligne JSON par trace
+TRACE_LOG = os.getenv("TRACE_LOG", os.path.join(_HERE, "outputs", "traces_webrtc.jsonl"))
+trace_log = TraceLog(
+    TRACE_LOG,
+    max_bytes=int(os.getenv("TRACE_LOG_MB", "50")) * 1024 * 1024,
+    backups=int(os.getenv("TRACE_LOG_BACKUPS", "5")),
+)
+metrics_registry.gauge("musetalk_active_connections", "Clients Socket.IO connectés").set_function(
+    lambda: len(connected_clients)
+)
+metrics_registry.gauge("musetalk_webrtc_peers", "PeerConnections WebRTC ouvertes").set_function(
+    lambda: len(webrtc_peers)
+)
+metrics_registry.gauge("musetalk_queue_jobs", "Énoncés micro en attente du pipeline", ("state",)).set_function(
+    lambda: {"queued": utterances_pending[0]}
+)
+metrics_registry.gauge("musetalk_webrtc_loop_lag_seconds", "Retard de la boucle asyncio WebRTC", ("loop",)).set_function(
+    lambda: {loop["name"]: loop["lag_ms"] / 1000.0 for loop in (rtc_loops.stats() if rtc_loops else [])}
+)
+metrics_registry.gauge("musetalk_storage_bytes", "Octets par dossier géré par le janitor", ("policy",)).set_function(
+    lambda: {name: policy["bytes"] for name, policy in janitor.stats()["policies"].items()}
+)
+metrics_registry.gauge("musetalk_disk_free_bytes", "Espace libre sur le disque de travail").set_function(
+    lambda: shutil.disk_usage(".").free
+)
 
 # -------------------------------------------------------------------
 # Fonctions utilitaires
@@ -96,20 +216,43 @@ def generate_unique_filename(extension=".wav"):
 
 def base64_to_wav_file(b64_data, output_path):
     """
-    Décode une chaîne Base64 en WAV et l'enregistre dans un fichier.
+    Décode une chaîne Base64 (wav, webm/opus, mp3…) et l'enregistre en WAV
+    16 kHz mono, via le module audio partagé (décodage en mémoire).
     """
     try:
-        audio_bytes = base64.b64decode(b64_data)
-        with wave.open(io.BytesIO(audio_bytes), "rb") as wav_in:
-            with wave.open(output_path, "wb") as wav_out:
-                wav_out.setparams(wav_in.getparams())
-                wav_out.writeframes(wav_in.readframes(wav_in.getnframes()))
+        with stage_metrics.stage("decode"):
+            audio_bytes = base64.b64decode(b64_data)
+            write_wav(output_path, decode_to_pcm16k(audio_bytes))
         return True
     except Exception as e:
         logger.error("Erreur lors de l'écriture du fichier WAV depuis le Base64 : %s", e)
         return False
 
 
+def close_peer(client_id, wait=True):
+    """
+    Ferme la PeerConnection du client sur la boucle qui la possède.
+    Retourne False si le client n'en avait pas.
+    """
+    channel = rtc_channels.pop(client_id, None)
+    if channel:
+        channel.interrupt()
+    pc = webrtc_peers.pop(client_id, None)
+    if pc is None or rtc_loops is None:
+        return False
+
+    def _released(_future):
+        # Une nouvelle offre a pu arriver entre-temps : on garde alors la boucle
+        if client_id not in webrtc_peers:
+            rtc_loops.release(client_id)
+
+    future = rtc_loops.submit(client_id, pc.close())
+    future.add_done_callback(_released)
+    if wait:
+        future.result(WEBRTC_CLOSE_TIMEOUT)
+    return True
+
+
 def wav_duration_seconds(filepath):
     """
     Retourne la durée d'un fichier WAV en secondes.
@@ -125,93 +268,45 @@ def wav_duration_seconds(filepath):
         return None
 
 
-# -------------------------------------------------------------------
-# Tracks WebRTC (audio / vidéo) côté serveur
-# -------------------------------------------------------------------
-if AIORTC_AVAILABLE:
-
-    class VideoStreamTrack(MediaStreamTrack):
-        """
-        Track vidéo de démonstration : génère des frames vides.
-        À remplacer par ta vraie source vidéo (OpenCV, ffmpeg, etc.).
-        """
-        kind = "video"
-
-        def __init__(self):
-            super().__init__()
-            self.width = 640
-            self.height = 480
-
-        async def recv(self):
-            # Petite temporisation pour respecter un framerate (~25 fps)
-            await asyncio.sleep(1 / 25)
-
-            frame = av.VideoFrame(self.width, self.height, 'rgb24')
-            # Optionnel : remplir l'image avec du noir (par défaut elle est vide)
-            for plane in frame.planes:
-                plane.update(b'\x00' * len(plane))
-            return frame
-
-
-    class AudioStreamTrack(MediaStreamTrack):
-        """
-        Track audio de démonstration : génère du silence.
-        À remplacer par ta vraie source audio (TTS, fichier, pipeline IA, etc.).
-        """
-        kind = "audio"
-
-        def __init__(self):
-            super().__init__()
-            self.sample_rate = 48000
-            self.samples_per_frame = 960  # 20 ms @ 48 kHz
-
-        async def recv(self):
-            await asyncio.sleep(self.samples_per_frame / self.sample_rate)
-
-            frame = av.AudioFrame(format='s16', layout='mono', samples=self.samples_per_frame)
-            for plane in frame.planes:
-                plane.update(b'\x00' * len(plane))
-            frame.sample_rate = self.sample_rate
-            return frame
-
 # -------------------------------------------------------------------
 # Routes Flask
 # -------------------------------------------------------------------
 
+def _cors_preflight():
+    response = app.make_default_options_response()
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    response.headers["Access-Control-Allow-Methods"] = "GET, HEAD, OPTIONS"
+    response.headers["Access-Control-Allow-Headers"] = "Content-Type, Range, If-None-Match, If-Range"
+    return response
+
+
+def _serve_video(root, filename, accel_prefix):
+    """
+    Sert une vidéo de `root` : Range (206), ETag / 304, revalidation du cache
+    (les noms comme video_latest.mp4 peuvent être réutilisés), X-Accel-Redirect
+    si `accel_prefix` est configuré.
+    """
+    filepath = safe_join(root, filename)
+    response = filepath and send_media(
+        filepath,
+        accel_root=root,
+        accel_prefix=accel_prefix,
+        extra_headers=MEDIA_CORS_HEADERS
+    )
+    if response is None:
+        logger.warning("File not found: %s", filename)
+        return jsonify({"error": "File not found", "path": filename}), 404
+    return response
+
+
 @app.route("/exports/<path:filename>", methods=["GET", "OPTIONS"])
 def serve_export(filename):
     """
     Sert les fichiers vidéo exportés avec les headers CORS appropriés.
     """
     if request.method == "OPTIONS":
-        # Preflight CORS
-        response = app.make_default_options_response()
-        response.headers["Access-Control-Allow-Origin"] = "*"
-        response.headers["Access-Control-Allow-Methods"] = "GET, OPTIONS"
-        response.headers["Access-Control-Allow-Headers"] = "Content-Type, Range"
-        return response
-    
-    exports_dir = os.path.join(os.path.dirname(__file__), "exports")
-    if not os.path.exists(exports_dir):
-        exports_dir = "/app/MuseTalk/exports"
-    
-    filepath = os.path.join(exports_dir, filename)
-    logger.info("Serving export file: %s", filepath)
-    
-    if not os.path.exists(filepath):
-        logger.error("File not found: %s", filepath)
-        return jsonify({"error": "File not found", "path": filepath}), 404
-    
-    response = send_file(
-        filepath,
-        mimetype="video/mp4",
-        as_attachment=False
-    )
-    response.headers["Access-Control-Allow-Origin"] = "*"
-    response.headers["Access-Control-Allow-Methods"] = "GET, OPTIONS"
-    response.headers["Access-Control-Expose-Headers"] = "Content-Length, Content-Range"
-    response.headers["Accept-Ranges"] = "bytes"
-    return response
+        return _cors_preflight()
+    return _serve_video(EXPORTS_DIR, filename, MEDIA_ACCEL_EXPORTS)
 
 
 @app.route("/results/output/<path:filename>", methods=["GET", "OPTIONS"])
@@ -220,33 +315,8 @@ def serve_result(filename):
     Sert les fichiers vidéo résultats avec les headers CORS appropriés.
     """
     if request.method == "OPTIONS":
-        response = app.make_default_options_response()
-        response.headers["Access-Control-Allow-Origin"] = "*"
-        response.headers["Access-Control-Allow-Methods"] = "GET, OPTIONS"
-        response.headers["Access-Control-Allow-Headers"] = "Content-Type, Range"
-        return response
-    
-    results_dir = os.path.join(os.path.dirname(__file__), "results", "output")
-    if not os.path.exists(results_dir):
-        results_dir = "/app/MuseTalk/results/output"
-    
-    filepath = os.path.join(results_dir, filename)
-    logger.info("Serving result file: %s", filepath)
-    
-    if not os.path.exists(filepath):
-        logger.error("File not found: %s", filepath)
-        return jsonify({"error": "File not found", "path": filepath}), 404
-    
-    response = send_file(
-        filepath,
-        mimetype="video/mp4",
-        as_attachment=False
-    )
-    response.headers["Access-Control-Allow-Origin"] = "*"
-    response.headers["Access-Control-Allow-Methods"] = "GET, OPTIONS"
-    response.headers["Access-Control-Expose-Headers"] = "Content-Length, Content-Range"
-    response.headers["Accept-Ranges"] = "bytes"
-    return response
+        return _cors_preflight()
+    return _serve_video(RESULTS_OUTPUT_DIR, filename, MEDIA_ACCEL_RESULTS)
 
 
 @app.route("/", methods=["GET"])
@@ -264,7 +334,23 @@ def health():
     Route de health-check.
     """
     logger.info("Requête GET sur /health")
-    return jsonify({"status": "ok"}), 200
+    webrtc = {"peers": len(webrtc_peers), "loops": rtc_loops.stats() if rtc_loops else []}
+    return jsonify({
+        "status": "ok",
+        "storage": janitor.stats(),
+        "uploads": uploads.stats(),
+        "webrtc": webrtc,
+        "http": http_client.stats(),
+        "traces": {"path": TRACE_LOG, "written": trace_log.written},
+    }), 200
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Métriques au format texte Prometheus.
+    """
+    return app.response_class(metrics_registry.render(), content_type=METRICS_CONTENT_TYPE)
 
 
 @app.route("/upload_audio", methods=["POST"])
@@ -330,7 +416,10 @@ def handle_connect():
     """
     Événement Socket.IO: un client se connecte.
     """
+    # Le transport Socket.IO ne passe pas par before_request
+    start_background_services()
     client_id = request.sid
+    connected_clients.add(client_id)
     logger.info("Client connecté: %s", client_id)
     emit("server_message", {"message": "Connecté au serveur Socket.IO", "client_id": client_id})
 
@@ -341,16 +430,16 @@ def handle_disconnect():
     Événement Socket.IO: un client se déconnecte.
     """
     client_id = request.sid
+    connected_clients.discard(client_id)
     logger.info("Client déconnecté: %s", client_id)
 
     # Si une PeerConnection WebRTC existe pour ce client, on la ferme proprement
-    pc = webrtc_peers.pop(client_id, None)
-    if pc and AIORTC_AVAILABLE:
-        logger.info("Fermeture de la PeerConnection WebRTC pour le client %s", client_id)
-        try:
-            asyncio.run(pc.close())
-        except Exception as e:
-            logger.error("Erreur lors de la fermeture de la PeerConnection: %s", e)
+    # (sans attendre : le client est déjà parti)
+    try:
+        if close_peer(client_id, wait=False):
+            logger.info("Fermeture de la PeerConnection WebRTC pour le client %s", client_id)
+    except Exception as e:
+        logger.error("Erreur lors de la fermeture de la PeerConnection: %s", e)
 
 
 @socketio.on("ping_server")
@@ -362,26 +451,57 @@ def handle_ping(data):
     emit("pong_client", {"message": "Pong depuis le serveur", "data": data})
 
 
+# upload_begin / upload_chunk / upload_status / upload_finish / upload_abort
+register_upload_events(socketio, uploads)
+
+
+def upload_to_wav_file(upload_id, output_path):
+    """
+    Convertit un upload binaire terminé (wav, webm/opus, mp3…) en WAV 16 kHz mono.
+    L'upload est consommé : le fichier source est supprimé après conversion.
+    """
+    try:
+        upload = uploads.consume(upload_id, "audio")
+    except UploadError as e:
+        logger.error("Upload audio %s inutilisable : %s", upload_id, e)
+        return False
+    try:
+        with stage_metrics.stage("decode"), open(upload.path, "rb") as f:
+            write_wav(output_path, decode_to_pcm16k(f.read()))
+        return True
+    except Exception as e:
+        logger.error("Erreur lors de l'écriture du fichier WAV depuis l'upload : %s", e)
+        return False
+    finally:
+        upload.path.unlink(missing_ok=True)
+
+
+@socketio.on("upload_audio")
 @socketio.on("upload_audio_b64")
 def handle_upload_audio_b64(data):
     """
-    Événement Socket.IO pour recevoir un audio en Base64 (WAV),
-    le sauvegarder, vérifier la durée, etc.
+    Événement Socket.IO pour finaliser un audio reçu par upload binaire
+    (`upload_id`) ou, pour les anciens clients, en Base64 (`audio_base64`) :
+    le sauvegarder en WAV, vérifier la durée, etc.
     """
     client_id = request.sid
     logger.info("Réception upload_audio_b64 de %s", client_id)
 
     try:
+        upload_id = data.get("upload_id")
         audio_b64 = data.get("audio_base64")
-        if not audio_b64:
-            emit("upload_error", {"error": "Aucun audio_base64 fourni"}, room=client_id)
+        if not upload_id and not audio_b64:
+            emit("upload_error", {"error": "Aucun upload_id (ou audio_base64) fourni"}, room=client_id)
             return
 
         unique_name = generate_unique_filename(".wav")
         filepath = os.path.join(UPLOAD_FOLDER, unique_name)
 
-        # Décodage du base64 en WAV
-        success = base64_to_wav_file(audio_b64, filepath)
+        # Décodage de l'upload (ou du base64) en WAV
+        if upload_id:
+            success = upload_to_wav_file(upload_id, filepath)
+        else:
+            success = base64_to_wav_file(audio_b64, filepath)
         if not success:
             emit("upload_error", {"error": "Impossible de décoder le fichier audio"}, room=client_id)
             return
@@ -428,40 +548,119 @@ def handle_chat_with_avatar(data):
     logger.info("chat_with_avatar reçu de %s avec data=%s", client_id, data)
 
     try:
-        user_message = data.get("message", "")
-        # Placeholder : on renvoie simplement une réponse "echo".
-        response_text = f"Avatar: j'ai bien reçu ton message -> {user_message}"
-
-        # Si tu as un système de TTS (text-to-speech) ou de génération audio,
-        # tu peux ici :
-        #  1) Générer un fichier audio
-        #  2) Le stocker dans OUTPUT_FOLDER
-        #  3) Retourner l'URL publique ou un identifiant au client
-
-        # Exemple de nom de fichier audio généré (placeholder)
-        fake_audio_name = generate_unique_filename(".wav")
-        fake_audio_path = os.path.join(OUTPUT_FOLDER, fake_audio_name)
-        # Ici, tu pourrais écrire un vrai WAV à partir d'un TTS.
-        # Par exemple, avec un TTS d'ElevenLabs ou autre.
-
-        # Construction d'une URL publique (si PUBLIC_URL est configuré)
-        # Par ex: https://magirl.fr/outputs/<fake_audio_name>
-        # À adapter selon ta config Nginx / Apache / etc.
-        audio_url = f"{PUBLIC_URL}/outputs/{fake_audio_name}"
-
-        payload = {
-            "text": response_text,
-            "audio_file": fake_audio_name,
-            "audio_url": audio_url,
-        }
-
-        emit("avatar_response", payload, room=client_id)
+        emit("avatar_response", build_avatar_reply(data.get("message", "")), room=client_id)
     except Exception as e:
         logger.error("Erreur dans chat_with_avatar: %s", e)
         traceback.print_exc()
         emit("avatar_error", {"error": "Erreur interne dans le chat avec l'avatar"}, room=client_id)
 
 
+def build_avatar_reply(user_message):
+    """
+    Réponse de l'avatar à un message (texte tapé ou énoncé transcrit).
+    Placeholder : on renvoie simplement une réponse "echo".
+    """
+    response_text = f"Avatar: j'ai bien reçu ton message -> {user_message}"
+
+    # Si tu as un système de TTS (text-to-speech) ou de génération audio,
+    # tu peux ici :
+    #  1) Générer un fichier audio
+    #  2) Le stocker dans OUTPUT_FOLDER
+    #  3) Retourner l'URL publique ou un identifiant au client
+
+    # Exemple de nom de fichier audio généré (placeholder)
+    fake_audio_name = generate_unique_filename(".wav")
+    # Ici, tu pourrais écrire un vrai WAV à partir d'un TTS
+    # (os.path.join(OUTPUT_FOLDER, fake_audio_name)), avec ElevenLabs ou autre.
+
+    # Construction d'une URL publique (si PUBLIC_URL est configuré)
+    # Par ex: https://magirl.fr/outputs/<fake_audio_name>
+    # À adapter selon ta config Nginx / Apache / etc.
+    audio_url = f"{PUBLIC_URL}/outputs/{fake_audio_name}"
+
+    return {
+        "text": response_text,
+        "audio_file": fake_audio_name,
+        "audio_url": audio_url,
+    }
+
+
+def submit_utterance(client_id, pcm):
+    """Appelé depuis la boucle du pair : l'énoncé part dans le pool du pipeline."""
+    with utterances_lock:
+        utterances_pending[0] += 1
+    return utterance_pool.submit(process_utterance, client_id, pcm, time.time())
+
+
+def process_utterance(client_id, pcm, submitted_at=None):
+    """
+    Énoncé détecté sur le micro WebRTC (PCM 16 kHz mono) → transcription →
+    réponse de l'avatar. Plus d'enregistrement webm, de base64 ni de décodage :
+    le pipeline démarre dès la fin de la parole.
+    """
+    duration = duration_seconds(pcm)
+    trace = Trace(client_id=client_id, source="webrtc", audio_seconds=round(duration, 3))
+    trace_token = attach(trace)
+    if submitted_at is not None:
+        trace.start = submitted_at  # la trace couvre l'attente dans le pool
+        with utterances_lock:
+            utterances_pending[0] -= 1
+        stage_metrics.observe("utterance_wait", time.time() - submitted_at)
+        trace.add_span("utterance_wait", submitted_at, time.time() - submitted_at)
+    logger.info("Énoncé de %.2fs détecté pour %s", duration, client_id)
+    socketio.emit("utterance", {"duration": round(duration, 2), "trace_id": trace.trace_id}, room=client_id)
+
+    try:
+        if not (OPENAI_AVAILABLE and OPENAI_API_KEY):
+            # Pas de transcription configurée : l'énoncé est gardé comme un upload audio
+            unique_name = generate_unique_filename(".wav")
+            write_wav(os.path.join(UPLOAD_FOLDER, unique_name), pcm)
+            socketio.emit("upload_success", {
+                "status": "ok",
+                "filename": unique_name,
+                "duration": duration,
+                "source": "webrtc",
+            }, room=client_id)
+            trace.finish("stored")
+            return
+
+        with stage_metrics.stage("encode", codec=TRANSCRIBE_CODEC) as attrs:
+            # ⚡️ opus 16 kHz : l'énoncé est déjà rogné par l'Endpointer
+            upload = encode_for_transcription(pcm, TRANSCRIBE_CODEC)
+            attrs["bytes"] = len(upload[1])
+        with stage_metrics.stage("transcription", request_bytes=len(upload[1])) as attrs:
+            user_text = http_client.openai("transcription").audio.transcriptions.create(
+                model="whisper-1",
+                file=upload,
+                language="fr"
+            ).text
+            attrs["response_chars"] = len(user_text)
+        socketio.emit("transcription", {
+            "text": user_text,
+            "duration": round(duration, 2),
+            "trace_id": trace.trace_id,
+            "spans": trace.take_new(),
+        }, room=client_id)
+        if user_text.strip():
+            with stage_metrics.stage("emit"):
+                socketio.emit("avatar_response", build_avatar_reply(user_text), room=client_id)
+        trace.finish("done")
+    except Exception as e:
+        trace.finish("failed")
+        logger.error("Erreur lors du traitement de l'énoncé WebRTC: %s", e)
+        traceback.print_exc()
+        socketio.emit("avatar_error", {
+            "error": "Erreur interne lors du traitement de l'énoncé",
+            "trace_id": trace.trace_id,
+        }, room=client_id)
+    finally:
+        detach(trace_token)
+        try:
+            trace_log.write(trace)
+        except Exception:
+            logger.exception("Écriture de la trace %s impossible", trace.trace_id)
+
+
 # -------------------------------------------------------------------
 # Intégration potentielle avec ElevenLabs (placeholder)
 # -------------------------------------------------------------------
@@ -505,15 +704,47 @@ def handle_webrtc_offer(data):
         emit("webrtc_error", {"error": "Aucune 'offer' fournie"}, room=client_id)
         return
 
+    # Renégociation : l'ancienne PeerConnection est fermée sur sa boucle
+    if client_id in webrtc_peers:
+        try:
+            close_peer(client_id)
+        except Exception as e:
+            logger.error("Erreur lors de la fermeture de l'ancienne PeerConnection: %s", e)
+
+    # Vidéo : clip d'attente puis sortie MuseTalk (anneau partagé, cadencé par pts).
+    # Créé ici, hors de la boucle asyncio (décodage du clip d'attente au premier appel).
+    channel = rtc_channels.get(client_id)
+    if channel is None:
+        channel = rtc_channels[client_id] = AvatarChannel(
+            WEBRTC_VIDEO_WIDTH, WEBRTC_VIDEO_HEIGHT, WEBRTC_VIDEO_FPS,
+            idle_path=WEBRTC_IDLE_AVATAR
+        )
+
     async def process_offer():
-        # Nouvelle PeerConnection pour ce client
+        # Nouvelle PeerConnection pour ce client, créée sur sa boucle
         pc = RTCPeerConnection()
         webrtc_peers[client_id] = pc
         logger.info("PeerConnection créée pour le client %s", client_id)
 
-        # Ajout des pistes vidéo / audio (démonstration)
-        pc.addTrack(VideoStreamTrack())
-        pc.addTrack(AudioStreamTrack())
+        pc.addTrack(AvatarVideoTrack(channel))
+        # Audio : son des vidéos MuseTalk et audios TTS mis en file (48 kHz), ou
+        # silence, sur la même horloge que la vidéo
+        pc.addTrack(AvatarAudioTrack(channel))
+
+        @pc.on("track")
+        def on_track(track):
+            # Micro du client : VAD côté serveur, chaque énoncé part au pipeline
+            if track.kind != "audio":
+                return
+            logger.info("Piste micro reçue de %s", client_id)
+            endpointer = Endpointer(threshold_db=WEBRTC_VAD_THRESHOLD_DB, hangover_ms=WEBRTC_VAD_HANGOVER_MS)
+            task = asyncio.ensure_future(consume_mic(
+                track,
+                lambda pcm: submit_utterance(client_id, pcm),
+                endpointer
+            ))
+            mic_tasks.add(task)
+            task.add_done_callback(mic_tasks.discard)
 
         @pc.on("connectionstatechange")
         async def on_connectionstatechange():
@@ -521,7 +752,13 @@ def handle_webrtc_offer(data):
             if pc.connectionState in ("failed", "closed", "disconnected"):
                 logger.info("Fermeture de la PeerConnection pour %s", client_id)
                 await pc.close()
-                webrtc_peers.pop(client_id, None)
+                if webrtc_peers.get(client_id) is pc:
+                    webrtc_peers.pop(client_id, None)
+                    # Plus de pistes pour le lire : le canal (anneau vidéo, file de voix) part aussi
+                    channel = rtc_channels.pop(client_id, None)
+                    if channel:
+                        channel.interrupt()
+                    rtc_loops.release(client_id)
 
         # Application de l'offre du client
         desc = RTCSessionDescription(sdp=offer["sdp"], type=offer["type"])
@@ -537,12 +774,22 @@ def handle_webrtc_offer(data):
             "sdp": pc.localDescription.sdp,
         }
 
+    future = rtc_loops.submit(client_id, process_offer())
     try:
-        answer = asyncio.run(process_offer())
+        answer = future.result(WEBRTC_OFFER_TIMEOUT)
         emit("webrtc_answer", {"answer": answer}, room=client_id)
         logger.info("webrtc_answer envoyée à %s", client_id)
     except Exception as e:
         logger.error("Erreur lors du traitement de l'offre WebRTC: %s", e, exc_info=True)
+        # Délai dépassé : la négociation ne doit pas aboutir après le nettoyage
+        future.cancel()
+        # Négociation ratée : PeerConnection, canal et place sur la boucle sont rendus
+        # tout de suite (sinon ils faussent le choix de la boucle la moins chargée)
+        try:
+            if not close_peer(client_id, wait=False):
+                rtc_loops.release(client_id)
+        except Exception as close_error:
+            logger.error("Nettoyage de la PeerConnection ratée impossible: %s", close_error)
         emit("webrtc_error", {"error": "Erreur interne lors du traitement de l'offre WebRTC"}, room=client_id)
 
 
@@ -555,22 +802,76 @@ def handle_webrtc_close():
     client_id = request.sid
     logger.info("webrtc_close demandé par %s", client_id)
 
-    pc = webrtc_peers.pop(client_id, None)
-    if pc and AIORTC_AVAILABLE:
-        try:
-            asyncio.run(pc.close())
+    try:
+        if close_peer(client_id):
             emit("webrtc_closed", {"status": "ok"}, room=client_id)
             logger.info("PeerConnection WebRTC fermée pour %s", client_id)
-        except Exception as e:
-            logger.error("Erreur lors de la fermeture de la PeerConnection: %s", e)
-            emit("webrtc_error", {"error": "Erreur lors de la fermeture de la PeerConnection"}, room=client_id)
-    else:
-        emit("webrtc_closed", {"status": "no_peer"}, room=client_id)
+        else:
+            emit("webrtc_closed", {"status": "no_peer"}, room=client_id)
+    except Exception as e:
+        logger.error("Erreur lors de la fermeture de la PeerConnection: %s", e)
+        emit("webrtc_error", {"error": "Erreur lors de la fermeture de la PeerConnection"}, room=client_id)
+
+
+@socketio.on("webrtc_play")
+def handle_webrtc_play(data):
+    """
+    Joue une vidéo MuseTalk (results/output ou exports) sur les pistes WebRTC
+    du client, à la place du clip d'attente (image et son partent au même
+    instant de l'horloge), ou met un audio TTS (outputs) en file sur la piste
+    audio, après la voix en cours.
+    """
+    client_id = request.sid
+    channel = rtc_channels.get(client_id)
+    if channel is None:
+        emit("webrtc_error", {"error": "Aucune session WebRTC pour ce client"}, room=client_id)
+        return
+
+    filename = (data or {}).get("filename", "")
+    filepath = next(
+        (path for path in (safe_join(RESULTS_OUTPUT_DIR, filename), safe_join(EXPORTS_DIR, filename),
+                           safe_join(OUTPUT_FOLDER, filename))
+         if path and os.path.isfile(path)),
+        None
+    )
+    if filepath is None:
+        emit("webrtc_error", {"error": "Média introuvable", "filename": filename}, room=client_id)
+        return
+
+    channel.play_video(filepath)
+    emit("webrtc_playing", {"filename": filename}, room=client_id)
+
+
+# -------------------------------------------------------------------
+# Services de fond
+# -------------------------------------------------------------------
+_services_started = False
+_services_lock = threading.Lock()
+
+
+def start_background_services():
+    """
+    Janitor, comme dans le backend optimisé : jamais à l'import, mais au
+    lancement direct ou à la première requête HTTP / connexion Socket.IO du
+    processus qui sert (chaque worker gunicorn après le fork). Idempotent.
+    """
+    global _services_started
+    if _services_started:
+        return
+    with _services_lock:
+        if _services_started:
+            return
+        _services_started = True
+    janitor.start()
+
+
+app.before_request(start_background_services)
 
 
 # -------------------------------------------------------------------
 # Main
 # -------------------------------------------------------------------
 if __name__ == "__main__":
+    start_background_services()
     logger.info("Démarrage du serveur Flask+Socket.IO sur 0.0.0.0:8000")
     socketio.run(app, host="0.0.0.0", port=8000, debug=False, allow_unsafe_werkzeug=True)
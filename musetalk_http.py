@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""
+Couche HTTP partagée pour les appels fournisseurs (ElevenLabs, OpenAI, avatar_url).
+
+- Une seule requests.Session par backend, pool de connexions keep-alive par
+  hôte : plus de poignée de main TCP + TLS à chaque tour.
+- Délais connect / read et budget de réessais par étape (HttpStage), réglables
+  par HTTP_<ÉTAPE>_TIMEOUT, HTTP_<ÉTAPE>_CONNECT_TIMEOUT, HTTP_<ÉTAPE>_RETRIES.
+  Un fournisseur bloqué ne retient plus un thread indéfiniment.
+- Réessais avec backoff uniquement avant la lecture du corps : erreurs de
+  connexion, délais dépassés, 429 et 5xx (Retry-After respecté).
+- Téléchargements écrits sur disque par blocs (fichier .part puis rename),
+  jamais entièrement en mémoire, avec taille max optionnelle.
+- Client OpenAI créé une fois ; `openai(étape)` en dérive une vue avec les
+  délais de l'étape, qui partage le même pool de connexions.
+- UrlCache : fichiers distants (avatar_url) gardés sur disque et revalidés par
+  requête conditionnelle (ETag / Last-Modified → 304).
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+
+class DownloadTooLarge(ValueError):
+    """Le fichier distant dépasse la taille autorisée."""
+
+
+class HttpStage:
+    """Délais (s) et nombre de réessais d'une étape du pipeline."""
+
+    __slots__ = ('name', 'read', 'connect', 'retries')
+
+    def __init__(self, name, read, connect=5.0, retries=2):
+        self.name = name
+        self.read = read
+        self.connect = connect
+        self.retries = retries
+
+    @property
+    def timeout(self):
+        return self.connect, self.read
+
+    @classmethod
+    def from_env(cls, name, read, connect=5.0, retries=2):
+        prefix = f'HTTP_{name.upper()}_'
+        return cls(
+            name,
+            float(os.getenv(prefix + 'TIMEOUT', str(read))),
+            float(os.getenv(prefix + 'CONNECT_TIMEOUT', str(connect))),
+            int(os.getenv(prefix + 'RETRIES', str(retries)))
+        )
+
+    def as_dict(self):
+        return {'connect': self.connect, 'read': self.read, 'retries': self.retries}
+
+
+def _retry_after(resp, default):
+    value = resp.headers.get('Retry-After', '')
+    try:
+        return min(float(value), 30.0)
+    except ValueError:
+        return default
+
+
+class HttpClient:
+    """
+    Session partagée entre threads (requests la tolère pour des requêtes
+    indépendantes) ; `pool_size` connexions gardées ouvertes par hôte.
+    Les corps de requête doivent être rejouables (json, bytes) pour les réessais.
+    """
+
+    def __init__(self, stages, pool_size=10, backoff=0.5, openai_api_key=None):
+        self.stages = {stage.name: stage for stage in stages}
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._openai_api_key = openai_api_key
+        self._openai = None
+        self._openai_views = {}
+        self._lock = threading.Lock()
+        self._counters = {name: {'requests': 0, 'retries': 0, 'failures': 0} for name in self.stages}
+
+    def stage(self, name):
+        return self.stages[name]
+
+    def _count(self, stage, key):
+        with self._lock:
+            self._counters.setdefault(stage.name, {'requests': 0, 'retries': 0, 'failures': 0})[key] += 1
+
+    def request(self, stage, method, url, **kwargs):
+        """
+        Requête avec les délais et réessais de `stage` (nom ou HttpStage).
+        La réponse est rendue telle quelle (4xx compris) ; avec stream=True,
+        le corps reste à lire par l'appelant (`with resp:`).
+        """
+        stage = self.stages[stage] if isinstance(stage, str) else stage
+        kwargs.setdefault('timeout', stage.timeout)
+        self._count(stage, 'requests')
+        for attempt in range(stage.retries + 1):
+            delay = self.backoff * 2 ** attempt
+            try:
+                resp = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == stage.retries:
+                    self._count(stage, 'failures')
+                    raise
+                reason = f"{type(e).__name__}: {e}"
+            else:
+                if resp.status_code not in RETRY_STATUSES or attempt == stage.retries:
+                    if resp.status_code >= 400:
+                        self._count(stage, 'failures')
+                    return resp
+                reason = f"HTTP {resp.status_code}"
+                delay = _retry_after(resp, delay)
+                resp.close()
+            self._count(stage, 'retries')
+            logger.warning("%s %s (%s) : %s, nouvel essai %d/%d dans %.1fs",
+                           method, url, stage.name, reason, attempt + 1, stage.retries, delay)
+            time.sleep(delay)
+
+    def download(self, stage, url, dest, headers=None, max_bytes=None, chunk_size=DOWNLOAD_CHUNK_SIZE):
+        """
+        GET `url` → `dest` par blocs de `chunk_size`. Retourne (réponse, octets
+        écrits) ; sur un 304, rien n'est écrit. Lève HTTPError sur 4xx / 5xx et
+        DownloadTooLarge au-delà de `max_bytes`.
+        """
+        dest = Path(dest)
+        part = dest.with_name(dest.name + '.part')
+        with self.request(stage, 'GET', url, headers=headers, stream=True) as resp:
+            resp.raise_for_status()
+            if resp.status_code == 304:
+                return resp, 0
+            length = resp.headers.get('Content-Length', '')
+            if max_bytes and length.isdigit() and int(length) > max_bytes:
+                raise DownloadTooLarge(f"{url} : {int(length)} octets > {max_bytes}")
+            written = 0
+            try:
+                with open(part, 'wb') as f:
+                    for chunk in resp.iter_content(chunk_size):
+                        written += len(chunk)
+                        if max_bytes and written > max_bytes:
+                            raise DownloadTooLarge(f"{url} : plus de {max_bytes} octets")
+                        f.write(chunk)
+                os.replace(part, dest)
+            except BaseException:
+                part.unlink(missing_ok=True)
+                raise
+        return resp, written
+
+    def openai(self, stage):
+        """Client OpenAI avec les délais / réessais de `stage` (pool partagé)."""
+        stage = self.stages[stage] if isinstance(stage, str) else stage
+        with self._lock:
+            view = self._openai_views.get(stage.name)
+            if view is not None:
+                return view
+            import openai
+            if self._openai is None:
+                self._openai = openai.OpenAI(api_key=self._openai_api_key)
+            view = self._openai.with_options(
+                timeout=openai.Timeout(stage.read, connect=stage.connect),
+                max_retries=stage.retries
+            )
+            self._openai_views[stage.name] = view
+            return view
+
+    def stats(self):
+        with self._lock:
+            counters = {name: dict(values) for name, values in self._counters.items()}
+        return {
+            name: dict(stage.as_dict(), **counters.get(name, {}))
+            for name, stage in self.stages.items()
+        }
+
+    def close(self):
+        self.session.close()
+        if self._openai is not None:
+            self._openai.close()
+
+
+_EXT_RE = re.compile(r'^\.[A-Za-z0-9]{1,5}$')
+
+
+class UrlCache:
+    """
+    Cache disque de fichiers distants, clé = sha256(url) :
+    <root>/<clé><ext> (contenu) + <root>/<clé>.json (url, ETag, Last-Modified).
+
+    - Revalidation par If-None-Match / If-Modified-Since : un 304 réutilise le
+      fichier local sans retransférer la vidéo.
+    - Pendant `fresh` secondes après une validation, aucune requête.
+    - Demandes concurrentes de la même URL fusionnées : un seul GET, les
+      autres threads attendent son résultat.
+    - Serveur injoignable ou en erreur : la copie locale est servie (périmée).
+    - Chaque réutilisation du fichier local rafraîchit son mtime : le ménage
+      (LRU / âge max sur le mtime) n'évince pas une URL encore demandée.
+    """
+
+    def __init__(self, root, http, stage, max_bytes=None, fresh=0.0, default_ext='.mp4'):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.http = http
+        self.stage = stage
+        self.max_bytes = max_bytes
+        self.fresh = fresh
+        self.default_ext = default_ext
+        self._lock = threading.Lock()
+        self._inflight = {}  # clé → Future du téléchargement en cours
+        self.hits = 0
+        self.revalidated = 0
+        self.downloads = 0
+        self.coalesced = 0
+        self.stale = 0
+        self.bytes_downloaded = 0
+
+    @staticmethod
+    def key(url):
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def _paths(self, url, key):
+        ext = os.path.splitext(urlsplit(url).path)[1].lower()
+        return self.root / f"{key}{ext if _EXT_RE.match(ext) else self.default_ext}", self.root / f"{key}.json"
+
+    def fetch(self, url):
+        """Chemin local à jour du fichier `url` (téléchargé ou revalidé si besoin)."""
+        key = self.key(url)
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            return flight.result()
+        try:
+            path = self._fetch(url, key)
+            flight.set_result(path)
+            return path
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    @staticmethod
+    def _touch(path):
+        try:
+            os.utime(path, None)
+        except OSError as e:
+            logger.debug("mtime de %s non rafraîchi : %s", path, e)
+
+    def _fetch(self, url, key):
+        data_path, meta_path = self._paths(url, key)
+        meta = {}
+        if data_path.exists():
+            try:
+                meta = json.loads(meta_path.read_text())
+            except (OSError, ValueError):
+                meta = {}
+        if meta and time.time() - meta.get('validated_at', 0) < self.fresh:
+            with self._lock:
+                self.hits += 1
+            self._touch(data_path)
+            return data_path
+
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        try:
+            resp, written = self.http.download(self.stage, url, data_path, headers=headers or None,
+                                               max_bytes=self.max_bytes)
+        except (requests.RequestException, OSError) as e:
+            if not meta:
+                raise
+            with self._lock:
+                self.stale += 1
+            logger.warning("Revalidation de %s impossible (%s) : copie locale servie", url, e)
+            self._touch(data_path)
+            return data_path
+
+        if resp.status_code == 304:
+            meta['validated_at'] = time.time()
+            with self._lock:
+                self.revalidated += 1
+            self._touch(data_path)
+        else:
+            meta = {
+                'url': url,
+                'etag': resp.headers.get('ETag'),
+                'last_modified': resp.headers.get('Last-Modified'),
+                'size': written,
+                'validated_at': time.time(),
+            }
+            with self._lock:
+                self.downloads += 1
+                self.bytes_downloaded += written
+        tmp = meta_path.with_name(meta_path.name + '.tmp')
+        tmp.write_text(json.dumps(meta))
+        os.replace(tmp, meta_path)
+        return data_path
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'revalidated': self.revalidated,
+                'downloads': self.downloads,
+                'coalesced': self.coalesced,
+                'stale': self.stale,
+                'bytes_downloaded': self.bytes_downloaded,
+            }
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Service des médias (vidéos / audio) pour les deux backends.
+
+- Requêtes Range : 206 avec Content-Range (seek dans <video>), 416 si hors bornes.
+- ETag fort + Last-Modified, 304 sur If-None-Match / If-Modified-Since, If-Range.
+- Cache-Control : `immutable` pour les sorties de job (nom unique, jamais réécrites),
+  revalidation par ETag sinon.
+- Corps : sendfile (zéro copie) quand le serveur WSGI le fait en respectant
+  Content-Length (gunicorn), sinon lecture bornée par blocs.
+- Mode X-Accel-Redirect (optionnel) : Flask ne renvoie que les en-têtes, nginx
+  sert les octets depuis une location `internal`.
+"""
+
+import mimetypes
+import os
+import re
+import stat
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import quote
+
+from flask import Response, request
+
+CHUNK_SIZE = 1 << 20
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE = 'public, max-age=0, must-revalidate'
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def etag_for(st):
+    """ETag fort : inode + taille + mtime (les fichiers sont remplacés atomiquement, jamais modifiés)."""
+    return f'"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"'
+
+
+def parse_range(header, size):
+    """
+    Range « bytes=a-b » → (start, end) inclusifs, None si absent / multi-plages
+    (réponse complète), ou 'invalid' si non satisfiable.
+    """
+    if not header:
+        return None
+    match = _RANGE_RE.match(header.strip())
+    if not match:
+        return None  # multi-plages ou unité inconnue : on sert le fichier entier
+    first, last = match.groups()
+    if not first and not last:
+        return 'invalid'
+    if not first:
+        length = int(last)
+        if length == 0:
+            return 'invalid'
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return 'invalid'
+    return start, end
+
+
+def _not_modified(st, etag):
+    inm = request.headers.get('If-None-Match')
+    if inm:
+        return inm.strip() == '*' or etag in [tag.strip() for tag in inm.split(',')]
+    ims = request.headers.get('If-Modified-Since')
+    if ims:
+        try:
+            return int(st.st_mtime) <= parsedate_to_datetime(ims).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _file_body(path, start, length):
+    """Corps de réponse : sendfile si le serveur le permet, sinon lecture par blocs."""
+    f = open(path, 'rb')
+    f.seek(start)
+    wrapper = request.environ.get('wsgi.file_wrapper')
+    # gunicorn : sendfile depuis la position courante, borné par Content-Length
+    if wrapper is not None and request.environ.get('SERVER_SOFTWARE', '').startswith('gunicorn'):
+        return wrapper(f, CHUNK_SIZE)
+
+    def chunks():
+        remaining = length
+        try:
+            while remaining > 0:
+                data = f.read(min(CHUNK_SIZE, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield data
+        finally:
+            f.close()
+    return chunks()
+
+
+def send_media(path, mimetype=None, immutable=False, download_name=None,
+               accel_root=None, accel_prefix=None, extra_headers=None):
+    """
+    Réponse HTTP pour `path` (None si ce n'est pas un fichier ordinaire existant :
+    à l'appelant de renvoyer son 404). `accel_prefix` active X-Accel-Redirect : le chemin
+    relatif à `accel_root` est ajouté au préfixe de la location nginx interne.
+    """
+    try:
+        st = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None  # dossier, fifo… : 404 plutôt qu'un IsADirectoryError (500)
+
+    etag = etag_for(st)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': formatdate(st.st_mtime, usegmt=True),
+        'Cache-Control': IMMUTABLE_CACHE if immutable else REVALIDATE_CACHE,
+        'Accept-Ranges': 'bytes',
+    }
+    if download_name:
+        headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(download_name)}"
+    headers.update(extra_headers or {})
+    mimetype = mimetype or mimetypes.guess_type(str(path))[0] or 'application/octet-stream'
+
+    if _not_modified(st, etag):
+        return Response(status=304, headers=headers)
+
+    if accel_prefix and accel_root:
+        rel = os.path.relpath(os.path.abspath(path), os.path.abspath(accel_root))
+        headers['X-Accel-Redirect'] = f"{accel_prefix.rstrip('/')}/{quote(rel.replace(os.sep, '/'))}"
+        return Response(status=200, headers=headers, mimetype=mimetype)
+
+    size = st.st_size
+    byte_range = parse_range(request.headers.get('Range'), size)
+    if_range = request.headers.get('If-Range')
+    if byte_range is not None and if_range and if_range.strip() != etag:
+        byte_range = None  # le fichier a changé depuis : réponse complète
+
+    if byte_range == 'invalid':
+        headers['Content-Range'] = f'bytes */{size}'
+        return Response(status=416, headers=headers)
+
+    if byte_range is None:
+        status, start, length = 200, 0, size
+    else:
+        start, end = byte_range
+        status, length = 206, end - start + 1
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+    body = None if request.method == 'HEAD' else _file_body(path, start, length)
+    response = Response(body, status=status, headers=headers, mimetype=mimetype, direct_passthrough=True)
+    response.headers['Content-Length'] = str(length)
+    return response
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+Métriques au format texte Prometheus (route /metrics des deux backends).
+
+Sans dépendance : compteurs, jauges et histogrammes à étiquettes, rendus à la
+demande. Les jauges peuvent être calculées au moment du scrape (fonction
+passée à `Gauge.set_function`) : connexions, file d'attente, disque.
+
+`StageMetrics.stage(nom)` chronomètre une étape du pipeline :
+- durée dans l'histogramme `<prefix>_stage_seconds{stage=…}` ;
+- exception → `<prefix>_stage_errors_total{stage=…, kind="timeout"|"error"}` ;
+- avec `span=` (ex. musetalk_trace.span), chaque étape est aussi un span de
+  la trace du job ; le bloc reçoit son dict d'attributs.
+"""
+
+import math
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Du décodage (~10 ms) à l'inférence MuseTalk (~minutes)
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} : étiquettes attendues {self.labelnames}, reçues {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return self._header() + [
+            f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}' for key, value in values
+        ]
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+        self._function = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function):
+        """
+        Valeur calculée au scrape : `function()` retourne un nombre (sans
+        étiquette) ou un dict {valeurs d'étiquettes (tuple ou str): nombre}.
+        """
+        self._function = function
+
+    def _collect(self):
+        if self._function is None:
+            with self._lock:
+                return dict(self._values)
+        result = self._function()
+        if not isinstance(result, dict):
+            return {(): result}
+        return {key if isinstance(key, tuple) else (key,): value for key, value in result.items()}
+
+    def render(self):
+        lines = self._header()
+        for key, value in sorted(self._collect().items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._series = {}  # clé → [compte par bucket (non cumulé)…, somme, total]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = next(i for i, bound in enumerate(self.buckets) if value <= bound)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        with self._lock:
+            series = sorted((key, list(values)) for key, values in self._series.items())
+        lines = self._header()
+        for key, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(float(bound)))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(values[-2])}')
+            lines.append(f'{self.name}_count{labels} {values[-1]}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._add(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:  # une jauge en échec ne casse pas tout le scrape
+                lines.append(f'# {metric.name} indisponible : {type(e).__name__}')
+        return '\n'.join(lines) + '\n'
+
+
+def is_timeout(exc):
+    """requests / openai / subprocess / socket : toutes leurs erreurs de délai ont « Timeout » dans le nom."""
+    return isinstance(exc, TimeoutError) or any('Timeout' in cls.__name__ for cls in type(exc).__mro__)
+
+
+class StageMetrics:
+    """Durées et erreurs par étape du pipeline, dans un Registry."""
+
+    def __init__(self, registry, prefix, buckets=DEFAULT_BUCKETS, span=None):
+        self._span = span
+        self.seconds = registry.histogram(
+            f'{prefix}_stage_seconds', 'Durée de chaque étape du pipeline (s)', ('stage',), buckets
+        )
+        self.errors = registry.counter(
+            f'{prefix}_stage_errors_total', "Étapes terminées en erreur, par type (timeout | error)", ('stage', 'kind')
+        )
+
+    def observe(self, stage, seconds):
+        self.seconds.observe(seconds, stage=stage)
+
+    def error(self, stage, exc):
+        self.errors.inc(stage=stage, kind='timeout' if is_timeout(exc) else 'error')
+
+    @contextmanager
+    def stage(self, stage, **attrs):
+        start = time.perf_counter()
+        try:
+            with self._span(stage, **attrs) if self._span else nullcontext(attrs) as span_attrs:
+                yield span_attrs
+        except BaseException as e:
+            if isinstance(e, Exception):
+                self.error(stage, e)
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - start)
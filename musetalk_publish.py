@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+Publication des vidéos hors du chemin critique.
+
+Le `chat_result` part tout de suite avec l'URL servie par le backend ; la copie
+vers le front (ou ailleurs) est faite ensuite par un pool de workers, avec
+retries, puis signalée par un callback (événement `video_published`).
+
+Destinations (« sinks ») interchangeables :
+- LocalDirSink : copie dans un dossier local (tests, volume partagé, nginx).
+- SshSink      : scp (ou rsync) via une connexion SSH maîtresse persistante
+                 (ControlMaster) : une seule poignée de main pour toutes les vidéos.
+- HttpPutSink  : PUT HTTP (stockage objet, WebDAV…) avec une session réutilisée.
+"""
+
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+from musetalk_storage import link_or_copy
+
+logger = logging.getLogger(__name__)
+
+
+class PublishError(RuntimeError):
+    """La copie vers une destination a échoué (après tous les essais)."""
+
+
+class LocalDirSink:
+    name = 'local'
+
+    def __init__(self, root, public_base):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.public_base = public_base.rstrip('/')
+
+    def publish(self, path, name):
+        link_or_copy(path, self.root / name)
+        return f"{self.public_base}/{name}"
+
+    def close(self):
+        pass
+
+
+class SshSink:
+    """
+    Copie via scp (défaut) ou rsync sur une connexion SSH multiplexée :
+    la première copie ouvre la connexion maîtresse, les suivantes la réutilisent
+    (`ControlPersist` la garde ouverte entre deux vidéos).
+    """
+    name = 'ssh'
+
+    def __init__(self, target, remote_dir, public_base, key_path=None, port=22,
+                 tool='scp', persist=600, timeout=60):
+        self.target = target
+        self.remote_dir = remote_dir.rstrip('/')
+        self.public_base = public_base.rstrip('/')
+        self.tool = tool
+        self.timeout = timeout
+        control_path = os.path.join(tempfile.gettempdir(), f"musetalk-ssh-{os.getpid()}-%C")
+        self.ssh_opts = [
+            '-p', str(port),
+            '-o', 'StrictHostKeyChecking=no',
+            '-o', 'BatchMode=yes',
+            '-o', 'ControlMaster=auto',
+            '-o', f'ControlPath={control_path}',
+            '-o', f'ControlPersist={persist}',
+        ]
+        if key_path:
+            self.ssh_opts[:0] = ['-i', str(key_path)]
+
+    def _command(self, path, name):
+        dest = f"{self.target}:{self.remote_dir}/{name}"
+        if self.tool == 'rsync':
+            ssh = ' '.join(['ssh'] + self.ssh_opts)
+            return ['rsync', '-t', '--partial', '-e', ssh, str(path), dest]
+        # scp attend -P pour le port
+        opts = ['-P' if opt == '-p' else opt for opt in self.ssh_opts]
+        return ['scp', '-q'] + opts + [str(path), dest]
+
+    def publish(self, path, name):
+        completed = subprocess.run(
+            self._command(path, name), capture_output=True, text=True, timeout=self.timeout
+        )
+        if completed.returncode != 0:
+            raise PublishError(f"{self.tool} exit {completed.returncode}: {completed.stderr.strip()}")
+        return f"{self.public_base}/{name}"
+
+    def close(self):
+        subprocess.run(['ssh'] + self.ssh_opts + ['-O', 'exit', self.target],
+                       capture_output=True, timeout=10)
+
+
+class HttpPutSink:
+    name = 'http'
+
+    def __init__(self, upload_base, public_base=None, headers=None, timeout=60):
+        self.upload_base = upload_base.rstrip('/')
+        self.public_base = (public_base or upload_base).rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(headers or {})
+
+    def publish(self, path, name):
+        with open(path, 'rb') as f:
+            resp = self.session.put(
+                f"{self.upload_base}/{name}", data=f, timeout=self.timeout,
+                headers={'Content-Type': 'video/mp4'}
+            )
+        if resp.status_code >= 300:
+            raise PublishError(f"PUT {resp.status_code}: {resp.text[:200]}")
+        return f"{self.public_base}/{name}"
+
+    def close(self):
+        self.session.close()
+
+
+class Publisher:
+    """
+    File de publication : `submit()` rend la main immédiatement, un pool de
+    `workers` threads copie le fichier vers chaque sink (avec `retries` essais
+    et backoff exponentiel), puis appelle on_done(context, urls, errors) si au
+    moins un sink a réussi (`errors` : échecs des autres sinks, vide sinon), ou
+    on_failed(context, errors). `observer(sink, secondes, erreur)` reçoit la
+    durée de chaque copie (réessais compris), pour les métriques.
+    """
+
+    def __init__(self, sinks, workers=2, retries=3, backoff=1.0, on_done=None, on_failed=None, observer=None):
+        self.sinks = list(sinks)
+        self.retries = retries
+        self.backoff = backoff
+        self.on_done = on_done
+        self.on_failed = on_failed
+        self.observer = observer
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='publish')
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.published = 0
+        self.partial = 0               # au moins un sink réussi, au moins un en échec
+        self.failed = 0
+        self.retried = 0
+        self.last_error = None
+        self._total_seconds = 0.0
+
+    def submit(self, path, name, context=None):
+        if not self.sinks:
+            return None
+        with self._lock:
+            self.pending += 1
+        return self._pool.submit(self._publish, Path(path), name, context or {})
+
+    def _publish_one(self, sink, path, name):
+        for attempt in range(1, self.retries + 1):
+            try:
+                return sink.publish(path, name)
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                with self._lock:
+                    self.retried += 1
+                delay = self.backoff * 2 ** (attempt - 1)
+                logger.warning("Publication %s → %s échouée (essai %d/%d, %s), nouvel essai dans %.1fs",
+                               name, sink.name, attempt, self.retries, e, delay)
+                time.sleep(delay)
+
+    def _publish(self, path, name, context):
+        start = time.time()
+        urls, errors = {}, {}
+        for sink in self.sinks:
+            sink_start, error = time.time(), None
+            try:
+                urls[sink.name] = self._publish_one(sink, path, name)
+            except Exception as e:
+                error = e
+                errors[sink.name] = f"{type(e).__name__}: {e}"
+                logger.error("Publication %s → %s abandonnée : %s", name, sink.name, e)
+            if self.observer:
+                try:
+                    self.observer(sink.name, time.time() - sink_start, error)
+                except Exception:
+                    logger.exception("Observateur de publication en échec")
+
+        with self._lock:
+            self.pending -= 1
+            self._total_seconds += time.time() - start
+            if errors:
+                self.last_error = next(iter(errors.values()))
+            if not urls:
+                self.failed += 1
+            elif errors:
+                self.partial += 1
+            else:
+                self.published += 1
+
+        callback, args = (self.on_done, (urls, errors)) if urls else (self.on_failed, (errors,))
+        if callback:
+            try:
+                callback(context, *args)
+            except Exception:
+                logger.exception("Callback de publication en échec")
+        if urls:
+            logger.info("📤 %s publiée en %.2fs : %s", name, time.time() - start, urls)
+        return urls
+
+    def stats(self):
+        with self._lock:
+            done = self.published + self.partial + self.failed
+            return {
+                'sinks': [sink.name for sink in self.sinks],
+                'pending': self.pending,
+                'published': self.published,
+                'partial': self.partial,
+                'failed': self.failed,
+                'retried': self.retried,
+                'avg_seconds': round(self._total_seconds / done, 3) if done else None,
+                'last_error': self.last_error,
+            }
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+        for sink in self.sinks:
+            try:
+                sink.close()
+            except Exception:
+                pass
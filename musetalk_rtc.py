@@ -0,0 +1,605 @@
+# -*- coding: utf-8 -*-
+"""
+Pistes média WebRTC (aiortc) du backend.
+
+- MediaClock : horloge d'une session ; chaque piste attend l'instant de
+  présentation (pts) de sa prochaine frame au lieu de dormir une durée fixe,
+  donc pas de dérive et rattrapage (frames sautées) sous charge.
+- IdleClip : clip d'attente de l'avatar, décodé une seule fois en yuv420p et
+  partagé par toutes les sessions qui utilisent le même fichier.
+- FrameRing : anneau de frames préallouées où la sortie MuseTalk est écrite au
+  fil de la production ; la frame affichée est choisie par l'horloge.
+- AudioTimeline : file de PCM 48 kHz (TTS, piste son des vidéos MuseTalk)
+  placée sur la même horloge que la vidéo → lèvres et voix synchrones.
+- AvatarChannel : horloge + clip d'attente + anneau + file audio d'une session.
+- AvatarVideoTrack / AvatarAudioTrack : recopient la frame courante dans un
+  petit pool d'av.VideoFrame / av.AudioFrame réutilisées (aucune allocation
+  par frame), pts monotones sur l'horloge commune.
+- LoopPool : boucles asyncio longue durée (un thread chacune) qui possèdent
+  les RTCPeerConnection ; les handlers Socket.IO y soumettent leurs coroutines.
+- consume_mic : lit la piste micro du client, la ramène en 16 kHz et la
+  découpe en énoncés (Endpointer) remis au pipeline dès la fin de la parole.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from fractions import Fraction
+from pathlib import Path
+
+import av
+import numpy as np
+
+from musetalk_audio import (
+    AudioDecodeError, Endpointer, StreamResampler, TARGET_RATE, decode_audio, frames_to_mono, resample, to_pcm16
+)
+
+try:
+    from aiortc import MediaStreamTrack
+    from aiortc.mediastreams import MediaStreamError
+    AIORTC_AVAILABLE = True
+except ImportError:
+    AIORTC_AVAILABLE = False
+
+_AV_ERRORS = (getattr(av, 'FFmpegError', None) or av.AVError, IndexError)
+
+logger = logging.getLogger(__name__)
+
+VIDEO_CLOCK_RATE = 90000
+VIDEO_TIME_BASE = Fraction(1, VIDEO_CLOCK_RATE)
+AUDIO_RATE = 48000
+AUDIO_TIME_BASE = Fraction(1, AUDIO_RATE)
+AUDIO_SAMPLES_PER_FRAME = 960  # 20 ms
+
+
+class MediaClock:
+    """Horloge monotone d'une session, démarrée par la première piste lue."""
+
+    def __init__(self):
+        self._t0 = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._t0 is None:
+                self._t0 = time.monotonic()
+
+    @property
+    def started(self):
+        return self._t0 is not None
+
+    def now(self):
+        """Secondes écoulées depuis le démarrage (0 avant)."""
+        return time.monotonic() - self._t0 if self._t0 is not None else 0.0
+
+    async def sleep_until(self, t):
+        delay = t - self.now()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+# ----------  frames yuv420p  ----------
+def _split_yuv420p(frame, width, height):
+    """av.VideoFrame → (Y, U, V) ndarrays à la taille de la session."""
+    arr = frame.reformat(width=width, height=height, format='yuv420p').to_ndarray()
+    quarter = height // 4
+    y = arr[:height]
+    u = arr[height:height + quarter].reshape(height // 2, width // 2)
+    v = arr[height + quarter:].reshape(height // 2, width // 2)
+    return y, u, v
+
+
+def rgb_to_planes(rgb, width, height):
+    """Frame RGB (H, W, 3) uint8 → (Y, U, V), pour pousser des frames en mémoire."""
+    return _split_yuv420p(av.VideoFrame.from_ndarray(rgb, format='rgb24'), width, height)
+
+
+def _retime(frames, dst_fps):
+    """Ré-échantillonne des av.VideoFrame décodées au débit de la session (duplication / saut)."""
+    next_index = 0
+    for frame in frames:
+        t = frame.time if frame.time is not None else next_index / dst_fps
+        # La frame couvre jusqu'à la suivante : on la répète pour combler
+        while next_index <= round(t * dst_fps):
+            yield frame
+            next_index += 1
+
+
+class IdleClip:
+    """Frames d'attente préconverties (n, H, W) / (n, H/2, W/2), lues en boucle."""
+
+    def __init__(self, y, u, v, fps):
+        self.y, self.u, self.v = y, u, v
+        self.fps = fps
+
+    @classmethod
+    def black(cls, width, height, fps):
+        y = np.full((1, height, width), 16, np.uint8)
+        uv = np.full((1, height // 2, width // 2), 128, np.uint8)
+        return cls(y, uv, uv.copy(), fps)
+
+    def __len__(self):
+        return len(self.y)
+
+    def frame_at(self, t):
+        i = int(t * self.fps) % len(self.y)
+        return self.y[i], self.u[i], self.v[i]
+
+
+_idle_cache = {}
+_idle_lock = threading.Lock()
+
+
+def load_idle_clip(path, width, height, fps, max_seconds=4.0):
+    """
+    Décode (une fois) au plus `max_seconds` du clip d'attente, au format de la
+    session. Les sessions qui partagent le même fichier partagent les frames.
+    """
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        logger.warning("Clip d'attente introuvable (%s) : image noire", path)
+        return IdleClip.black(width, height, fps)
+
+    key = (os.path.abspath(path), mtime, width, height, fps)
+    with _idle_lock:
+        clip = _idle_cache.get(key)
+        if clip is not None:
+            return clip
+
+        n_max = max(1, int(max_seconds * fps))
+        y = np.empty((n_max, height, width), np.uint8)
+        u = np.empty((n_max, height // 2, width // 2), np.uint8)
+        v = np.empty((n_max, height // 2, width // 2), np.uint8)
+        n = 0
+        try:
+            with av.open(path) as container:
+                for frame in _retime(container.decode(video=0), fps):
+                    if n == n_max:
+                        break
+                    y[n], u[n], v[n] = _split_yuv420p(frame, width, height)
+                    n += 1
+        except _AV_ERRORS as e:
+            logger.error("Décodage du clip d'attente %s impossible : %s", path, e)
+        if n == 0:
+            return IdleClip.black(width, height, fps)
+
+        clip = IdleClip(y[:n], u[:n], v[:n], fps)
+        _idle_cache.clear()  # un seul avatar d'attente à la fois en pratique
+        _idle_cache[key] = clip
+        logger.info("🎞️ Clip d'attente %s chargé (%d frames %dx%d)", path, n, width, height)
+        return clip
+
+
+class FrameRing:
+    """
+    Anneau de `capacity` frames yuv420p préallouées pour la sortie MuseTalk.
+    Un segment démarre à un instant de l'horloge ; la frame k est affichée à
+    start + k/fps. Le producteur bloque quand il a `capacity` frames d'avance.
+    """
+
+    def __init__(self, width, height, fps, clock, capacity=50):
+        self.width, self.height = width, height
+        self.fps = fps
+        self.clock = clock
+        self.capacity = capacity
+        self.y = np.empty((capacity, height, width), np.uint8)
+        self.u = np.empty((capacity, height // 2, width // 2), np.uint8)
+        self.v = np.empty((capacity, height // 2, width // 2), np.uint8)
+        self._cond = threading.Condition()
+        self._generation = 0
+        self._start = None
+        self._written = 0
+        self._closed = True
+
+    def _played(self):
+        if self._start is None:
+            return 0
+        return max(0, int((self.clock.now() - self._start) * self.fps))
+
+    def start_segment(self, start_time):
+        """Nouveau segment (interrompt le précédent) ; retourne son numéro."""
+        with self._cond:
+            self._generation += 1
+            self._start = start_time
+            self._written = 0
+            self._closed = False
+            self._cond.notify_all()
+            return self._generation
+
+    def push(self, planes, generation):
+        """Copie une frame (Y, U, V) dans l'anneau ; False si le segment a été interrompu."""
+        with self._cond:
+            while (generation == self._generation
+                   and self._written - self._played() >= self.capacity):
+                self._cond.wait(timeout=1 / self.fps)
+            if generation != self._generation:
+                return False
+            slot = self._written % self.capacity
+        # Hors verrou : la case `slot` n'est plus lue (au moins `capacity` frames d'écart)
+        y, u, v = planes
+        np.copyto(self.y[slot], y)
+        np.copyto(self.u[slot], u)
+        np.copyto(self.v[slot], v)
+        with self._cond:
+            if generation == self._generation:
+                self._written += 1
+        return True
+
+    def end_segment(self, generation):
+        with self._cond:
+            if generation == self._generation:
+                self._closed = True
+
+    def stop(self):
+        with self._cond:
+            self._generation += 1
+            self._start = None
+            self._closed = True
+            self._cond.notify_all()
+
+    def frame_at(self, t):
+        """(Y, U, V) à afficher à l'instant t, ou None (pas de segment en cours)."""
+        with self._cond:
+            if self._start is None or t < self._start:
+                return None
+            index = int((t - self._start) * self.fps)
+            if index >= self._written:
+                if self._closed:
+                    self._start = None  # segment terminé : retour au clip d'attente
+                    return None
+                if not self._written:
+                    return None
+                index = self._written - 1  # producteur en retard : on fige la dernière frame
+            slot = index % self.capacity
+        return self.y[slot], self.u[slot], self.v[slot]
+
+    @property
+    def active(self):
+        return self._start is not None
+
+
+class LoopThread:
+    """
+    Boucle asyncio dans un thread dédié, qui vit aussi longtemps que le backend.
+    Mesure son retard (lag) : une boucle saturée par trop de pairs se voit ici.
+    """
+
+    def __init__(self, name, lag_interval=0.5):
+        self.name = name
+        self.lag_interval = lag_interval
+        self.loop = asyncio.new_event_loop()
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.peers = 0
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.create_task(self._watch_lag())
+        self.loop.run_forever()
+
+    async def _watch_lag(self):
+        while True:
+            t = time.monotonic()
+            await asyncio.sleep(self.lag_interval)
+            lag = max(0.0, time.monotonic() - t - self.lag_interval)
+            self.lag = 0.8 * self.lag + 0.2 * lag
+            self.max_lag = max(self.max_lag, lag)
+
+    def submit(self, coro):
+        """Planifie `coro` sur la boucle depuis n'importe quel thread → concurrent Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def stats(self):
+        return {
+            'name': self.name,
+            'peers': self.peers,
+            'tasks': len(asyncio.all_tasks(self.loop)),
+            'lag_ms': round(self.lag * 1000, 2),
+            'max_lag_ms': round(self.max_lag * 1000, 2),
+        }
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=5)
+
+
+class LoopPool:
+    """
+    Petit pool de LoopThread. Chaque clé (client Socket.IO) est attachée à la
+    boucle la moins chargée et y reste : sa RTCPeerConnection, ses pistes et
+    leur fermeture s'exécutent toujours sur la même boucle.
+    """
+
+    def __init__(self, size=1, name='rtc-loop'):
+        self.loops = [LoopThread(f"{name}-{i}") for i in range(max(1, size))]
+        self._owners = {}
+        self._lock = threading.Lock()
+
+    def loop_for(self, key):
+        with self._lock:
+            loop = self._owners.get(key)
+            if loop is None:
+                loop = min(self.loops, key=lambda lt: lt.peers)
+                loop.peers += 1
+                self._owners[key] = loop
+            return loop
+
+    def submit(self, key, coro):
+        return self.loop_for(key).submit(coro)
+
+    def run(self, key, coro, timeout=None):
+        """Exécute `coro` sur la boucle de `key` et attend son résultat (thread appelant bloqué)."""
+        return self.submit(key, coro).result(timeout)
+
+    def release(self, key):
+        with self._lock:
+            loop = self._owners.pop(key, None)
+            if loop is not None:
+                loop.peers -= 1
+
+    def stats(self):
+        return [loop.stats() for loop in self.loops]
+
+    def stop(self):
+        for loop in self.loops:
+            loop.stop()
+
+
+class AudioTimeline:
+    """
+    File de segments PCM s16 48 kHz, chacun placé à un échantillon de départ
+    sur l'horloge de la session. La piste audio lit la fenêtre de 20 ms
+    correspondant à son pts ; hors segment, c'est du silence.
+    """
+
+    def __init__(self, rate=AUDIO_RATE):
+        self.rate = rate
+        self._segments = deque()  # (start_sample, pcm int16)
+        self._lock = threading.Lock()
+
+    def schedule(self, pcm, start_time):
+        """Place `pcm` (int16, déjà à `rate`) à l'instant `start_time` de l'horloge."""
+        start = int(round(start_time * self.rate))
+        with self._lock:
+            self._segments.append((start, pcm))
+            if len(self._segments) > 1 and self._segments[-2][0] > start:
+                self._segments = deque(sorted(self._segments, key=lambda seg: seg[0]))
+        return start_time
+
+    def end_time(self):
+        """Fin (s) du dernier segment en file, None si la file est vide."""
+        with self._lock:
+            if not self._segments:
+                return None
+            return max(start + len(pcm) for start, pcm in self._segments) / self.rate
+
+    def read_into(self, out, position):
+        """Remplit `out` (int16) avec les échantillons [position, position + len(out))."""
+        n = len(out)
+        end = position + n
+        out.fill(0)
+        with self._lock:
+            # Segments entièrement joués : retirés de la file
+            while self._segments and self._segments[0][0] + len(self._segments[0][1]) <= position:
+                self._segments.popleft()
+            for start, pcm in self._segments:
+                if start >= end:
+                    break
+                a, b = max(position, start), min(end, start + len(pcm))
+                if a < b:
+                    out[a - position:b - position] = pcm[a - start:b - start]
+
+    def clear(self):
+        with self._lock:
+            self._segments.clear()
+
+
+def pcm_to_48k(samples, rate):
+    """float32 mono (ou int16) à `rate` → int16 48 kHz pour la piste audio."""
+    if samples.dtype == np.int16:
+        samples = samples.astype(np.float32) / 32768.0
+    return to_pcm16(resample(samples, rate, AUDIO_RATE))
+
+
+class AvatarChannel:
+    """Média d'une session WebRTC : horloge commune, clip d'attente, sortie MuseTalk, voix."""
+
+    def __init__(self, width=640, height=480, fps=25, idle_path=None, ring_seconds=2.0, lead=0.1):
+        self.width, self.height = width - width % 2, height - height % 2
+        self.fps = fps
+        self.lead = lead
+        self.clock = MediaClock()
+        self.idle = (load_idle_clip(idle_path, self.width, self.height, fps) if idle_path
+                     else IdleClip.black(self.width, self.height, fps))
+        self.ring = FrameRing(self.width, self.height, fps, self.clock,
+                              capacity=max(2, int(ring_seconds * fps)))
+        self.audio = AudioTimeline()
+
+    def video_planes(self, t):
+        return self.ring.frame_at(t) or self.idle.frame_at(t)
+
+    def queue_speech(self, samples, rate):
+        """
+        Met une voix (TTS…) en file sur la piste audio, après ce qui est déjà
+        en file. Retourne l'instant (horloge) où elle commence.
+        """
+        self.clock.start()
+        start = max(self.clock.now() + self.lead, self.audio.end_time() or 0.0)
+        return self.audio.schedule(pcm_to_48k(samples, rate), start)
+
+    def push_frames(self, frames, start_time=None):
+        """
+        Joue une suite d'av.VideoFrame (bloquant, à appeler hors de la boucle
+        asyncio) : elles sont converties une fois et partagées par les pistes.
+        """
+        self.clock.start()
+        if start_time is None:
+            start_time = self.clock.now() + self.lead
+        generation = self.ring.start_segment(start_time)
+        count = 0
+        try:
+            for frame in _retime(frames, self.fps):
+                if not self.ring.push(_split_yuv420p(frame, self.width, self.height), generation):
+                    break
+                count += 1
+        finally:
+            self.ring.end_segment(generation)
+        return count
+
+    def _play_file(self, path):
+        try:
+            try:
+                samples, rate = decode_audio(Path(path).read_bytes())
+            except AudioDecodeError:
+                samples = None
+            has_speech = samples is not None and len(samples)
+            with av.open(str(path)) as container:
+                if not container.streams.video:
+                    # Audio seul (sortie TTS) : en file après la voix en cours,
+                    # la vidéo reste sur le clip d'attente
+                    if has_speech:
+                        self.queue_speech(samples, rate)
+                    logger.info("🔊 %s mis en file sur la piste audio", os.path.basename(str(path)))
+                    return
+                # Nouvelle vidéo : elle remplace ce qui reste en file ; sa piste son
+                # (voix TTS muxée par MuseTalk) part au même instant que les frames
+                self.clock.start()
+                start = self.clock.now() + self.lead
+                self.audio.clear()
+                if has_speech:
+                    self.audio.schedule(pcm_to_48k(samples, rate), start)
+                count = self.push_frames(container.decode(video=0), start)
+            logger.info("🎬 %s joué sur la piste vidéo (%d frames)", os.path.basename(str(path)), count)
+        except Exception as e:
+            logger.error("Lecture de %s sur la piste vidéo impossible : %s", path, e)
+
+    def play_video(self, path):
+        """
+        Lit une vidéo MuseTalk sur les pistes, ou met un audio TTS en file sur la
+        piste audio, en tâche de fond.
+        """
+        threading.Thread(target=self._play_file, args=(path,), daemon=True,
+                         name='rtc-play').start()
+
+    def interrupt(self):
+        self.ring.stop()
+        self.audio.clear()
+
+
+if AIORTC_AVAILABLE:
+
+    class AvatarVideoTrack(MediaStreamTrack):
+        """
+        Piste vidéo cadencée par pts : la frame n est émise à n/fps sur
+        l'horloge de la session. Les av.VideoFrame viennent d'un pool réutilisé
+        (l'encodeur a fini avec une frame avant que la suivante ne soit demandée).
+        """
+        kind = "video"
+
+        def __init__(self, channel, pool_size=3):
+            super().__init__()
+            self.channel = channel
+            self._pool = [av.VideoFrame(channel.width, channel.height, 'yuv420p') for _ in range(pool_size)]
+            self._views = [
+                [np.frombuffer(plane, np.uint8).reshape(plane.height, plane.line_size)[:, :plane.width]
+                 for plane in frame.planes]
+                for frame in self._pool
+            ]
+            self._index = -1
+            self.frames_sent = 0
+            self.frames_skipped = 0
+
+        async def recv(self):
+            clock = self.channel.clock
+            clock.start()
+            fps = self.channel.fps
+            # En retard (CPU chargé) : on saute à la frame courante plutôt que de dériver
+            index = max(self._index + 1, int(clock.now() * fps))
+            self.frames_skipped += index - self._index - 1 if self._index >= 0 else 0
+            self._index = index
+            t = index / fps
+            await clock.sleep_until(t)
+
+            slot = index % len(self._pool)
+            for view, src in zip(self._views[slot], self.channel.video_planes(t)):
+                np.copyto(view, src)
+            frame = self._pool[slot]
+            frame.pts = round(t * VIDEO_CLOCK_RATE)
+            frame.time_base = VIDEO_TIME_BASE
+            self.frames_sent += 1
+            return frame
+
+
+    class AvatarAudioTrack(MediaStreamTrack):
+        """
+        Piste audio 48 kHz mono, trames de 20 ms : pts en échantillons sur
+        l'horloge de la session, voix en file (AudioTimeline) ou silence.
+        """
+        kind = "audio"
+
+        def __init__(self, channel, pool_size=3, max_lag=0.1):
+            super().__init__()
+            self.channel = channel
+            self.max_lag = max_lag
+            self._pool = []
+            self._views = []
+            for _ in range(pool_size):
+                frame = av.AudioFrame(format='s16', layout='mono', samples=AUDIO_SAMPLES_PER_FRAME)
+                frame.sample_rate = AUDIO_RATE
+                frame.time_base = AUDIO_TIME_BASE
+                self._pool.append(frame)
+                self._views.append(np.frombuffer(frame.planes[0], np.int16)[:AUDIO_SAMPLES_PER_FRAME])
+            self._pts = None
+            self._count = 0
+            self.samples_skipped = 0
+
+        async def recv(self):
+            clock = self.channel.clock
+            clock.start()
+            now = int(clock.now() * AUDIO_RATE)
+            if self._pts is None:
+                self._pts = now
+            else:
+                self._pts += AUDIO_SAMPLES_PER_FRAME
+                # Trop en retard (boucle chargée) : on recale sur l'horloge, comme la vidéo
+                if now - self._pts > self.max_lag * AUDIO_RATE:
+                    self.samples_skipped += now - self._pts
+                    self._pts = now
+            await clock.sleep_until(self._pts / AUDIO_RATE)
+
+            slot = self._count % len(self._pool)
+            self._count += 1
+            self.channel.audio.read_into(self._views[slot], self._pts)
+            frame = self._pool[slot]
+            frame.pts = self._pts
+            return frame
+
+
+    async def consume_mic(track, on_utterance, endpointer=None):
+        """
+        Lit la piste audio entrante (micro du client) jusqu'à sa fin : PCM
+        16 kHz mono → Endpointer → on_utterance(pcm int16) pour chaque énoncé.
+        `on_utterance` est appelé sur la boucle : il doit rendre la main tout
+        de suite (soumission à un pool de threads).
+        """
+        endpointer = endpointer or Endpointer()
+        resampler = None
+        while True:
+            try:
+                frame = await track.recv()
+            except MediaStreamError:
+                break
+            if resampler is None or resampler.src_rate != frame.sample_rate:
+                resampler = StreamResampler(frame.sample_rate, TARGET_RATE)
+            pcm = to_pcm16(resampler.process(frames_to_mono([frame])))
+            for utterance in endpointer.feed(pcm):
+                on_utterance(utterance)
+        tail = endpointer.flush()
+        if tail is not None:
+            on_utterance(tail)
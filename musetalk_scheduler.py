@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+Ordonnanceur de jobs du backend MuseTalk.
+
+Remplace le thread-par-message. Deux ressources bornées, une par type d'étape :
+- `io_workers` permis pour les étapes I/O (audio, Whisper, GPT, TTS…) ;
+- `inference_slots` slots GPU pour MuseTalk, attribués dans l'ordre d'arrivée.
+Un job rend son permis I/O pendant qu'il attend (puis occupe) un slot GPU :
+des jobs en file pour le GPU ne bloquent pas les appels fournisseurs des
+nouveaux jobs. Chaque job admis a son thread (au plus `max_queue`) ; au-delà,
+les nouveaux messages sont refusés immédiatement.
+"""
+
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(RuntimeError):
+    """File d'attente pleine : le job est refusé sans être mis en attente."""
+
+
+class Job:
+    __slots__ = ('id', 'client_id', 'state', 'stage', 'submitted_at', 'started_at',
+                 'io_started_at', 'inference_started_at', 'finished_at', 'error', 'slot')
+
+    def __init__(self, client_id):
+        self.id = uuid.uuid4().hex[:12]
+        self.client_id = client_id
+        self.state = 'queued'          # queued → running → waiting_inference → inference → waiting_io → running → done/failed
+        self.stage = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.io_started_at = None      # début de la détention courante du permis I/O
+        self.inference_started_at = None
+        self.finished_at = None
+        self.error = None
+        self.slot = None               # index du slot d'inférence occupé
+
+    def as_dict(self):
+        now = time.time()
+        return {
+            'job_id': self.id,
+            'client_id': self.client_id,
+            'state': self.state,
+            'stage': self.stage,
+            'waited_seconds': round((self.started_at or now) - self.submitted_at, 2),
+            'running_seconds': round(now - self.started_at, 2) if self.started_at else 0,
+        }
+
+
+class JobScheduler:
+    """
+    Pool borné pour les jobs + slots d'inférence FIFO.
+    `on_wait(job, position, eta)` est appelé quand la position d'un job dans
+    la file d'inférence change (pour émettre un `status` au client).
+    """
+
+    def __init__(self, io_workers=4, inference_slots=1, max_queue=8,
+                 initial_inference_seconds=30.0, initial_io_seconds=5.0, on_wait=None):
+        self.io_workers = io_workers
+        self.inference_slots = inference_slots
+        self.max_queue = max_queue
+        self.on_wait = on_wait
+
+        # Un thread par job admis ; la concurrence I/O est bornée par `_io`
+        self._pool = ThreadPoolExecutor(max_workers=max(io_workers, max_queue), thread_name_prefix='job')
+        self._io = threading.BoundedSemaphore(io_workers)
+        self._lock = threading.Condition()
+        self._jobs = {}                 # job_id → Job (non terminés)
+        self._inference_waiters = deque()
+        self._inference_running = set()
+        self._avg_inference = initial_inference_seconds
+        self._avg_io = initial_io_seconds  # durée moyenne de détention d'un permis I/O
+        self._local = threading.local()
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    # ----------  soumission  ----------
+    def submit(self, client_id, fn, *args, **kwargs):
+        """Place un job dans le pool ; lève QueueFull si la file est pleine."""
+        with self._lock:
+            if len(self._jobs) >= self.max_queue:
+                self.rejected += 1
+                raise QueueFull(f"{len(self._jobs)} jobs en cours (max {self.max_queue})")
+            job = Job(client_id)
+            self._jobs[job.id] = job
+        self._pool.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def queue_status(self, job):
+        """
+        (position, eta) du job, lus sous le verrou : dans la file I/O tant qu'il
+        n'a pas démarré, puis dans la file d'inférence. (0, 0.0) s'il n'attend pas.
+        """
+        with self._lock:
+            if job in self._inference_waiters:
+                position = self._inference_waiters.index(job) + 1
+                return position, self._inference_eta(position)
+            if job.state != 'queued':
+                return 0, 0.0
+            holders = [j for j in self._jobs.values() if j.io_started_at]
+            if len(holders) < self.io_workers:
+                return 0, 0.0
+            queued = [j for j in self._jobs.values() if j.state == 'queued']
+            position = next((i + 1 for i, j in enumerate(queued) if j is job), 0)
+            return position, self._io_eta(position, holders) if position else 0.0
+
+    def _acquire_io(self, job):
+        self._io.acquire()
+        self._local.io_held = True
+        job.io_started_at = time.time()
+
+    def _release_io(self, job):
+        self._local.io_held = False
+        with self._lock:
+            if job.io_started_at:
+                # Moyenne glissante pour l'ETA de la file I/O
+                self._avg_io = 0.7 * self._avg_io + 0.3 * (time.time() - job.io_started_at)
+            job.io_started_at = None
+        self._io.release()
+
+    def _run(self, job, fn, args, kwargs):
+        self._acquire_io(job)
+        job.state = 'running'
+        job.started_at = time.time()
+        self._local.job = job
+        try:
+            fn(*args, **kwargs)
+            job.state = 'done'
+        except Exception as e:
+            job.state = 'failed'
+            job.error = f'{type(e).__name__}: {e}'
+            logger.exception("Job %s en échec", job.id)
+        finally:
+            if getattr(self._local, 'io_held', False):
+                self._release_io(job)
+            job.finished_at = time.time()
+            self._local.job = None
+            with self._lock:
+                self._jobs.pop(job.id, None)
+                if job.state == 'done':
+                    self.completed += 1
+                else:
+                    self.failed += 1
+
+    def active_job_ids(self):
+        with self._lock:
+            return set(self._jobs)
+
+    def current_job(self):
+        return getattr(self._local, 'job', None)
+
+    def set_stage(self, stage):
+        job = self.current_job()
+        if job is not None:
+            job.stage = stage
+
+    # ----------  ETA (appelées sous self._lock)  ----------
+    def _io_eta(self, position, holders):
+        """ETA (s) avant l'obtention d'un permis I/O pour un job à `position` (1 = prochain)."""
+        now = time.time()
+        busy_until = min(max(0.0, self._avg_io - (now - j.io_started_at)) for j in holders)
+        rounds = (position - 1) // self.io_workers
+        return round(busy_until + rounds * self._avg_io, 1)
+
+    def _inference_eta(self, position):
+        """ETA (s) avant le démarrage de l'inférence pour un job à `position` (1 = prochain)."""
+        now = time.time()
+        remaining = [max(0.0, self._avg_inference - (now - j.inference_started_at))
+                     for j in self._inference_running if j.inference_started_at]
+        busy_until = min(remaining) if len(remaining) >= self.inference_slots and remaining else 0.0
+        rounds = (position - 1) // self.inference_slots
+        return round(busy_until + rounds * self._avg_inference, 1)
+
+    # ----------  slot d'inférence  ----------
+    @contextmanager
+    def inference_slot(self):
+        """
+        Réserve un slot d'inférence (FIFO) pour le job du thread courant.
+        `job.slot` donne l'index du slot (0 … inference_slots-1), pour choisir
+        le worker MuseTalk associé.
+        """
+        job = self.current_job() or Job(None)
+        # Le permis I/O est rendu pendant l'attente et l'inférence GPU
+        io_held = getattr(self._local, 'io_held', False)
+        if io_held:
+            self._release_io(job)
+        try:
+            with self._lock:
+                self._inference_waiters.append(job)
+                job.state = 'waiting_inference'
+            last_position = None
+            while True:
+                with self._lock:
+                    try:
+                        if (self._inference_waiters[0] is job
+                                and len(self._inference_running) < self.inference_slots):
+                            self._inference_waiters.popleft()
+                            busy = {j.slot for j in self._inference_running}
+                            job.slot = next(i for i in range(self.inference_slots) if i not in busy)
+                            self._inference_running.add(job)
+                            job.state = 'inference'
+                            job.inference_started_at = time.time()
+                            self._lock.notify_all()
+                            break
+                        position = self._inference_waiters.index(job) + 1
+                        notify = self.on_wait is not None and position != last_position
+                        if notify:
+                            last_position = position
+                            eta = self._inference_eta(position)
+                        else:
+                            self._lock.wait(timeout=5)
+                    except BaseException:
+                        if job in self._inference_waiters:
+                            self._inference_waiters.remove(job)
+                            self._lock.notify_all()
+                        raise
+                if notify:
+                    # Hors verrou : un emit lent ne bloque ni les libérations de slot ni les submit
+                    self._notify_wait(job, position, eta)
+
+            try:
+                yield job
+            finally:
+                duration = time.time() - job.inference_started_at
+                with self._lock:
+                    self._inference_running.discard(job)
+                    # Moyenne glissante pour l'ETA
+                    self._avg_inference = 0.7 * self._avg_inference + 0.3 * duration
+                    job.state = 'waiting_io' if io_held else 'running'
+                    job.inference_started_at = None
+                    job.slot = None
+                    self._lock.notify_all()
+        finally:
+            if io_held:
+                self._acquire_io(job)
+                job.state = 'running'
+
+    def _notify_wait(self, job, position, eta):
+        try:
+            self.on_wait(job, position, eta)
+        except Exception:
+            logger.exception("on_wait a échoué")
+
+    # ----------  vue  ----------
+    def snapshot(self):
+        with self._lock:
+            jobs = [j.as_dict() for j in sorted(self._jobs.values(), key=lambda j: j.submitted_at)]
+            waiting = [j.id for j in self._inference_waiters]
+        for entry in jobs:
+            if entry['job_id'] in waiting:
+                entry['inference_position'] = waiting.index(entry['job_id']) + 1
+        return {
+            'running': [j for j in jobs if j['state'] != 'queued'],
+            'pending': [j for j in jobs if j['state'] == 'queued'],
+            'limits': {
+                'io_workers': self.io_workers,
+                'inference_slots': self.inference_slots,
+                'max_queue': self.max_queue,
+            },
+            'avg_inference_seconds': round(self._avg_inference, 2),
+            'avg_io_seconds': round(self._avg_io, 2),
+            'completed': self.completed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+        }
@@ -0,0 +1,511 @@
+# -*- coding: utf-8 -*-
+"""
+Stockage disque partagé par le backend MuseTalk.
+
+- AvatarStore : registre d'avatars adressé par contenu (avatar_id = sha256),
+  les uploads identiques sont dédupliqués.
+- TtsCache : cache LRU des sorties TTS (mp3 + wav 16 kHz).
+- JobWorkspace : dossiers de travail isolés par job (chemins déterministes).
+- JobManifest : index des jobs (JSONL en ajout seul) → entrées, sorties, timings.
+- StorageJanitor : nettoyage en tâche de fond (budgets octets / âge, LRU).
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+_AVATAR_ID_RE = re.compile(r'^[0-9a-f]{64}$')
+_EXT_RE = re.compile(r'^[a-z0-9]{1,5}$')
+_JOB_ID_RE = re.compile(r'^[0-9a-f]{8,32}$')
+
+
+class AvatarStore:
+    """
+    Registre d'avatars : <root>/<sha256>.<ext>.
+    Le client envoie l'avatar une fois, récupère un avatar_id, puis ne transmet
+    plus que cet identifiant à chaque tour.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def _normalize_ext(ext):
+        ext = (ext or 'mp4').lower().lstrip('.')
+        return ext if _EXT_RE.match(ext) else 'mp4'
+
+    def path(self, avatar_id):
+        """Chemin local de l'avatar, ou None s'il est inconnu (l'usage met à jour l'ordre LRU)."""
+        if not avatar_id or not _AVATAR_ID_RE.match(avatar_id):
+            return None
+        for candidate in self.root.glob(f"{avatar_id}.*"):
+            try:
+                os.utime(candidate)
+            except OSError:
+                pass
+            return candidate
+        return None
+
+    def put_bytes(self, data, ext=None):
+        """Enregistre un avatar en mémoire. Retourne (avatar_id, path, created)."""
+        avatar_id = hashlib.sha256(data).hexdigest()
+        existing = self.path(avatar_id)
+        if existing:
+            return avatar_id, existing, False
+
+        dest = self.root / f"{avatar_id}.{self._normalize_ext(ext)}"
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix='.upload-')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, dest)
+        logger.info("🆕 Avatar enregistré: %s (%d bytes)", avatar_id[:12], len(data))
+        return avatar_id, dest, True
+
+    def put_stream(self, stream, ext=None, chunk_size=1 << 20):
+        """
+        Enregistre un avatar depuis un flux (fichier uploadé, réponse HTTP…),
+        en hachant au fil de l'écriture. Retourne (avatar_id, path, created).
+        """
+        h = hashlib.sha256()
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in iter(lambda: stream.read(chunk_size), b''):
+                    h.update(chunk)
+                    f.write(chunk)
+            avatar_id = h.hexdigest()
+            existing = self.path(avatar_id)
+            if existing:
+                os.unlink(tmp)
+                return avatar_id, existing, False
+            dest = self.root / f"{avatar_id}.{self._normalize_ext(ext)}"
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, dest)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        logger.info("🆕 Avatar enregistré: %s (%d bytes)", avatar_id[:12], dest.stat().st_size)
+        return avatar_id, dest, True
+
+    def put_file(self, path, ext=None, sha256=None):
+        """
+        Déplace un fichier déjà sur disque (upload terminé) dans le registre,
+        sans le relire si son sha256 est connu. Retourne (avatar_id, path, created).
+        """
+        path = Path(path)
+        if sha256 is None:
+            with open(path, 'rb') as f:
+                return self.put_stream(f, ext)
+        existing = self.path(sha256)
+        if existing:
+            path.unlink(missing_ok=True)
+            return sha256, existing, False
+        dest = self.root / f"{sha256}.{self._normalize_ext(ext)}"
+        os.chmod(path, 0o644)
+        shutil.move(str(path), str(dest))
+        logger.info("🆕 Avatar enregistré: %s (%d bytes)", sha256[:12], dest.stat().st_size)
+        return sha256, dest, True
+
+
+class TtsCache:
+    """
+    Cache disque des sorties TTS : <root>/<key>.mp3 (brut fournisseur) et
+    <root>/<key>.wav (déjà rééchantillonné 16 kHz mono).
+    Clé = sha256(provider, voice_id, model, voice_settings, text).
+    Écritures atomiques, éviction LRU sur un budget en octets.
+    """
+
+    def __init__(self, root, budget_bytes):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.budget_bytes = budget_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(provider, voice_id, model, voice_settings, text):
+        raw = json.dumps([provider, voice_id, model, voice_settings or {}, text],
+                         sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Retourne (mp3_path, wav_path) si les deux fichiers sont en cache."""
+        mp3, wav = self.root / f"{key}.mp3", self.root / f"{key}.wav"
+        with self._lock:
+            if mp3.exists() and wav.exists():
+                self.hits += 1
+                for p in (mp3, wav):
+                    try:
+                        os.utime(p)  # mtime = ordre LRU
+                    except OSError:
+                        pass
+                return mp3, wav
+            self.misses += 1
+            return None
+
+    def put(self, key, mp3_src, wav_src):
+        for src, ext in ((mp3_src, 'mp3'), (wav_src, 'wav')):
+            _atomic_link_or_copy(Path(src), self.root / f"{key}.{ext}")
+        self.evict()
+
+    def evict(self):
+        with self._lock:
+            files = []
+            total = 0
+            for p in self.root.iterdir():
+                if p.name.startswith('.'):
+                    continue
+                st = p.stat()
+                files.append((st.st_mtime, st.st_size, p))
+                total += st.st_size
+            for _, size, p in sorted(files):
+                if total <= self.budget_bytes:
+                    break
+                try:
+                    p.unlink()
+                except FileNotFoundError:
+                    pass
+                total -= size
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else None,
+            }
+
+
+class JobWorkspace:
+    """
+    Dossiers d'un job :
+      <root>/<job_id>/         audio utilisateur, TTS, vidéo finale
+      <results_root>/<job_id>/ sorties MuseTalk (<results_root> servi par /results)
+    Les noms de fichiers sont fixés par le job (pas d'horodatage, pas de
+    fichier « latest » partagé) : plusieurs inférences peuvent tourner en
+    parallèle sans s'écraser, et le chemin du résultat est connu d'avance.
+    """
+
+    def __init__(self, job_id, root, results_root):
+        if not _JOB_ID_RE.match(job_id):
+            raise ValueError(f"job_id invalide: {job_id!r}")
+        self.job_id = job_id
+        self.dir = Path(root) / job_id
+        self.result_dir = Path(results_root) / job_id
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.result_dir.mkdir(parents=True, exist_ok=True)
+
+    def path(self, name):
+        return self.dir / name
+
+
+class JobManifest:
+    """
+    Index des jobs : une ligne JSON par mise à jour dans <path> (ajout seul),
+    rejoué au démarrage dans un dict job_id → enregistrement. Les lookups
+    (résultat d'un job, fichier à servir) sont en O(1), sans parcourir le disque.
+
+    Les champs dict (`inputs`, `outputs`, `timings`) sont fusionnés d'une mise à
+    jour à l'autre ; `outputs` associe nom de fichier → chemin absolu.
+    """
+
+    MERGED_FIELDS = ('inputs', 'outputs', 'timings')
+
+    def __init__(self, path, compact_ratio=4):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.compact_ratio = compact_ratio
+        self._records = {}
+        self._lines = 0
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                self._lines += 1
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    logger.warning("Ligne de manifeste illisible ignorée (%s)", self.path)
+                    continue
+                self._apply(entry)
+        self._maybe_compact()
+        logger.info("📒 Manifeste des jobs: %d jobs (%s)", len(self._records), self.path)
+
+    def _apply(self, entry):
+        job_id = entry.get('job_id')
+        if not job_id:
+            return
+        if entry.get('deleted'):
+            self._records.pop(job_id, None)
+            return
+        record = self._records.setdefault(job_id, {'job_id': job_id})
+        for key, value in entry.items():
+            if key in self.MERGED_FIELDS and isinstance(value, dict):
+                record.setdefault(key, {}).update(value)
+            else:
+                record[key] = value
+
+    def _append(self, entry):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False, default=str) + '\n')
+        self._lines += 1
+
+    def _maybe_compact(self):
+        """Réécrit le fichier (un enregistrement par job) quand il a trop grossi."""
+        if self._lines <= self.compact_ratio * max(len(self._records), 64):
+            return
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent, prefix='.manifest-')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            for record in self._records.values():
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+        os.replace(tmp, self.path)
+        self._lines = len(self._records)
+
+    def update(self, job_id, **fields):
+        entry = dict(fields, job_id=job_id, updated_at=time.time())
+        with self._lock:
+            self._apply(entry)
+            self._append(entry)
+            self._maybe_compact()
+
+    def add_output(self, job_id, name, path):
+        self.update(job_id, outputs={name: str(Path(path).resolve())})
+
+    def get(self, job_id):
+        with self._lock:
+            record = self._records.get(job_id)
+            return json.loads(json.dumps(record, default=str)) if record else None
+
+    def output(self, job_id, name):
+        """Chemin d'un fichier produit par le job, ou None s'il est inconnu."""
+        with self._lock:
+            record = self._records.get(job_id)
+            path = record and record.get('outputs', {}).get(name)
+        return Path(path) if path else None
+
+    def forget(self, job_ids):
+        with self._lock:
+            for job_id in job_ids:
+                if job_id in self._records:
+                    self._apply({'job_id': job_id, 'deleted': True})
+                    self._append({'job_id': job_id, 'deleted': True})
+            self._maybe_compact()
+
+    def __len__(self):
+        return len(self._records)
+
+
+class StorageJanitor:
+    """
+    Nettoyage disque en tâche de fond. Chaque politique (dossier + motifs) a un
+    budget en octets et/ou un âge maximum : les entrées trop vieilles sont
+    supprimées, puis les moins récemment modifiées (mtime) jusqu'à repasser
+    sous le budget. Les chemins « épinglés » par un job en cours ne sont jamais
+    supprimés (ni les dossiers qui les contiennent).
+    """
+
+    def __init__(self, interval=60, on_evict=None):
+        self.interval = interval
+        self.on_evict = on_evict      # on_evict(nom_politique, path)
+        self._policies = []
+        self._pins = {}               # propriétaire → {paths}
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_run = None
+        self.last_duration = None
+
+    def add(self, name, root, patterns=('*',), max_bytes=None, max_age=None, dirs=False):
+        """
+        Ajoute une politique. `dirs=True` : chaque sous-dossier est une unité
+        (dossier de job), sinon seuls les fichiers du premier niveau sont gérés.
+        """
+        if isinstance(patterns, str):
+            patterns = (patterns,)
+        self._policies.append({
+            'name': name, 'root': Path(root), 'patterns': tuple(patterns),
+            'max_bytes': max_bytes, 'max_age': max_age, 'dirs': dirs,
+        })
+        self._stats[name] = {'bytes': 0, 'entries': 0, 'evicted': 0, 'freed_bytes': 0}
+
+    # ----------  fichiers en cours d'utilisation  ----------
+    def pin(self, owner, *paths):
+        with self._lock:
+            self._pins.setdefault(owner, set()).update(Path(p).resolve() for p in paths if p)
+
+    def unpin(self, owner):
+        with self._lock:
+            self._pins.pop(owner, None)
+
+    def _pinned(self, path):
+        path = path.resolve()
+        with self._lock:
+            pins = [p for owned in self._pins.values() for p in owned]
+        return any(p == path or path in p.parents or p in path.parents for p in pins)
+
+    # ----------  balayage  ----------
+    def _entries(self, policy):
+        root = policy['root']
+        if not root.is_dir():
+            return []
+        entries = []
+        seen = set()
+        for pattern in policy['patterns']:
+            for path in root.glob(pattern):
+                if path in seen or path.name.startswith('.') or path.is_dir() != policy['dirs']:
+                    continue
+                seen.add(path)
+                try:
+                    st = path.stat()
+                    size, mtime = st.st_size, st.st_mtime
+                    if policy['dirs']:
+                        # Dossier : taille totale, dernière activité = fichier le plus récent
+                        size = 0
+                        for f in path.rglob('*'):
+                            if f.is_file():
+                                fst = f.stat()
+                                size += fst.st_size
+                                mtime = max(mtime, fst.st_mtime)
+                except FileNotFoundError:
+                    continue
+                entries.append((mtime, size, path))
+        entries.sort()
+        return entries
+
+    def _delete(self, policy, path):
+        try:
+            if path.is_dir():
+                shutil.rmtree(path)
+            else:
+                path.unlink()
+        except FileNotFoundError:
+            return True
+        except OSError as e:
+            logger.warning("🧹 Suppression impossible %s : %s", path, e)
+            return False
+        if self.on_evict:
+            try:
+                self.on_evict(policy['name'], path)
+            except Exception:
+                logger.exception("on_evict a échoué")
+        return True
+
+    def sweep(self, policy):
+        entries = self._entries(policy)
+        total = sum(size for _, size, _ in entries)
+        now = time.time()
+        evicted = Counter()
+        for mtime, size, path in entries:
+            expired = policy['max_age'] is not None and now - mtime > policy['max_age']
+            over = policy['max_bytes'] is not None and total > policy['max_bytes']
+            if not (expired or over):
+                if policy['max_age'] is None:
+                    break  # LRU pur : tout le reste est plus récent et sous budget
+                continue
+            if self._pinned(path) or not self._delete(policy, path):
+                continue
+            total -= size
+            evicted['entries'] += 1
+            evicted['bytes'] += size
+        stats = self._stats[policy['name']]
+        stats.update(bytes=total, entries=len(entries) - evicted['entries'])
+        stats['evicted'] += evicted['entries']
+        stats['freed_bytes'] += evicted['bytes']
+        if evicted['entries']:
+            logger.info("🧹 %s : %d entrées supprimées (%d octets)",
+                        policy['name'], evicted['entries'], evicted['bytes'])
+
+    def run_once(self):
+        start = time.time()
+        for policy in self._policies:
+            try:
+                self.sweep(policy)
+            except Exception:
+                logger.exception("Nettoyage %s en échec", policy['name'])
+        self.last_run = time.time()
+        self.last_duration = round(self.last_run - start, 3)
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name='storage-janitor', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self.run_once()
+            self._stop.wait(self.interval)
+
+    def stats(self):
+        policies = {}
+        for policy in self._policies:
+            policies[policy['name']] = dict(
+                self._stats[policy['name']],
+                root=str(policy['root']),
+                max_bytes=policy['max_bytes'],
+                max_age=policy['max_age'],
+            )
+        disk = shutil.disk_usage('.')
+        return {
+            'policies': policies,
+            'disk': {'total': disk.total, 'used': disk.used, 'free': disk.free},
+            'last_run': self.last_run,
+            'last_duration': self.last_duration,
+            'pinned': sum(len(p) for p in self._pins.values()),
+        }
+
+
+def storage_budget(name, mb, max_age):
+    """
+    Budget d'une politique du janitor, surchargeable par l'environnement :
+    STORAGE_<NOM>_MB et STORAGE_<NOM>_MAX_AGE (secondes) ; 0 = illimité.
+    """
+    mb = int(os.getenv(f'STORAGE_{name.upper()}_MB', str(mb)))
+    max_age = int(os.getenv(f'STORAGE_{name.upper()}_MAX_AGE', str(max_age)))
+    return {'max_bytes': mb * 1024 * 1024 or None, 'max_age': max_age or None}
+
+
+def _atomic_link_or_copy(src, dest):
+    """Copie src → dest de façon atomique (lien dur si possible, sinon copie)."""
+    tmp = dest.with_name(f".{dest.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        try:
+            os.link(src, tmp)
+        except OSError:
+            shutil.copyfile(src, tmp)
+        os.replace(tmp, dest)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+
+def link_or_copy(src, dest):
+    """Expose un fichier du cache sous un autre nom sans recopier les octets."""
+    _atomic_link_or_copy(Path(src), Path(dest))
+    return Path(dest)
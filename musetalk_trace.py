@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+Traces par job : un trace_id et des spans (début, durée, attributs) pour chaque
+étape et sous-étape d'un tour.
+
+- La trace « courante » est propre au thread (`attach` / `detach`) ; `bind()`
+  la transmet aux threads auxiliaires (préchargement TTS, flux GPT).
+- `span(nom, **attrs)` mesure un bloc ; le dict d'attributs est modifiable
+  dans le bloc (octets reçus, code de sortie…). Sans trace active : no-op.
+- `run_subprocess()` : subprocess.run avec un span (code de sortie, durée).
+- TraceLog : une ligne JSON par job dans un fichier à rotation.
+- En ligne de commande, convertit ce JSONL au format Chrome Trace Event
+  (Perfetto, chrome://tracing, speedscope) :
+      python musetalk_trace.py outputs/traces.jsonl -o trace.json
+"""
+
+import argparse
+import functools
+import itertools
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+_state = threading.local()
+
+
+class Trace:
+    """Spans d'un job ; les spans terminés sont ajoutés depuis n'importe quel thread."""
+
+    def __init__(self, trace_id=None, **attrs):
+        self.trace_id = trace_id or uuid.uuid4().hex[:16]
+        self.attrs = attrs
+        self.start = time.time()
+        self.end = None
+        self.status = None
+        self.spans = []
+        self._ids = itertools.count(1)
+        self._sent = 0
+        self._lock = threading.Lock()
+
+    def elapsed_ms(self):
+        return round(((self.end or time.time()) - self.start) * 1000, 1)
+
+    def add_span(self, name, start, duration, parent_id=None, error=None, **attrs):
+        """Span mesuré ailleurs (autre process, callback) : start en epoch, duration en s."""
+        span = {
+            'name': name,
+            'span_id': next(self._ids),
+            'parent_id': parent_id,
+            'start_ms': round((start - self.start) * 1000, 1),
+            'duration_ms': round(duration * 1000, 1),
+            'thread': threading.current_thread().name,
+            'attrs': attrs,
+        }
+        if error:
+            span['error'] = error
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    @contextmanager
+    def span(self, name, **attrs):
+        stack = _stack()
+        span_id = next(self._ids)
+        parent_id = stack[-1] if stack else None
+        start, t0 = time.time(), time.perf_counter()
+        error = None
+        stack.append(span_id)
+        try:
+            yield attrs
+        except BaseException as e:
+            error = f"{type(e).__name__}: {e}"[:300]
+            raise
+        finally:
+            stack.pop()
+            span = {
+                'name': name,
+                'span_id': span_id,
+                'parent_id': parent_id,
+                'start_ms': round((start - self.start) * 1000, 1),
+                'duration_ms': round((time.perf_counter() - t0) * 1000, 1),
+                'thread': threading.current_thread().name,
+                'attrs': attrs,
+            }
+            if error:
+                span['error'] = error
+            with self._lock:
+                self.spans.append(span)
+
+    def current_span_id(self):
+        stack = _stack()
+        return stack[-1] if stack else None
+
+    def take_new(self):
+        """Spans terminés depuis le dernier appel (envoyés avec chaque `status`)."""
+        with self._lock:
+            new, self._sent = self.spans[self._sent:], len(self.spans)
+        return new
+
+    def finish(self, status):
+        self.end = time.time()
+        self.status = status
+
+    def as_dict(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s['start_ms'])
+        return dict(
+            self.attrs,
+            trace_id=self.trace_id,
+            start=self.start,
+            duration_ms=self.elapsed_ms(),
+            status=self.status,
+            spans=spans,
+        )
+
+
+class _NullTrace:
+    """Trace inactive : les spans ne coûtent rien et ne sont pas gardés."""
+    trace_id = None
+
+    @contextmanager
+    def span(self, name, **attrs):
+        yield attrs
+
+    def add_span(self, name, start, duration, parent_id=None, error=None, **attrs):
+        return None
+
+    def current_span_id(self):
+        return None
+
+    def take_new(self):
+        return []
+
+
+NULL_TRACE = _NullTrace()
+
+
+def _stack():
+    stack = getattr(_state, 'stack', None)
+    if stack is None:
+        stack = _state.stack = []
+    return stack
+
+
+def current_trace():
+    return getattr(_state, 'trace', None) or NULL_TRACE
+
+
+def attach(trace, parent_id=None):
+    """Rend `trace` courante dans ce thread ; retourne le jeton pour `detach`."""
+    token = (getattr(_state, 'trace', None), getattr(_state, 'stack', None))
+    _state.trace = trace
+    _state.stack = [parent_id] if parent_id else []
+    return token
+
+
+def detach(token):
+    _state.trace, _state.stack = token
+
+
+def bind(fn):
+    """`fn` exécutée dans un autre thread avec la trace (et le span parent) courants."""
+    trace = getattr(_state, 'trace', None)
+    if trace is None:
+        return fn
+    parent_id = trace.current_span_id()
+
+    @functools.wraps(fn)
+    def bound(*args, **kwargs):
+        token = attach(trace, parent_id)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            detach(token)
+    return bound
+
+
+def span(name, **attrs):
+    return current_trace().span(name, **attrs)
+
+
+def run_subprocess(name, cmd, **kwargs):
+    """subprocess.run dans un span : exécutable, code de sortie, durée."""
+    with span(name, argv0=os.path.basename(str(cmd[0]))) as attrs:
+        try:
+            completed = subprocess.run(cmd, **kwargs)
+        except subprocess.CalledProcessError as e:
+            attrs['exit_code'] = e.returncode
+            raise
+        except subprocess.TimeoutExpired:
+            attrs['exit_code'] = None
+            attrs['timed_out'] = True
+            raise
+        attrs['exit_code'] = completed.returncode
+        return completed
+
+
+class TraceLog:
+    """Une ligne JSON par trace, fichier à rotation (`max_bytes`, `backups` anciens fichiers)."""
+
+    def __init__(self, path, max_bytes=50 * 1024 * 1024, backups=5):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8')
+        self._handler.setFormatter(logging.Formatter('%(message)s'))
+        self.written = 0
+
+    def write(self, trace):
+        record = logging.LogRecord('musetalk.trace', logging.INFO, __file__, 0,
+                                   json.dumps(trace.as_dict(), ensure_ascii=False, default=str), None, None)
+        self._handler.handle(record)
+        self.written += 1
+
+    def close(self):
+        self._handler.close()
+
+
+# ----------  export flamegraph  ----------
+def to_chrome_trace(records):
+    """Traces (dicts du JSONL) → Chrome Trace Event : un process par job, un thread par thread Python."""
+    events = []
+    for pid, record in enumerate(records, 1):
+        label = record.get('job_id') or record.get('trace_id')
+        events.append({'ph': 'M', 'name': 'process_name', 'pid': pid, 'args': {'name': f"job {label}"}})
+        threads = {}
+        base_us = record['start'] * 1e6
+        for s in record.get('spans', []):
+            tid = threads.setdefault(s.get('thread') or 'main', len(threads) + 1)
+            events.append({
+                'ph': 'X',
+                'name': s['name'],
+                'pid': pid,
+                'tid': tid,
+                'ts': base_us + s['start_ms'] * 1000,
+                'dur': s['duration_ms'] * 1000,
+                'args': dict(s.get('attrs') or {}, **({'error': s['error']} if s.get('error') else {})),
+            })
+        for name, tid in threads.items():
+            events.append({'ph': 'M', 'name': 'thread_name', 'pid': pid, 'tid': tid, 'args': {'name': name}})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def read_traces(path, trace_id=None, job_id=None):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if trace_id and record.get('trace_id') != trace_id:
+                continue
+            if job_id and record.get('job_id') != job_id:
+                continue
+            yield record
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Traces JSONL → Chrome Trace Event (Perfetto, speedscope)")
+    parser.add_argument('path', help="fichier JSONL (TRACE_LOG)")
+    parser.add_argument('-o', '--output', help="fichier de sortie (stdout par défaut)")
+    parser.add_argument('--trace-id')
+    parser.add_argument('--job-id')
+    parser.add_argument('--last', type=int, default=0, help="ne garder que les N dernières traces")
+    args = parser.parse_args(argv)
+
+    records = list(read_traces(args.path, args.trace_id, args.job_id))
+    if args.last:
+        records = records[-args.last:]
+    data = json.dumps(to_chrome_trace(records))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(data)
+    else:
+        sys.stdout.write(data)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+"""
+Upload binaire par morceaux sur Socket.IO, partagé par les deux backends.
+
+Remplace les `data:` URL base64 envoyées en un seul message (33 % de trafic en
+plus, plusieurs copies complètes en mémoire, `max_http_buffer_size=10**8`) :
+
+1. `upload_begin`  {kind, size, filename?, mimetype?, sha256?, upload_id?}
+                   → ack {ok, upload_id, received, chunk_size}
+   (un `upload_id` connu reprend l'upload là où il s'était arrêté)
+2. `upload_chunk`  {upload_id, offset, data: <binaire>} → ack {ok, received}
+   écrit directement sur disque ; un morceau déjà reçu est acquitté sans
+   réécriture, un trou renvoie `offset_mismatch` + l'offset attendu.
+3. `upload_finish` {upload_id} → ack {ok, upload_id, size, sha256, …}
+   (champs ajoutés par le hook `on_finish` du backend, ex. `avatar_id`)
+4. `chat_with_avatar` / `upload_audio_b64` référencent ensuite l'upload par id.
+
+`upload_status` {upload_id} donne l'avancement (reprise après reconnexion),
+`upload_abort` {upload_id} abandonne. L'état est aussi écrit à côté du fichier
+partiel (<id>.json) : un upload survit à un redémarrage du backend.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 256 * 1024
+MAX_CHUNK_SIZE = 1 << 20
+# Taille max d'un message Socket.IO : un morceau + l'enveloppe JSON
+SOCKETIO_BUFFER_SIZE = MAX_CHUNK_SIZE + 64 * 1024
+
+_UPLOAD_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+_EXT_RE = re.compile(r'^[a-z0-9]{1,5}$')
+_DEFAULT_EXT = {'audio': 'webm', 'avatar': 'mp4'}
+
+
+class UploadError(ValueError):
+    """Upload refusé ou introuvable ; `code` est renvoyé tel quel au client."""
+
+    def __init__(self, code, message, received=None):
+        super().__init__(message)
+        self.code = code
+        self.received = received
+
+
+class Upload:
+    __slots__ = ('id', 'kind', 'size', 'ext', 'filename', 'mimetype', 'expected_sha256',
+                 'received', 'digest', 'complete', 'created_at', 'updated_at',
+                 'part_path', 'path', 'lock', '_file', '_hasher')
+
+    def __init__(self, upload_id, kind, size, ext, root, filename=None, mimetype=None, sha256=None):
+        self.id = upload_id
+        self.kind = kind
+        self.size = size
+        self.ext = ext
+        self.filename = filename
+        self.mimetype = mimetype
+        self.expected_sha256 = sha256
+        self.received = 0
+        self.digest = None
+        self.complete = False
+        self.created_at = self.updated_at = time.time()
+        self.part_path = Path(root) / f"{upload_id}.part"
+        self.path = Path(root) / f"{upload_id}.{ext}"
+        self.lock = threading.Lock()
+        self._file = None
+        self._hasher = hashlib.sha256()
+
+    def meta(self):
+        return {
+            'upload_id': self.id,
+            'kind': self.kind,
+            'size': self.size,
+            'ext': self.ext,
+            'filename': self.filename,
+            'mimetype': self.mimetype,
+            'sha256': self.expected_sha256,
+            'created_at': self.created_at,
+        }
+
+    def as_dict(self):
+        return {
+            'upload_id': self.id,
+            'kind': self.kind,
+            'size': self.size,
+            'received': self.received,
+            'complete': self.complete,
+            'sha256': self.digest,
+        }
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class UploadStore:
+    """
+    Uploads en cours / terminés sous `root` :
+    <id>.part (en cours), <id>.json (métadonnées), <id>.<ext> (terminé).
+    Un upload terminé est consommé une seule fois (`consume`) par le job qui
+    le référence ; les fichiers oubliés sont purgés par le janitor du dossier.
+    """
+
+    def __init__(self, root, max_sizes, chunk_size=DEFAULT_CHUNK_SIZE, ttl=3600):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_sizes = dict(max_sizes)
+        self.chunk_size = min(chunk_size, MAX_CHUNK_SIZE)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._uploads = {}
+        self.completed = 0
+        self.bytes_received = 0
+
+    # ----------  cycle de vie  ----------
+    def begin(self, kind, size, filename=None, mimetype=None, sha256=None, upload_id=None):
+        """Crée un upload, ou reprend `upload_id` s'il existe encore."""
+        self.expire()
+        if upload_id:
+            upload = self._lookup(upload_id)
+            if upload.kind != kind or upload.size != size:
+                raise UploadError('upload_mismatch', "Upload existant de type ou de taille différents")
+            return upload
+
+        if kind not in self.max_sizes:
+            raise UploadError('invalid_kind', f"Type d'upload inconnu: {kind}")
+        if not isinstance(size, int) or size <= 0:
+            raise UploadError('invalid_size', "Taille d'upload invalide")
+        if size > self.max_sizes[kind]:
+            raise UploadError('too_large', f"{size} octets (max {self.max_sizes[kind]})")
+        if sha256 is not None and not re.match(r'^[0-9a-f]{64}$', str(sha256)):
+            raise UploadError('invalid_sha256', "sha256 attendu en hexadécimal")
+
+        ext = (filename or '').rsplit('.', 1)[-1].lower() if filename and '.' in filename else ''
+        ext = ext if _EXT_RE.match(ext) else _DEFAULT_EXT.get(kind, 'bin')
+        upload = Upload(uuid.uuid4().hex, kind, size, ext, self.root,
+                        filename=filename, mimetype=mimetype, sha256=sha256)
+        upload.part_path.touch()
+        self._meta_path(upload.id).write_text(json.dumps(upload.meta()))
+        with self._lock:
+            self._uploads[upload.id] = upload
+        logger.info("📥 Upload %s ouvert (%s, %d octets)", upload.id[:8], kind, size)
+        return upload
+
+    def write(self, upload_id, offset, data):
+        """Écrit un morceau à `offset` ; retourne le nombre d'octets reçus."""
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            raise UploadError('invalid_chunk', "Morceau attendu en binaire (pas de base64)")
+        if len(data) > MAX_CHUNK_SIZE:
+            raise UploadError('chunk_too_large', f"Morceau > {MAX_CHUNK_SIZE} octets")
+        upload = self._lookup(upload_id)
+        with upload.lock:
+            if upload.complete:
+                return upload.received
+            if offset != upload.received:
+                if isinstance(offset, int) and 0 <= offset and offset + len(data) <= upload.received:
+                    return upload.received  # renvoi d'un morceau déjà écrit : idempotent
+                raise UploadError('offset_mismatch', f"offset {offset}, attendu {upload.received}",
+                                  received=upload.received)
+            if upload.received + len(data) > upload.size:
+                raise UploadError('too_large', "Données au-delà de la taille annoncée",
+                                  received=upload.received)
+            if upload._file is None:
+                upload._file = open(upload.part_path, 'r+b')
+                upload._file.seek(upload.received)
+            upload._file.write(data)
+            upload._hasher.update(data)
+            upload.received += len(data)
+            upload.updated_at = time.time()
+        with self._lock:
+            self.bytes_received += len(data)
+        return upload.received
+
+    def finish(self, upload_id):
+        """Vérifie taille (et sha256 annoncé) puis publie le fichier complet."""
+        upload = self._lookup(upload_id)
+        with upload.lock:
+            if upload.complete:
+                return upload
+            if upload.received != upload.size:
+                raise UploadError('upload_incomplete', f"{upload.received}/{upload.size} octets reçus",
+                                  received=upload.received)
+            upload.close()
+            digest = upload._hasher.hexdigest()
+            if upload.expected_sha256 and digest != upload.expected_sha256:
+                self._discard(upload)
+                raise UploadError('checksum_mismatch', "sha256 différent de celui annoncé")
+            os.replace(upload.part_path, upload.path)
+            upload.digest = digest
+            upload.complete = True
+            upload.updated_at = time.time()
+        with self._lock:
+            self.completed += 1
+        logger.info("✅ Upload %s terminé (%s, %d octets)", upload.id[:8], upload.kind, upload.size)
+        return upload
+
+    def status(self, upload_id):
+        """Upload en cours ou terminé (avancement pour la reprise)."""
+        return self._lookup(upload_id)
+
+    def get(self, upload_id, kind=None):
+        """Upload terminé (lève UploadError sinon)."""
+        upload = self._lookup(upload_id)
+        if kind and upload.kind != kind:
+            raise UploadError('upload_mismatch', f"Upload {upload_id} n'est pas de type {kind}")
+        if not upload.complete:
+            raise UploadError('upload_incomplete', f"{upload.received}/{upload.size} octets reçus",
+                              received=upload.received)
+        return upload
+
+    def consume(self, upload_id, kind=None):
+        """
+        Retire un upload terminé de l'index et le rend : l'appelant devient
+        propriétaire de `upload.path` (à déplacer / lire / supprimer).
+        """
+        upload = self.get(upload_id, kind)
+        with self._lock:
+            self._uploads.pop(upload.id, None)
+        self._meta_path(upload.id).unlink(missing_ok=True)
+        return upload
+
+    def abort(self, upload_id):
+        try:
+            upload = self._lookup(upload_id)
+        except UploadError:
+            return False
+        with upload.lock:
+            self._discard(upload)
+        return True
+
+    def expire(self):
+        """Abandonne les uploads inactifs depuis plus de `ttl` secondes."""
+        limit = time.time() - self.ttl
+        with self._lock:
+            stale = [u for u in self._uploads.values() if u.updated_at < limit]
+        for upload in stale:
+            with upload.lock:
+                self._discard(upload)
+        if stale:
+            logger.info("🧹 %d upload(s) expiré(s)", len(stale))
+
+    # ----------  interne  ----------
+    def _meta_path(self, upload_id):
+        return self.root / f"{upload_id}.json"
+
+    def _discard(self, upload):
+        upload.close()
+        with self._lock:
+            self._uploads.pop(upload.id, None)
+        for path in (upload.part_path, upload.path, self._meta_path(upload.id)):
+            path.unlink(missing_ok=True)
+
+    def _lookup(self, upload_id):
+        if not isinstance(upload_id, str) or not _UPLOAD_ID_RE.match(upload_id):
+            raise UploadError('upload_not_found', "upload_id invalide")
+        with self._lock:
+            upload = self._uploads.get(upload_id)
+        if upload is None:
+            upload = self._reload(upload_id)
+        return upload
+
+    def _reload(self, upload_id):
+        """Reprise après redémarrage : métadonnées + fichier partiel (ou complet) sur disque."""
+        try:
+            meta = json.loads(self._meta_path(upload_id).read_text())
+        except (OSError, ValueError):
+            raise UploadError('upload_not_found', f"Upload inconnu: {upload_id}") from None
+        upload = Upload(upload_id, meta['kind'], meta['size'], meta['ext'], self.root,
+                        filename=meta.get('filename'), mimetype=meta.get('mimetype'),
+                        sha256=meta.get('sha256'))
+        upload.created_at = meta.get('created_at', upload.created_at)
+        source = upload.path if upload.path.exists() else upload.part_path
+        if not source.exists():
+            raise UploadError('upload_not_found', f"Upload inconnu: {upload_id}")
+        # Le hash incrémental repart du préfixe déjà écrit
+        with open(source, 'rb') as f:
+            for block in iter(lambda: f.read(MAX_CHUNK_SIZE), b''):
+                upload._hasher.update(block)
+                upload.received += len(block)
+        if source == upload.path:
+            upload.complete = True
+            upload.digest = upload._hasher.hexdigest()
+        elif upload.received > upload.size:
+            raise UploadError('upload_not_found', f"Upload corrompu: {upload_id}")
+        with self._lock:
+            upload = self._uploads.setdefault(upload_id, upload)
+        logger.info("♻️ Upload %s repris (%d/%d octets)", upload_id[:8], upload.received, upload.size)
+        return upload
+
+    def stats(self):
+        with self._lock:
+            uploads = list(self._uploads.values())
+            return {
+                'in_progress': sum(1 for u in uploads if not u.complete),
+                'ready': sum(1 for u in uploads if u.complete),
+                'completed': self.completed,
+                'bytes_received': self.bytes_received,
+                'chunk_size': self.chunk_size,
+                'max_sizes': self.max_sizes,
+            }
+
+
+def _ack_error(e):
+    ack = {'ok': False, 'error': str(e), 'code': e.code}
+    if e.received is not None:
+        ack['received'] = e.received
+    return ack
+
+
+def register_upload_events(socketio, store, on_finish=None):
+    """
+    Déclare les événements upload_* sur `socketio`. Chaque handler répond par
+    l'acquittement Socket.IO (callback côté client), pas par un emit.
+    `on_finish(upload)` est appelé sur chaque upload terminé ; le dict qu'il
+    retourne est ajouté à l'acquittement de `upload_finish`.
+    """
+
+    @socketio.on('upload_begin')
+    def handle_upload_begin(data):
+        data = data or {}
+        try:
+            upload = store.begin(
+                data.get('kind'),
+                data.get('size'),
+                filename=data.get('filename'),
+                mimetype=data.get('mimetype'),
+                sha256=data.get('sha256'),
+                upload_id=data.get('upload_id'),
+            )
+        except UploadError as e:
+            return _ack_error(e)
+        return {'ok': True, 'chunk_size': store.chunk_size, **upload.as_dict()}
+
+    @socketio.on('upload_chunk')
+    def handle_upload_chunk(data):
+        data = data or {}
+        try:
+            received = store.write(data.get('upload_id'), data.get('offset'), data.get('data'))
+        except UploadError as e:
+            return _ack_error(e)
+        return {'ok': True, 'upload_id': data.get('upload_id'), 'received': received}
+
+    @socketio.on('upload_status')
+    def handle_upload_status(data):
+        try:
+            upload = store.status((data or {}).get('upload_id'))
+        except UploadError as e:
+            return _ack_error(e)
+        return {'ok': True, **upload.as_dict()}
+
+    @socketio.on('upload_finish')
+    def handle_upload_finish(data):
+        try:
+            upload = store.finish((data or {}).get('upload_id'))
+            extra = on_finish(upload) if on_finish else None
+        except UploadError as e:
+            return _ack_error(e)
+        return {'ok': True, **upload.as_dict(), **(extra or {})}
+
+    @socketio.on('upload_abort')
+    def handle_upload_abort(data):
+        return {'ok': store.abort((data or {}).get('upload_id'))}
@@ -0,0 +1,714 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Worker MuseTalk persistant.
+
+Lancé une seule fois par le backend (cwd = MUSETALK_DIR), il charge UNet, VAE,
+Whisper et FaceParsing au démarrage puis traite les jobs reçus sur une socket
+Unix locale (multiprocessing.connection). On évite ainsi de relancer
+`python3 -m scripts.inference` (import torch + chargement des poids) à chaque tour.
+
+Côté backend on n'utilise que la classe `MuseTalkWorker`, qui n'importe pas torch.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import pickle
+import secrets
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing.connection import Client, Listener
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerUnavailable(RuntimeError):
+    """Le worker n'a pas pu être joint (démarrage raté, crash, socket fermée)."""
+
+
+# ==================== CÔTÉ BACKEND ====================
+class MuseTalkWorker:
+    """
+    Pilote un process worker MuseTalk : démarrage, attente du signal « ready »,
+    envoi des jobs, et redémarrage automatique si le process meurt.
+    Un seul job à la fois (un seul slot GPU).
+    Après `max_startup_failures` démarrages ratés d'affilée, le watchdog
+    abandonne : les jobs basculent aussitôt sur le mode subprocess.
+    """
+
+    def __init__(self, musetalk_dir, socket_path, model_args=None,
+                 python='python3', startup_timeout=300, watchdog_interval=5,
+                 restart_backoff=30, max_startup_failures=3):
+        self.musetalk_dir = Path(musetalk_dir)
+        self.socket_path = str(socket_path)
+        self.model_args = model_args or {}
+        self.python = python
+        self.startup_timeout = startup_timeout
+        self.watchdog_interval = watchdog_interval
+        self.restart_backoff = restart_backoff
+        self.max_startup_failures = max_startup_failures
+
+        self._authkey = secrets.token_bytes(32)
+        self._proc = None
+        self._conn = None
+        self._lock = threading.Lock()          # sérialise les jobs
+        self._state_lock = threading.Lock()    # protège proc / conn
+        self._ready = threading.Event()
+        self._started = False
+        self._spawning = False                 # démarrage en cours (process lancé, pas encore prêt)
+        self._startup_failures = 0             # démarrages ratés d'affilée
+        self._stopping = False
+        self._restarts = 0
+        self._last_spawn = 0.0
+        self._jobs_done = 0
+        self._last_error = None
+        self._watchdog = None
+
+    # ----------  cycle de vie  ----------
+    def start(self):
+        """Démarre le worker et le watchdog (non bloquant)."""
+        self._stopping = False
+        self._started = True
+        self._startup_failures = 0
+        self._spawn_async()
+        if self._watchdog is None:
+            self._watchdog = threading.Thread(target=self._watchdog_loop, daemon=True)
+            self._watchdog.start()
+
+    def stop(self):
+        self._stopping = True
+        self._teardown()
+
+    def is_alive(self):
+        return self._proc is not None and self._proc.poll() is None
+
+    def wait_ready(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def gave_up(self):
+        return self._startup_failures >= self.max_startup_failures
+
+    def _spawn_async(self):
+        self._spawning = True
+        threading.Thread(target=self._spawn_and_connect, daemon=True).start()
+
+    def _spawn_and_connect(self):
+        try:
+            if self._spawn_locked():
+                self._startup_failures = 0
+            else:
+                self._startup_failures += 1
+                if self.gave_up():
+                    logger.error("Worker MuseTalk : %d démarrages ratés, abandon (mode subprocess)",
+                                 self._startup_failures)
+        finally:
+            self._spawning = False
+
+    def _spawn_locked(self):
+        """Lance le process et attend son signal « ready » ; False si le démarrage a échoué."""
+        with self._state_lock:
+            self._teardown_locked()
+            self._last_spawn = time.time()
+            try:
+                os.unlink(self.socket_path)
+            except FileNotFoundError:
+                pass
+
+            cmd = [self.python, str(Path(__file__).resolve()), '--socket', self.socket_path]
+            for key, value in self.model_args.items():
+                if value is True:
+                    cmd.append(f'--{key}')
+                elif value is not False and value is not None:
+                    cmd += [f'--{key}', str(value)]
+            env = dict(os.environ, MUSETALK_WORKER_AUTHKEY=self._authkey.hex())
+
+            logger.info("⚡️ Démarrage worker MuseTalk: %s", " ".join(cmd))
+            self._proc = subprocess.Popen(cmd, cwd=str(self.musetalk_dir), env=env)
+
+            # La socket n'est créée qu'une fois les modèles chargés → signal « ready »
+            deadline = time.time() + self.startup_timeout
+            while time.time() < deadline:
+                if self._proc.poll() is not None:
+                    self._last_error = f"worker exited with code {self._proc.returncode}"
+                    logger.error("Worker MuseTalk mort au démarrage (code %s)", self._proc.returncode)
+                    self._proc = None
+                    return False
+                if os.path.exists(self.socket_path):
+                    try:
+                        self._conn = Client(self.socket_path, family='AF_UNIX', authkey=self._authkey)
+                        self._conn.send({'op': 'ping'})
+                        if self._conn.poll(30) and self._conn.recv().get('ok'):
+                            self._ready.set()
+                            logger.info("✅ Worker MuseTalk prêt (pid %s)", self._proc.pid)
+                            return True
+                    except (OSError, EOFError) as e:
+                        self._last_error = str(e)
+                time.sleep(0.5)
+
+            self._last_error = "startup timeout"
+            logger.error("Worker MuseTalk: timeout au démarrage (%ss)", self.startup_timeout)
+            self._teardown_locked()
+            return False
+
+    def _teardown(self):
+        with self._state_lock:
+            self._teardown_locked()
+
+    def _teardown_locked(self):
+        self._ready.clear()
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except OSError:
+                pass
+            self._conn = None
+        if self._proc is not None and self._proc.poll() is None:
+            self._proc.terminate()
+            try:
+                self._proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self._proc.kill()
+        self._proc = None
+
+    def _restart(self, reason):
+        if self._stopping:
+            return
+        self._restarts += 1
+        self._last_error = reason
+        logger.warning("🔁 Redémarrage worker MuseTalk (%s)", reason)
+        self._spawn_async()
+
+    def _watchdog_loop(self):
+        while not self._stopping:
+            time.sleep(self.watchdog_interval)
+            if self._spawning or self._state_lock.locked():
+                continue  # démarrage en cours
+            if self.gave_up():
+                continue  # démarrages ratés à répétition : plus de relance
+            if time.time() - self._last_spawn < self.restart_backoff:
+                continue
+            if self._proc is not None and self._proc.poll() is not None:
+                self._restart(f"crash (code {self._proc.returncode})")
+            elif self._proc is None and not self._ready.is_set():
+                self._restart(self._last_error or "not running")
+
+    # ----------  jobs  ----------
+    def health(self):
+        return {
+            'alive': self.is_alive(),
+            'ready': self._ready.is_set(),
+            'pid': self._proc.pid if self._proc else None,
+            'busy': self._lock.locked(),
+            'jobs_done': self._jobs_done,
+            'restarts': self._restarts,
+            'startup_failures': self._startup_failures,
+            'gave_up': self.gave_up(),
+            'last_error': self._last_error,
+        }
+
+    def run_job(self, job, timeout=120, ready_timeout=None):
+        """
+        Envoie un job d'inférence et attend le résultat.
+        Lève WorkerUnavailable si le worker n'est pas joignable (le backend
+        bascule alors sur le mode subprocess), TimeoutError si le job dépasse
+        `timeout`, RuntimeError si l'inférence elle-même a échoué.
+        """
+        if not self._ready.is_set():
+            # On n'attend que si un démarrage est réellement en cours : worker jamais
+            # lancé, mort ou démarrage raté → fallback immédiat, sans garder le slot GPU
+            if not self._started:
+                raise WorkerUnavailable("worker not started")
+            if not self._spawning:
+                raise WorkerUnavailable(self._last_error or "worker not running")
+            if ready_timeout is None:
+                ready_timeout = self.startup_timeout
+            if not self._ready.wait(ready_timeout):
+                raise WorkerUnavailable(self._last_error or "worker not ready")
+
+        with self._lock:
+            conn = self._conn
+            if conn is None or not self.is_alive():
+                raise WorkerUnavailable(self._last_error or "worker not running")
+            try:
+                conn.send(dict(job, op='infer'))
+                if not conn.poll(timeout):
+                    # Job bloqué : on tue le worker, il sera relancé
+                    self._teardown()
+                    self._restart("job timeout")
+                    raise TimeoutError(f"MuseTalk worker timeout after {timeout}s")
+                reply = conn.recv()
+            except (OSError, EOFError) as e:
+                self._teardown()
+                self._restart(f"connection lost: {e}")
+                raise WorkerUnavailable(str(e))
+
+        if not reply.get('ok'):
+            raise RuntimeError(f"MuseTalk worker failed: {reply.get('error')}")
+        self._jobs_done += 1
+        return reply
+
+
+# ==================== CÔTÉ WORKER ====================
+class _Models:
+    """Modèles MuseTalk chargés une fois pour toutes (repris de scripts/inference.py)."""
+
+    def __init__(self, args):
+        import torch
+        from transformers import WhisperModel
+        from musetalk.utils.utils import load_all_model
+        from musetalk.utils.audio_processor import AudioProcessor
+        from musetalk.utils.face_parsing import FaceParsing
+
+        self.args = args
+        self.torch = torch
+        self.device = torch.device(f"cuda:{args.gpu_id}" if torch.cuda.is_available() else "cpu")
+        self.vae, self.unet, self.pe = load_all_model(
+            unet_model_path=args.unet_model_path,
+            vae_type=args.vae_type,
+            unet_config=args.unet_config,
+            device=self.device,
+        )
+        self.timesteps = torch.tensor([0], device=self.device)
+        self.audio_processor = AudioProcessor(feature_extractor_path=args.whisper_dir)
+        self.whisper = WhisperModel.from_pretrained(args.whisper_dir).eval()
+        self.whisper.requires_grad_(False)
+        if args.version == "v15":
+            self.fp = FaceParsing(left_cheek_width=args.left_cheek_width,
+                                  right_cheek_width=args.right_cheek_width)
+        else:
+            self.fp = FaceParsing()
+        self.float16 = None
+        self.set_precision(args.use_float16)
+        self.prepared = PreparedAvatarStore(
+            args.prepared_dir,
+            budget_bytes=args.prepared_budget_mb * 1024 * 1024,
+            version=args.version,
+            extra_margin=args.extra_margin,
+            parsing_mode=args.parsing_mode,
+        )
+
+    def set_precision(self, use_float16):
+        """Bascule fp16/fp32 uniquement si le job le demande différemment."""
+        if use_float16 == self.float16:
+            return
+        dtype = self.torch.float16 if use_float16 else self.torch.float32
+        self.pe = self.pe.to(self.device, dtype=dtype)
+        self.vae.vae = self.vae.vae.to(self.device, dtype=dtype)
+        self.unet.model = self.unet.model.to(self.device, dtype=dtype)
+        self.whisper = self.whisper.to(self.device, dtype=dtype)
+        self.float16 = use_float16
+
+    def prepare_avatar(self, video_path, bbox_shift, fps, work_dir):
+        """
+        Extraction des frames, détection visage, crops, latents VAE et masques de
+        blending. Résultat mis en cache (mémoire + disque) par PreparedAvatarStore.
+        """
+        import glob
+        import shutil
+        import cv2
+        from musetalk.utils.utils import get_file_type, get_video_fps
+        from musetalk.utils.preprocessing import get_landmark_and_bbox, coord_placeholder
+        from musetalk.utils.blending import get_image_prepare_material
+
+        args = self.args
+        file_type = get_file_type(video_path)
+        key = None
+        if file_type in ("video", "image"):
+            key = self.prepared.key(video_path, bbox_shift)
+            cached = self.prepared.get(key)
+            if cached is not None:
+                logger.info("♻️ Avatar préparé en cache (%s)", key[:12])
+                return cached
+
+        # Extraction des frames
+        save_dir_full = None
+        if file_type == "video":
+            save_dir_full = os.path.join(work_dir, f"frames_{os.getpid()}_{time.time_ns()}")
+            os.makedirs(save_dir_full, exist_ok=True)
+            subprocess.run([args.ffmpeg_path, '-v', 'fatal', '-i', video_path,
+                            '-start_number', '0', f"{save_dir_full}/%08d.png"], check=True)
+            input_img_list = sorted(glob.glob(os.path.join(save_dir_full, '*.[jpJP][pnPN]*[gG]')))
+            fps = get_video_fps(video_path)
+        elif file_type == "image":
+            input_img_list = [video_path]
+        elif os.path.isdir(video_path):
+            input_img_list = sorted(glob.glob(os.path.join(video_path, '*.[jpJP][pnPN]*[gG]')),
+                                    key=lambda x: int(os.path.splitext(os.path.basename(x))[0]))
+        else:
+            raise ValueError(f"{video_path} should be a video file, an image file or a directory of images")
+
+        # Détection visage + crops + latents VAE + masques
+        coord_list, frame_list = get_landmark_and_bbox(input_img_list, bbox_shift)
+        if save_dir_full:
+            shutil.rmtree(save_dir_full, ignore_errors=True)
+
+        input_latent_list = []
+        masks = []
+        for bbox, frame in zip(coord_list, frame_list):
+            if bbox == coord_placeholder:
+                masks.append(None)
+                continue
+            x1, y1, x2, y2 = bbox
+            if args.version == "v15":
+                y2 = min(y2 + args.extra_margin, frame.shape[0])
+            crop_frame = cv2.resize(frame[y1:y2, x1:x2], (256, 256), interpolation=cv2.INTER_LANCZOS4)
+            input_latent_list.append(self.vae.get_latents_for_unet(crop_frame))
+            if args.version == "v15":
+                masks.append(get_image_prepare_material(frame, [x1, y1, x2, y2],
+                                                        fp=self.fp, mode=args.parsing_mode))
+            else:
+                masks.append(get_image_prepare_material(frame, [x1, y1, x2, y2], fp=self.fp))
+
+        prepared = {
+            'frames': frame_list,
+            'coords': coord_list,
+            'latents': input_latent_list,
+            'masks': masks,
+            'fps': fps,
+        }
+        if key is not None:
+            self.prepared.put(key, prepared)
+        return prepared
+
+    def infer(self, job):
+        import shutil
+        import cv2
+        import numpy as np
+        from musetalk.utils.utils import datagen
+        from musetalk.utils.blending import get_image_blending
+
+        args = self.args
+        self.set_precision(bool(job.get('use_float16', args.use_float16)))
+        batch_size = int(job.get('batch_size', args.batch_size))
+        fps = int(job.get('fps', args.fps))
+        video_path = job['video_path']
+        audio_path = job['audio_path']
+        result_dir = job.get('result_dir', args.result_dir)
+        bbox_shift = 0 if args.version == "v15" else int(job.get('bbox_shift', 0))
+
+        input_basename = os.path.basename(video_path).split('.')[0]
+        audio_basename = os.path.basename(audio_path).split('.')[0]
+        output_basename = f"{input_basename}_{audio_basename}"
+        temp_dir = os.path.join(result_dir, args.version)
+        os.makedirs(temp_dir, exist_ok=True)
+        result_img_save_path = os.path.join(temp_dir, output_basename)
+        os.makedirs(result_img_save_path, exist_ok=True)
+        output_vid_name = os.path.join(temp_dir, job.get('result_name') or output_basename + ".mp4")
+
+        # Sous-étapes (epoch + durée) renvoyées au backend pour la trace du job
+        steps = []
+
+        def step(name, start, **attrs):
+            steps.append(dict(attrs, name=name, start=start, duration=time.time() - start))
+
+        # Avatar préparé (cache) : frames, bbox, latents, masques
+        t0 = time.time()
+        prepared = self.prepare_avatar(video_path, bbox_shift, fps, temp_dir)
+        fps = prepared['fps']
+        prepare_time = time.time() - t0
+        step('prepare_avatar', t0, frames=len(prepared['frames']))
+
+        frame_list = prepared['frames']
+        coord_list = prepared['coords']
+        mask_list = prepared['masks']
+        input_latent_list = prepared['latents']
+        frame_list_cycle = frame_list + frame_list[::-1]
+        coord_list_cycle = coord_list + coord_list[::-1]
+        mask_list_cycle = mask_list + mask_list[::-1]
+        input_latent_list_cycle = input_latent_list + input_latent_list[::-1]
+
+        # Features audio
+        t0 = time.time()
+        weight_dtype = self.unet.model.dtype
+        whisper_input_features, librosa_length = self.audio_processor.get_audio_feature(audio_path)
+        whisper_chunks = self.audio_processor.get_whisper_chunk(
+            whisper_input_features, self.device, weight_dtype, self.whisper, librosa_length,
+            fps=fps,
+            audio_padding_length_left=args.audio_padding_length_left,
+            audio_padding_length_right=args.audio_padding_length_right,
+        )
+
+        step('audio_features', t0, chunks=len(whisper_chunks))
+
+        # UNet + décodage VAE
+        t0 = time.time()
+        res_frame_list = []
+        gen = datagen(whisper_chunks=whisper_chunks, vae_encode_latents=input_latent_list_cycle,
+                      batch_size=batch_size, delay_frame=0, device=self.device)
+        with self.torch.no_grad():
+            for whisper_batch, latent_batch in gen:
+                audio_feature_batch = self.pe(whisper_batch)
+                latent_batch = latent_batch.to(dtype=weight_dtype)
+                pred_latents = self.unet.model(latent_batch, self.timesteps,
+                                               encoder_hidden_states=audio_feature_batch).sample
+                res_frame_list.extend(self.vae.decode_latents(pred_latents))
+
+        step('unet_vae', t0, frames=len(res_frame_list), batch_size=batch_size)
+
+        # Blending dans les frames d'origine (masques pré-calculés)
+        t0 = time.time()
+        for i, res_frame in enumerate(res_frame_list):
+            bbox = coord_list_cycle[i % len(coord_list_cycle)]
+            material = mask_list_cycle[i % len(mask_list_cycle)]
+            if material is None:
+                continue
+            ori_frame = frame_list_cycle[i % len(frame_list_cycle)].copy()
+            x1, y1, x2, y2 = bbox
+            if args.version == "v15":
+                y2 = min(y2 + args.extra_margin, ori_frame.shape[0])
+            try:
+                res_frame = cv2.resize(res_frame.astype(np.uint8), (x2 - x1, y2 - y1))
+            except Exception:
+                continue
+            mask, crop_box = material
+            combine_frame = get_image_blending(ori_frame, res_frame, [x1, y1, x2, y2], mask, crop_box)
+            cv2.imwrite(f"{result_img_save_path}/{str(i).zfill(8)}.png", combine_frame)
+
+        step('blend', t0)
+
+        # Encodage vidéo + mux audio
+        temp_vid_path = f"{temp_dir}/temp_{input_basename}_{audio_basename}.mp4"
+        t0 = time.time()
+        completed = subprocess.run([args.ffmpeg_path, '-y', '-v', 'warning', '-r', str(fps), '-f', 'image2',
+                                    '-i', f"{result_img_save_path}/%08d.png", '-vcodec', 'libx264',
+                                    '-vf', 'format=yuv420p', '-crf', '18', temp_vid_path], check=True)
+        step('ffmpeg_encode', t0, exit_code=completed.returncode)
+        t0 = time.time()
+        completed = subprocess.run([args.ffmpeg_path, '-y', '-v', 'warning', '-i', audio_path,
+                                    '-i', temp_vid_path, output_vid_name], check=True)
+        step('ffmpeg_mux', t0, exit_code=completed.returncode)
+        os.remove(temp_vid_path)
+        shutil.rmtree(result_img_save_path)
+
+        return {
+            'output_path': output_vid_name,
+            'frames': len(res_frame_list),
+            'fps': fps,
+            'prepare_time': prepare_time,
+            'steps': steps,
+        }
+
+
+class PreparedAvatarStore:
+    """
+    Cache des avatars préparés, clé = (sha256 du fichier avatar, bbox_shift, version).
+    Un petit LRU en mémoire devant un LRU sur disque borné en octets :
+      <root>/<key>/frames/%08d.png, coords.pkl, latents.pt, masks.pkl, meta.json
+    L'usage d'une entrée « touche » meta.json (mtime = ordre LRU).
+    """
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, root, budget_bytes, version, extra_margin, parsing_mode, memory_entries=2):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.budget_bytes = budget_bytes
+        self.version_tag = f"{version}:{extra_margin}:{parsing_mode}:f{self.FORMAT_VERSION}"
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._digests = {}  # (path, size, mtime_ns) → sha256
+        self.hits = 0
+        self.misses = 0
+
+    def _file_digest(self, path):
+        st = os.stat(path)
+        sig = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+        digest = self._digests.get(sig)
+        if digest is None:
+            h = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    h.update(chunk)
+            digest = h.hexdigest()
+            self._digests[sig] = digest
+        return digest
+
+    def key(self, video_path, bbox_shift):
+        raw = f"{self._file_digest(video_path)}:{int(bbox_shift)}:{self.version_tag}"
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get(self, key):
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self._touch(key)
+            self.hits += 1
+            return self._memory[key]
+
+        entry_dir = self.root / key
+        if not (entry_dir / 'meta.json').exists():
+            self.misses += 1
+            return None
+        try:
+            prepared = self._load(entry_dir)
+        except Exception:
+            logger.exception("Entrée avatar préparé illisible, suppression: %s", key)
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            self.misses += 1
+            return None
+        self._touch(key)
+        self._remember(key, prepared)
+        self.hits += 1
+        return prepared
+
+    def put(self, key, prepared):
+        self._remember(key, prepared)
+        tmp_dir = self.root / f".{key}.tmp-{os.getpid()}"
+        try:
+            self._dump(tmp_dir, prepared)
+            os.replace(tmp_dir, self.root / key)
+        except OSError:
+            # Une autre écriture a gagné la course (dossier déjà présent)
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        for entry_dir in self.root.iterdir():
+            if entry_dir.name.startswith('.'):
+                continue
+            size = sum(p.stat().st_size for p in entry_dir.rglob('*') if p.is_file())
+            meta = entry_dir / 'meta.json'
+            last_used = meta.stat().st_mtime if meta.exists() else 0
+            entries.append((last_used, size, entry_dir))
+            total += size
+        for _, size, entry_dir in sorted(entries):
+            if total <= self.budget_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            self._memory.pop(entry_dir.name, None)
+            total -= size
+            logger.info("🗑️ Avatar préparé évincé: %s (%d octets)", entry_dir.name[:12], size)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'memory_entries': len(self._memory)}
+
+    def _remember(self, key, prepared):
+        self._memory[key] = prepared
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _touch(self, key):
+        try:
+            os.utime(self.root / key / 'meta.json')
+        except OSError:
+            pass
+
+    def _dump(self, entry_dir, prepared):
+        import cv2
+        import torch
+
+        frames_dir = entry_dir / 'frames'
+        frames_dir.mkdir(parents=True, exist_ok=True)
+        for i, frame in enumerate(prepared['frames']):
+            cv2.imwrite(str(frames_dir / f"{i:08d}.png"), frame)
+        with open(entry_dir / 'coords.pkl', 'wb') as f:
+            pickle.dump(prepared['coords'], f)
+        with open(entry_dir / 'masks.pkl', 'wb') as f:
+            pickle.dump(prepared['masks'], f)
+        torch.save([latent.cpu() for latent in prepared['latents']], entry_dir / 'latents.pt')
+        with open(entry_dir / 'meta.json', 'w', encoding='utf-8') as f:
+            json.dump({'fps': prepared['fps'], 'frames': len(prepared['frames']),
+                       'version': self.version_tag, 'created_at': time.time()}, f)
+
+    def _load(self, entry_dir):
+        import torch
+        from musetalk.utils.preprocessing import read_imgs
+
+        with open(entry_dir / 'meta.json', encoding='utf-8') as f:
+            meta = json.load(f)
+        frame_paths = sorted(str(p) for p in (entry_dir / 'frames').glob('*.png'))
+        with open(entry_dir / 'coords.pkl', 'rb') as f:
+            coords = pickle.load(f)
+        with open(entry_dir / 'masks.pkl', 'rb') as f:
+            masks = pickle.load(f)
+        latents = torch.load(entry_dir / 'latents.pt')
+        return {
+            'frames': read_imgs(frame_paths),
+            'coords': coords,
+            'latents': latents,
+            'masks': masks,
+            'fps': meta['fps'],
+        }
+
+
+def _serve(args):
+    authkey = bytes.fromhex(os.environ['MUSETALK_WORKER_AUTHKEY'])
+    sys.path.insert(0, os.getcwd())  # modules `musetalk.*` du dépôt MuseTalk
+
+    t0 = time.time()
+    models = _Models(args)
+    logger.info("Modèles MuseTalk chargés en %.2fs", time.time() - t0)
+
+    # La création de la socket vaut signal « ready »
+    with Listener(args.socket, family='AF_UNIX', authkey=authkey) as listener:
+        while True:
+            conn = listener.accept()
+            try:
+                while True:
+                    msg = conn.recv()
+                    op = msg.get('op')
+                    if op == 'ping':
+                        conn.send({'ok': True, 'pid': os.getpid(), 'prepared': models.prepared.stats()})
+                    elif op == 'infer':
+                        start = time.time()
+                        try:
+                            result = models.infer(msg)
+                            conn.send(dict(result, ok=True, duration=time.time() - start))
+                        except Exception as e:
+                            logger.exception("Erreur inférence")
+                            conn.send({'ok': False, 'error': f'{type(e).__name__}: {e}'})
+                    elif op == 'shutdown':
+                        conn.send({'ok': True})
+                        return
+                    else:
+                        conn.send({'ok': False, 'error': f'unknown op {op!r}'})
+            except EOFError:
+                pass  # le backend s'est déconnecté, on attend le suivant
+            finally:
+                conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker MuseTalk persistant")
+    parser.add_argument('--socket', required=True)
+    parser.add_argument('--result_dir', default='./results')
+    parser.add_argument('--unet_model_path', default='models/musetalkV15/unet.pth')
+    parser.add_argument('--unet_config', default='models/musetalkV15/musetalk.json')
+    parser.add_argument('--whisper_dir', default='./models/whisper')
+    parser.add_argument('--vae_type', default='sd-vae')
+    parser.add_argument('--version', default='v15', choices=['v1', 'v15'])
+    parser.add_argument('--ffmpeg_path', default='/usr/bin/ffmpeg')
+    parser.add_argument('--gpu_id', type=int, default=0)
+    parser.add_argument('--fps', type=int, default=25)
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--use_float16', action='store_true')
+    parser.add_argument('--extra_margin', type=int, default=10)
+    parser.add_argument('--parsing_mode', default='jaw')
+    parser.add_argument('--left_cheek_width', type=int, default=90)
+    parser.add_argument('--right_cheek_width', type=int, default=90)
+    parser.add_argument('--audio_padding_length_left', type=int, default=2)
+    parser.add_argument('--audio_padding_length_right', type=int, default=2)
+    parser.add_argument('--prepared_dir', default='./results/prepared')
+    parser.add_argument('--prepared_budget_mb', type=int, default=5120)
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s [%(levelname)s] musetalk_worker: %(message)s',
+        handlers=[logging.StreamHandler(sys.stdout)]
+    )
+    _serve(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,7 @@
-import { useState, useRef, useCallback } from 'react';
+import { useState, useRef, useCallback, useEffect } from 'react';
 import { toast } from 'sonner';
 import { io, Socket } from 'socket.io-client';
+import { dataUrlToBlob, uploadBlob } from '@/utils/socketUpload';
 
 interface UseLocalWebSocketProps {
   onConnect?: () => void;
@@ -27,6 +28,36 @@ export const useLocalWebSocket = ({
   const audioContextRef = useRef<AudioContext | null>(null);
   const mediaStreamRef = useRef<MediaStream | null>(null);
   const mediaRecorderRef = useRef<MediaRecorder | null>(null);
+  // avatar_id renvoyé par le backend : évite de renvoyer l'avatar à chaque tour
+  const avatarIdRef = useRef<string | null>(null);
+  // Upload de l'avatar en cours : partagé par les morceaux audio qui arrivent entre-temps
+  const avatarUploadRef = useRef<Promise<string> | null>(null);
+
+  useEffect(() => {
+    avatarIdRef.current = null;
+    avatarUploadRef.current = null;
+  }, [avatarData]);
+
+  // L'avatar est enregistré dès la fin de son upload : l'avatar_id est connu
+  // sans attendre qu'un tour atteigne l'étape avatar
+  const ensureAvatarId = useCallback(async (socket: Socket): Promise<string | undefined> => {
+    if (avatarIdRef.current) return avatarIdRef.current;
+    if (!avatarData) return undefined;
+    if (!avatarUploadRef.current) {
+      const pending = (async () => {
+        const ack = await uploadBlob(socket, await dataUrlToBlob(avatarData), 'avatar', 'avatar.mp4');
+        if (!ack.avatar_id) throw new Error('avatar_id manquant dans upload_finish');
+        avatarIdRef.current = ack.avatar_id;
+        return ack.avatar_id;
+      })();
+      avatarUploadRef.current = pending;
+      // Échec : le prochain morceau retentera l'upload
+      pending.catch(() => {
+        if (avatarUploadRef.current === pending) avatarUploadRef.current = null;
+      });
+    }
+    return avatarUploadRef.current;
+  }, [avatarData]);
 
   const startMicrophone = async () => {
     try {
@@ -50,15 +81,11 @@ export const useLocalWebSocket = ({
       
       mediaRecorder.ondataavailable = async (event) => {
         if (event.data.size > 0 && socketRef.current?.connected) {
-          // Convert blob to base64
-          const reader = new FileReader();
-          reader.onloadend = () => {
-            const base64Audio = reader.result as string;
-            // Retirer le préfixe "data:audio/webm;base64," pour envoyer uniquement les données base64
-            const base64Data = base64Audio.split(',')[1] || base64Audio;
-            sendAudioToBackend(base64Data);
-          };
-          reader.readAsDataURL(event.data);
+          // Upload binaire par morceaux (plus de base64)
+          sendAudioToBackend(event.data).catch((error) => {
+            console.error('❌ Audio upload failed:', error);
+            onError?.(error);
+          });
         }
       };
       
@@ -86,11 +113,17 @@ export const useLocalWebSocket = ({
     }
   };
 
-  const sendAudioToBackend = useCallback((audioBase64: string) => {
-    if (socketRef.current?.connected && (avatarData || avatarUrl)) {
-      socketRef.current.emit('chat_with_avatar', {
-        audio_data: audioBase64,
-        avatar_data: avatarData,
+  const sendAudioToBackend = useCallback(async (audio: Blob) => {
+    const socket = socketRef.current;
+    if (socket?.connected && (avatarData || avatarUrl)) {
+      // L'avatar n'est envoyé qu'une fois : ensuite seul son avatar_id circule
+      const [avatarId, audioUpload] = await Promise.all([
+        ensureAvatarId(socket),
+        uploadBlob(socket, audio, 'audio', 'voice.webm'),
+      ]);
+      socket.emit('chat_with_avatar', {
+        audio_upload_id: audioUpload.upload_id,
+        avatar_id: avatarId,
         avatar_url: avatarUrl,
         voice_provider: 'elevenlabs',
         voice_id: 'EXAVITQu4vr4xnSDxMaL',
@@ -98,7 +131,7 @@ export const useLocalWebSocket = ({
         bbox_shift: 0
       });
     }
-  }, [avatarData, avatarUrl]);
+  }, [avatarData, avatarUrl, ensureAvatarId, onError]);
 
   const connect = useCallback(async () => {
     try {
@@ -150,11 +183,26 @@ export const useLocalWebSocket = ({
         onMessage?.({ type: 'transcription', ...data });
       });
 
+      socket.on('ai_response_delta', (data) => {
+        onMessage?.({ type: 'ai_response_delta', ...data });
+      });
+
       socket.on('ai_response', (data) => {
         console.log('🤖 AI Response:', data);
         onMessage?.({ type: 'ai_response', ...data });
       });
 
+      socket.on('chat_segment', (data) => {
+        console.log(`🎬 Segment ${data.index + 1}:`, data);
+        onMessage?.({ type: 'segment', ...data });
+      });
+
+      // Tous les segments du tour sont arrivés
+      socket.on('chat_segments_done', (data) => {
+        console.log(`🎬 ${data.total} segment(s)`);
+        onMessage?.({ type: 'segments_done', ...data });
+      });
+
       socket.on('chat_result', (data) => {
         console.log('✅ Chat result:', data);
         setIsSpeaking(false);
@@ -167,7 +215,28 @@ export const useLocalWebSocket = ({
         }
       });
 
+      // Copie vers le front terminée : URL publique définitive de la vidéo
+      socket.on('video_published', (data) => {
+        console.log('📤 Video published:', data);
+        onMessage?.({ type: 'published', ...data });
+      });
+
+      socket.on('avatar_registered', (data) => {
+        console.log('🆔 Avatar registered:', data.avatar_id);
+        avatarIdRef.current = data.avatar_id;
+      });
+
       socket.on('error', (error) => {
+        if (error?.code === 'avatar_not_found') {
+          avatarIdRef.current = null;
+          avatarUploadRef.current = null;
+        }
+        // Enregistrement sans parole : rien n'a été envoyé à l'IA, pas une vraie erreur
+        if (error?.code === 'no_speech') {
+          setIsSpeaking(false);
+          toast.info(error.message || 'Aucune parole détectée');
+          return;
+        }
         console.error('❌ Backend error:', error);
         setIsSpeaking(false);
         onError?.(error);
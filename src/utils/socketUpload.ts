@@ -0,0 +1,96 @@
+import type { Socket } from 'socket.io-client';
+
+// Protocole d'upload binaire par morceaux du backend (voir musetalk_upload.py) :
+// upload_begin → upload_chunk (acquitté un par un) → upload_finish.
+// En cas de coupure, on reprend au dernier offset acquitté avec le même upload_id.
+
+export type UploadKind = 'audio' | 'avatar';
+
+export interface UploadAck {
+  ok: boolean;
+  upload_id?: string;
+  avatar_id?: string;
+  received?: number;
+  chunk_size?: number;
+  complete?: boolean;
+  sha256?: string | null;
+  error?: string;
+  code?: string;
+}
+
+const ACK_TIMEOUT_MS = 15000;
+const MAX_RETRIES = 5;
+
+const sleep = (ms: number) => new Promise((resolve) => setTimeout(resolve, ms));
+
+const waitForConnection = (socket: Socket) =>
+  new Promise<void>((resolve) => {
+    if (socket.connected) return resolve();
+    socket.once('connect', () => resolve());
+  });
+
+async function request(socket: Socket, event: string, payload: Record<string, unknown>): Promise<UploadAck> {
+  await waitForConnection(socket);
+  return socket.timeout(ACK_TIMEOUT_MS).emitWithAck(event, payload);
+}
+
+/**
+ * Envoie `blob` au backend en morceaux binaires et retourne l'acquittement de
+ * upload_finish : `upload_id` à passer à chat_with_avatar (audio_upload_id),
+ * et pour un avatar son `avatar_id`, déjà enregistré côté backend.
+ */
+export async function uploadBlob(
+  socket: Socket,
+  blob: Blob,
+  kind: UploadKind,
+  filename: string,
+  onProgress?: (received: number, total: number) => void
+): Promise<UploadAck & { upload_id: string }> {
+  const begin = await request(socket, 'upload_begin', {
+    kind,
+    size: blob.size,
+    filename,
+    mimetype: blob.type || undefined,
+  });
+  if (!begin.ok || !begin.upload_id) {
+    throw new Error(begin.error || 'upload_begin refusé');
+  }
+  const uploadId = begin.upload_id;
+  const chunkSize = begin.chunk_size ?? 256 * 1024;
+  let offset = begin.received ?? 0;
+  let retries = 0;
+
+  while (offset < blob.size) {
+    const data = await blob.slice(offset, offset + chunkSize).arrayBuffer();
+    let ack: UploadAck;
+    try {
+      ack = await request(socket, 'upload_chunk', { upload_id: uploadId, offset, data });
+    } catch (error) {
+      // Timeout / déconnexion : on redemande au serveur ce qu'il a déjà reçu
+      if (++retries > MAX_RETRIES) throw error;
+      await sleep(500 * retries);
+      const status = await request(socket, 'upload_status', { upload_id: uploadId }).catch(() => null);
+      if (status?.ok && typeof status.received === 'number') offset = status.received;
+      continue;
+    }
+    if (!ack.ok && ack.code !== 'offset_mismatch') {
+      throw new Error(ack.error || 'upload_chunk refusé');
+    }
+    // offset_mismatch : le serveur indique où reprendre
+    offset = ack.received ?? offset;
+    retries = 0;
+    onProgress?.(offset, blob.size);
+  }
+
+  const finish = await request(socket, 'upload_finish', { upload_id: uploadId });
+  if (!finish.ok) {
+    throw new Error(finish.error || 'upload_finish refusé');
+  }
+  return { ...finish, upload_id: uploadId };
+}
+
+/** `data:` URL (avatar déjà chargé en mémoire) → Blob, sans repasser par le base64 côté réseau. */
+export async function dataUrlToBlob(dataUrl: string): Promise<Blob> {
+  const response = await fetch(dataUrl);
+  return response.blob();
+}